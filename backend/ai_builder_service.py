@@ -6,8 +6,10 @@ import os
 import json
 import re
 import logging
-from typing import Dict, List
-from openai import AsyncOpenAI
+from typing import AsyncIterator, Dict, List
+from services.llm_clients import llm_clients
+from services.generation_cache import generation_cache
+from parallel_generator import ParallelAppGenerator, stream_app
 from dotenv import load_dotenv
 import asyncio
 
@@ -15,11 +17,16 @@ load_dotenv()
 logger = logging.getLogger(__name__)
 
 class AIBuilderService:
+    BUILDER_VERSION = "v1"
+    MODEL = "gpt-4o"
+
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
-        self.client = AsyncOpenAI(api_key=self.api_key)
+        # GENERATION_MODE: "parallel" (plan, then files concurrently) or "single" (one JSON response)
+        self.parallel = os.getenv("GENERATION_MODE", "parallel").lower() == "parallel"
+        self.cache_version = f"{self.BUILDER_VERSION}-parallel" if self.parallel else self.BUILDER_VERSION
 
     def _generate_readme(self, app_structure: Dict, tech_stack: Dict[str, str]) -> str:
         """Generate README for the project"""
@@ -224,9 +231,84 @@ FRONTEND_URL=http://localhost:3000
                 "language": "env"
             })
 
-    async def generate_app_structure(self, prompt: str, tech_stack: Dict[str, str]) -> Dict:
-        """Generate complete application structure from prompt"""
-        
+    async def generate_app_structure(self, prompt: str, tech_stack: Dict[str, str], use_cache: bool = True) -> Dict:
+        """Generate complete application structure from prompt
+
+        Identical requests (normalised prompt + tech stack) are served from the generation cache.
+        use_cache=False skips the lookup but still refreshes the cached entry; fallback templates are never cached.
+        """
+        cache_key = generation_cache.make_key(prompt, tech_stack, self.cache_version, self.MODEL)
+        if use_cache:
+            cached = await generation_cache.get(cache_key)
+            if cached:
+                logger.info(f"Generation cache hit for prompt: {prompt}")
+                return cached
+
+        try:
+            app_structure = await self._generate_with_model(prompt, tech_stack)
+        except Exception as e:
+            logger.error(f"AI generation error: {e}")
+            return self._get_fallback_template(prompt, tech_stack)
+
+        if not app_structure.get("errors"):
+            await generation_cache.set(cache_key, app_structure)
+        return app_structure
+
+    async def stream_app_structure(
+        self, prompt: str, tech_stack: Dict[str, str], use_cache: bool = True
+    ) -> AsyncIterator[Dict]:
+        """Streaming variant of generate_app_structure (events as in parallel_generator.stream_app)"""
+        cache_key = generation_cache.make_key(prompt, tech_stack, self.cache_version, self.MODEL)
+        async for event in stream_app(
+            cache_key,
+            use_cache,
+            self._parallel_generator() if self.parallel else None,
+            prompt,
+            self._plan_context(tech_stack),
+            model_stream=lambda: llm_clients.stream_chat_completion(
+                api_key=self.api_key,
+                model=self.MODEL,
+                messages=self._build_messages(prompt, tech_stack),
+                temperature=0.8,
+                max_tokens=16000
+            ),
+            finalize=lambda text: self._finalize_response(text.strip(), tech_stack),
+            post_process=lambda structure: self._post_process(structure, tech_stack),
+            fallback=lambda: self._get_fallback_template(prompt, tech_stack),
+        ):
+            yield event
+
+    def _parallel_generator(self) -> ParallelAppGenerator:
+        return ParallelAppGenerator(api_key=self.api_key, model=self.MODEL)
+
+    def _plan_context(self, tech_stack: Dict[str, str]) -> str:
+        return f"""Tech Stack:
+- Frontend: {tech_stack.get('frontend', 'React')}
+- Backend: {tech_stack.get('backend', 'FastAPI')}
+- Database: {tech_stack.get('database', 'MongoDB')}
+Use React Router only for multi-page apps. Use real, domain-specific content and modern responsive CSS."""
+
+    async def _generate_with_model(self, prompt: str, tech_stack: Dict[str, str]) -> Dict:
+        """Call the model and post-process its files; raises on any generation failure"""
+        if self.parallel:
+            app_structure = await self._parallel_generator().generate(prompt, self._plan_context(tech_stack))
+            return self._post_process(app_structure, tech_stack)
+
+        logger.info(f"Generating app for prompt: {prompt}")
+
+        response = await llm_clients.chat_completion(
+            api_key=self.api_key,
+            model=self.MODEL,
+            messages=self._build_messages(prompt, tech_stack),
+            temperature=0.8,
+            max_tokens=16000  # Increased for complex multi-page apps
+        )
+
+        response_text = response.choices[0].message.content.strip()
+        logger.info(f"Received response, length: {len(response_text)}")
+        return self._finalize_response(response_text, tech_stack)
+
+    def _build_messages(self, prompt: str, tech_stack: Dict[str, str]) -> List[Dict]:
         system_prompt = f"""You are a WORLD-CLASS full-stack developer who builds UNIQUE, TAILORED applications.
 
 CRITICAL: Analyze the user's request and build EXACTLY what they ask for. Don't use a template!
@@ -328,22 +410,14 @@ If it's e-commerce: Product catalog, product details, cart, checkout, user accou
 
 Return ONLY valid JSON with complete, working code for all files."""
 
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _finalize_response(self, response_text: str, tech_stack: Dict[str, str]) -> Dict:
+        """Parse the model's JSON and post-process it"""
         try:
-            logger.info(f"Generating app for prompt: {prompt}")
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.8,
-                max_tokens=16000  # Increased for complex multi-page apps
-            )
-            
-            response_text = response.choices[0].message.content.strip()
-            logger.info(f"Received response, length: {len(response_text)}")
-            
             # Clean response if needed
             if "```json" in response_text:
                 response_text = response_text.split("```json")[1].split("```")[0].strip()
@@ -352,48 +426,47 @@ Return ONLY valid JSON with complete, working code for all files."""
             
             # Parse JSON
             app_structure = json.loads(response_text)
-            
-            # Validate structure
-            if not app_structure.get('files'):
-                raise ValueError("No files generated in response")
-            
-            # Ensure package.json exists
-            has_package_json = any(f['path'].endswith('package.json') for f in app_structure['files'])
-            has_router = any('react-router' in f.get('content', '').lower() or 'BrowserRouter' in f.get('content', '') 
-                           for f in app_structure['files'])
-            
-            if not has_package_json:
-                app_structure['files'].append({
-                    "path": "frontend/package.json",
-                    "content": self._generate_package_json(app_structure.get('app_name', 'generated-app'), has_router=has_router),
-                    "language": "json"
-                })
-            
-            # AUTO-INJECT MISSING DEPENDENCIES (CRITICAL FIX)
-            print("\n🔍 Scanning for missing dependencies...")
-            app_structure['files'] = self._auto_inject_dependencies(app_structure['files'])
-            
-            # Add deployment configs if not present
-            self._add_deployment_configs(app_structure, tech_stack)
-            
-            # Add README if not present
-            if not any(f['path'].endswith('README.md') for f in app_structure['files']):
-                app_structure['files'].append({
-                    "path": "README.md",
-                    "content": self._generate_readme(app_structure, tech_stack),
-                    "language": "markdown"
-                })
-            
-            logger.info(f"Successfully generated app with {len(app_structure['files'])} files")
-            return app_structure
-            
         except json.JSONDecodeError as e:
             logger.error(f"JSON parsing error: {e}")
             logger.error(f"Response text: {response_text[:500]}")
-            return self._get_fallback_template(prompt, tech_stack)
-        except Exception as e:
-            logger.error(f"AI generation error: {e}")
-            return self._get_fallback_template(prompt, tech_stack)
+            raise
+        return self._post_process(app_structure, tech_stack)
+
+    def _post_process(self, app_structure: Dict, tech_stack: Dict[str, str]) -> Dict:
+        """Add package.json, missing dependencies, deployment configs and README"""
+        # Validate structure
+        if not app_structure.get('files'):
+            raise ValueError("No files generated in response")
+        
+        # Ensure package.json exists
+        has_package_json = any(f['path'].endswith('package.json') for f in app_structure['files'])
+        has_router = any('react-router' in f.get('content', '').lower() or 'BrowserRouter' in f.get('content', '') 
+                       for f in app_structure['files'])
+        
+        if not has_package_json:
+            app_structure['files'].append({
+                "path": "frontend/package.json",
+                "content": self._generate_package_json(app_structure.get('app_name', 'generated-app'), has_router=has_router),
+                "language": "json"
+            })
+        
+        # AUTO-INJECT MISSING DEPENDENCIES (CRITICAL FIX)
+        print("\n🔍 Scanning for missing dependencies...")
+        app_structure['files'] = self._auto_inject_dependencies(app_structure['files'])
+        
+        # Add deployment configs if not present
+        self._add_deployment_configs(app_structure, tech_stack)
+        
+        # Add README if not present
+        if not any(f['path'].endswith('README.md') for f in app_structure['files']):
+            app_structure['files'].append({
+                "path": "README.md",
+                "content": self._generate_readme(app_structure, tech_stack),
+                "language": "markdown"
+            })
+        
+        logger.info(f"Successfully generated app with {len(app_structure['files'])} files")
+        return app_structure
 
     def _get_fallback_template(self, prompt: str, tech_stack: Dict[str, str]) -> Dict:
         """Fallback template if AI generation fails"""
@@ -6,8 +6,10 @@ import os
 import json
 import re
 import logging
-from typing import Dict, List
-from openai import AsyncOpenAI
+from typing import AsyncIterator, Dict, List
+from services.llm_clients import llm_clients
+from services.generation_cache import generation_cache
+from parallel_generator import ParallelAppGenerator, stream_app
 from dotenv import load_dotenv
 import asyncio
 
@@ -16,12 +18,17 @@ logger = logging.getLogger(__name__)
 
 class AIBuilderServiceV2:
     """Enhanced AI Builder that generates production-ready applications"""
-    
+
+    BUILDER_VERSION = "v2"
+    MODEL = "gpt-4o"
+
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
-        self.client = AsyncOpenAI(api_key=self.api_key)
+        # GENERATION_MODE: "parallel" (plan, then files concurrently) or "single" (one JSON response)
+        self.parallel = os.getenv("GENERATION_MODE", "parallel").lower() == "parallel"
+        self.cache_version = f"{self.BUILDER_VERSION}-parallel" if self.parallel else self.BUILDER_VERSION
         
         # API Integration Templates
         self.api_templates = {
@@ -271,12 +278,92 @@ const api = {
             }
         }
     
-    async def generate_app_structure(self, prompt: str, tech_stack: Dict[str, str]) -> Dict:
-        """Generate COMPLETE working application with backend + frontend"""
-        
+    async def generate_app_structure(self, prompt: str, tech_stack: Dict[str, str], use_cache: bool = True) -> Dict:
+        """Generate COMPLETE working application with backend + frontend
+
+        Identical requests are served from the generation cache; use_cache=False forces a fresh generation.
+        """
+        cache_key = generation_cache.make_key(prompt, tech_stack, self.cache_version, self.MODEL)
+        if use_cache:
+            cached = await generation_cache.get(cache_key)
+            if cached:
+                logger.info(f"Generation cache hit for: {prompt}")
+                return cached
+
         # Detect what integrations are needed based on prompt
         integrations = self._detect_required_integrations(prompt)
-        
+
+        try:
+            app_data = await self._generate_with_model(prompt, integrations)
+        except Exception as e:
+            logger.error(f"Error generating app: {e}")
+            return self._generate_fallback_app(prompt, integrations)
+
+        if not app_data.get("errors"):
+            await generation_cache.set(cache_key, app_data)
+        return app_data
+
+    async def stream_app_structure(
+        self, prompt: str, tech_stack: Dict[str, str], use_cache: bool = True
+    ) -> AsyncIterator[Dict]:
+        """Streaming variant of generate_app_structure (events as in parallel_generator.stream_app)"""
+        cache_key = generation_cache.make_key(prompt, tech_stack, self.cache_version, self.MODEL)
+        integrations = self._detect_required_integrations(prompt)
+        async for event in stream_app(
+            cache_key,
+            use_cache,
+            self._parallel_generator() if self.parallel else None,
+            prompt,
+            self._plan_context(integrations),
+            model_stream=lambda: llm_clients.stream_chat_completion(
+                api_key=self.api_key,
+                model=self.MODEL,
+                messages=self._build_messages(prompt, integrations),
+                temperature=0.7,
+                max_tokens=4000
+            ),
+            finalize=lambda text: self._finalize_response(text, integrations),
+            post_process=lambda app_data: self._post_process(app_data, integrations),
+            fallback=lambda: self._generate_fallback_app(prompt, integrations),
+        ):
+            yield event
+
+    def _parallel_generator(self) -> ParallelAppGenerator:
+        return ParallelAppGenerator(api_key=self.api_key, model=self.MODEL)
+
+    def _plan_context(self, integrations: List[str]) -> str:
+        lines = [
+            "Generate a FastAPI backend (backend/main.py, backend/requirements.txt) and a React frontend,",
+            "plus .env.example with every required environment variable.",
+        ]
+        for integration in integrations:
+            template = self.api_templates.get(integration)
+            if template:
+                lines.append(
+                    f"Integration {integration}: env vars {', '.join(template['env_vars'])}; "
+                    f"backend deps {', '.join(template['dependencies']['backend']) or 'none'}"
+                )
+        return "\n".join(lines)
+
+    async def _generate_with_model(self, prompt: str, integrations: List[str]) -> Dict:
+        """Call the model and inject integrations; raises on any generation failure"""
+        if self.parallel:
+            app_data = await self._parallel_generator().generate(prompt, self._plan_context(integrations))
+            return self._post_process(app_data, integrations)
+
+        logger.info(f"Generating enhanced app structure for: {prompt}")
+        logger.info(f"Detected integrations: {integrations}")
+
+        response = await llm_clients.chat_completion(
+            api_key=self.api_key,
+            model=self.MODEL,
+            messages=self._build_messages(prompt, integrations),
+            temperature=0.7,
+            max_tokens=4000
+        )
+        return self._finalize_response(response.choices[0].message.content, integrations)
+
+    def _build_messages(self, prompt: str, integrations: List[str]) -> List[Dict]:
         system_prompt = f"""You are an ELITE full-stack developer building PRODUCTION-READY applications.
 
 🎯 USER REQUEST: {prompt}
@@ -340,41 +427,32 @@ const api = {
 
 NOW BUILD A COMPLETE, WORKING APPLICATION!"""
 
-        try:
-            logger.info(f"Generating enhanced app structure for: {prompt}")
-            logger.info(f"Detected integrations: {integrations}")
-            
-            response = await self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Build this: {prompt}"}
-                ],
-                temperature=0.7,
-                max_tokens=4000
-            )
-            
-            content = response.choices[0].message.content
-            logger.info(f"GPT-4o response length: {len(content)} chars")
-            
-            # Parse JSON response
-            json_match = re.search(r'\{.*\}', content, re.DOTALL)
-            if json_match:
-                app_data = json.loads(json_match.group())
-            else:
-                raise ValueError("No valid JSON in response")
-            
-            # Inject integration code
-            app_data = self._inject_integrations(app_data, integrations)
-            
-            # Add deployment files
-            app_data['files'].extend(self._generate_deployment_files(app_data))
-            
-            return app_data
-            
-        except Exception as e:
-            logger.error(f"Error generating app: {e}")
-            return self._generate_fallback_app(prompt, integrations)
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Build this: {prompt}"}
+        ]
+
+    def _finalize_response(self, content: str, integrations: List[str]) -> Dict:
+        """Parse the model's JSON and post-process it"""
+        logger.info(f"GPT-4o response length: {len(content)} chars")
+
+        # Parse JSON response
+        json_match = re.search(r'\{.*\}', content, re.DOTALL)
+        if json_match:
+            app_data = json.loads(json_match.group())
+        else:
+            raise ValueError("No valid JSON in response")
+        return self._post_process(app_data, integrations)
+
+    def _post_process(self, app_data: Dict, integrations: List[str]) -> Dict:
+        """Add integration dependencies and deployment files"""
+        # Inject integration code
+        app_data = self._inject_integrations(app_data, integrations)
+
+        # Add deployment files
+        app_data['files'].extend(self._generate_deployment_files(app_data))
+
+        return app_data
     
     def _detect_required_integrations(self, prompt: str) -> List[str]:
         """Detect which API integrations are needed"""
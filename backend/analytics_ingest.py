@@ -0,0 +1,367 @@
+"""
+Analytics Ingest
+Public, write-key authenticated intake for analytics sent by generated apps:
+NDJSON batches (optionally gzip-compressed) parsed into event and metric
+documents for AnalyticsService, plus the client beacon injected into generated
+frontends that batches a page session's events into one request.
+"""
+import hashlib
+import json
+import math
+import os
+import secrets
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+MAX_BODY_BYTES = int(os.getenv("ANALYTICS_INGEST_MAX_BYTES", str(1024 * 1024)))
+# Decompressed size cap, so a small gzip bomb cannot expand without bound
+MAX_DECODED_BYTES = int(os.getenv("ANALYTICS_INGEST_MAX_DECODED_BYTES", str(8 * 1024 * 1024)))
+MAX_RECORDS = int(os.getenv("ANALYTICS_INGEST_MAX_RECORDS", "1000"))
+# Client timestamps are honoured within this window; anything else gets the receive time
+MAX_CLIENT_AGE = timedelta(hours=24)
+MAX_CLIENT_AHEAD = timedelta(minutes=5)
+
+MAX_NAME_LENGTH = 64
+MAX_USER_ID_LENGTH = 128
+# An event's free-form `data` is stored as sent, so its encoded size and nesting are bounded
+MAX_DATA_BYTES = int(os.getenv("ANALYTICS_INGEST_MAX_DATA_BYTES", "4096"))
+MAX_DATA_DEPTH = int(os.getenv("ANALYTICS_INGEST_MAX_DATA_DEPTH", "4"))
+
+WRITE_KEY_PREFIX = "wk_"
+
+
+class IngestRejected(Exception):
+    """A batch refused as a whole; carries the HTTP status to answer with"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def generate_write_key() -> str:
+    return WRITE_KEY_PREFIX + secrets.token_urlsafe(24)
+
+
+def hash_write_key(key: str) -> str:
+    """Projects store only this digest; the key itself lives in the client code"""
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class WriteKeyCache:
+    """Bounded TTL cache of write-key digest -> project_id (None caches an unknown key)"""
+
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key_hash: str) -> Tuple[bool, Optional[str]]:
+        """(found, project_id)"""
+        entry = self._entries.get(key_hash)
+        if entry is None or entry[0] <= time.monotonic():
+            self._entries.pop(key_hash, None)
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key_hash)
+        self.hits += 1
+        return True, entry[1]
+
+    def set(self, key_hash: str, project_id: Optional[str]) -> None:
+        if self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return
+        self._entries[key_hash] = (time.monotonic() + self.ttl_seconds, project_id)
+        self._entries.move_to_end(key_hash)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate_project(self, project_id: str) -> None:
+        for key_hash in [k for k, (_, pid) in self._entries.items() if pid == project_id]:
+            del self._entries[key_hash]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class IngestRateLimiter:
+    """
+    Token bucket per project write key, counted in records
+
+    A batch is refused only when its key's bucket is already empty; an accepted
+    batch is then charged in full and may leave the bucket in debt, so a key
+    cannot get past the limit with one large batch. Buckets are per worker process.
+    """
+
+    def __init__(self, records_per_second: float = 200.0, burst: float = 2000.0, max_entries: int = 10000):
+        self.records_per_second = records_per_second
+        self.burst = burst
+        self.max_entries = max_entries
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.limited = 0
+
+    def _tokens(self, key: str, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.records_per_second)
+
+    def retry_after(self, key: str) -> Optional[float]:
+        """Seconds until `key` may send again, or None if it may send now"""
+        if self.records_per_second <= 0:
+            return None
+        tokens = self._tokens(key, time.monotonic())
+        if tokens >= 1:
+            return None
+        self.limited += 1
+        return (1 - tokens) / self.records_per_second
+
+    def charge(self, key: str, records: int) -> None:
+        if self.records_per_second <= 0:
+            return
+        now = time.monotonic()
+        self._buckets[key] = (self._tokens(key, now) - records, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_entries:
+            self._buckets.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"keys": len(self._buckets), "limited": self.limited, "records_per_second": self.records_per_second}
+
+
+async def read_body(
+    stream: AsyncIterator[bytes],
+    content_encoding: Optional[str] = None,
+    max_bytes: int = MAX_BODY_BYTES,
+    max_decoded: int = MAX_DECODED_BYTES
+) -> bytes:
+    """
+    Read and, if gzip-compressed, inflate a request body within size limits
+
+    sendBeacon cannot set Content-Encoding, so a body starting with the gzip magic
+    number is inflated even without the header.
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding not in ("identity", "gzip"):
+        raise IngestRejected(415, f"Unsupported Content-Encoding {encoding!r}; send gzip or identity")
+
+    raw = bytearray()
+    async for chunk in stream:
+        raw += chunk
+        if len(raw) > max_bytes:
+            raise IngestRejected(413, f"Batch exceeds {max_bytes} bytes")
+
+    if encoding != "gzip" and raw[:2] != b"\x1f\x8b":
+        return bytes(raw)
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        body = inflater.decompress(bytes(raw), max_decoded + 1)
+    except zlib.error:
+        raise IngestRejected(400, "Malformed gzip body")
+    if len(body) > max_decoded or inflater.unconsumed_tail:
+        raise IngestRejected(413, f"Batch exceeds {max_decoded} bytes once decompressed")
+    return body
+
+
+def _timestamp(value: Any, received_at: datetime) -> datetime:
+    """Client time (epoch milliseconds or ISO 8601) if plausible, else the receive time"""
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            ts = datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+        elif isinstance(value, str):
+            ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            ts = ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+        else:
+            return received_at
+    except (ValueError, OverflowError, OSError):
+        return received_at
+    if received_at - MAX_CLIENT_AGE <= ts <= received_at + MAX_CLIENT_AHEAD:
+        return ts
+    return received_at
+
+
+def _short_string(value: Any, limit: int) -> Optional[str]:
+    if value is None:
+        return None
+    if not isinstance(value, str) or not value or len(value) > limit:
+        raise ValueError("invalid string")
+    return value
+
+
+def _data_depth(value: Any, limit: int) -> int:
+    """Nesting depth of a JSON value, counting stops once it passes `limit`"""
+    if isinstance(value, dict):
+        children = value.values()
+    elif isinstance(value, list):
+        children = value
+    else:
+        return 0
+    depth = 1
+    for child in children:
+        if depth > limit:
+            break
+        depth = max(depth, 1 + _data_depth(child, limit - 1))
+    return depth
+
+
+def parse_records(
+    body: bytes,
+    project_id: str,
+    received_at: Optional[datetime] = None,
+    max_records: int = MAX_RECORDS
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], int]:
+    """
+    (events, metrics, invalid) from an NDJSON batch
+
+    Each line is either an event, {"type", "data"?, "user_id"?, "ts"?}, or a
+    measurement, {"metric", "value", "unit"?, "ts"?}. Malformed lines, and events
+    whose `data` exceeds MAX_DATA_BYTES or MAX_DATA_DEPTH, are counted and skipped
+    rather than failing the batch.
+    """
+    received_at = received_at or datetime.now(timezone.utc)
+    lines = [line for line in body.splitlines() if line.strip()]
+    if len(lines) > max_records:
+        raise IngestRejected(413, f"Batch has {len(lines)} records; at most {max_records} are accepted")
+
+    events: List[Dict[str, Any]] = []
+    metrics: List[Dict[str, Any]] = []
+    invalid = 0
+    for line in lines:
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("record is not an object")
+            created_at = _timestamp(record.get("ts"), received_at)
+            if "metric" in record:
+                value = record.get("value")
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                    raise ValueError("metric value is not a finite number")
+                name = _short_string(record["metric"], MAX_NAME_LENGTH)
+                if name is None:
+                    raise ValueError("metric name is missing")
+                metrics.append({
+                    "project_id": project_id,
+                    "metric_name": name,
+                    "value": float(value),
+                    "unit": _short_string(record.get("unit"), MAX_NAME_LENGTH) or "ms",
+                    "timestamp": created_at.isoformat(),
+                    "created_at": created_at
+                })
+            else:
+                data = record.get("data") or {}
+                if not isinstance(data, dict):
+                    raise ValueError("event data is not an object")
+                # The line bounds the encoded data, so only long lines need re-encoding
+                if len(line) > MAX_DATA_BYTES and len(json.dumps(data, separators=(",", ":"))) > MAX_DATA_BYTES:
+                    raise ValueError("event data is too large")
+                if _data_depth(data, MAX_DATA_DEPTH) > MAX_DATA_DEPTH:
+                    raise ValueError("event data is nested too deeply")
+                events.append({
+                    "project_id": project_id,
+                    "event_type": _short_string(record.get("type"), MAX_NAME_LENGTH) or "unknown",
+                    "data": data,
+                    "user_id": _short_string(record.get("user_id"), MAX_USER_ID_LENGTH),
+                    "timestamp": created_at.isoformat(),
+                    "created_at": created_at
+                })
+        except (ValueError, KeyError, TypeError, OverflowError, RecursionError):
+            invalid += 1
+    return events, metrics, invalid
+
+
+BEACON_MARKER = "/* analytics-beacon */"
+
+_BEACON_TEMPLATE = """
+/* analytics-beacon */
+// Batches this page session's analytics and sends them in one request when the page is hidden.
+// Use window.appAnalytics.track(type, data) and .metric(name, value, unit) from app code.
+(function () {
+  var endpoint = __ENDPOINT__;
+  var limit = 60000; // stay under the browser's keepalive/sendBeacon quota
+  var queue = [];
+  var size = 0;
+  var userId;
+  try {
+    userId = localStorage.getItem("app_analytics_uid");
+    if (!userId) {
+      userId = "anon-" + Math.random().toString(36).slice(2) + Date.now().toString(36);
+      localStorage.setItem("app_analytics_uid", userId);
+    }
+  } catch (e) {}
+
+  function push(record) {
+    var line = JSON.stringify(record);
+    if (size + line.length + 1 > limit) flush();
+    queue.push(line);
+    size += line.length + 1;
+  }
+
+  function flush() {
+    if (!queue.length) return;
+    // text/plain keeps the beacon a simple CORS request (no preflight)
+    var body = new Blob([queue.join("\\n")], { type: "text/plain" });
+    queue = [];
+    size = 0;
+    if (!(navigator.sendBeacon && navigator.sendBeacon(endpoint, body))) {
+      fetch(endpoint, { method: "POST", body: body, keepalive: true, mode: "no-cors" }).catch(function () {});
+    }
+  }
+
+  function track(type, data) {
+    push({ type: type, data: data || {}, user_id: userId, ts: Date.now() });
+  }
+
+  function metric(name, value, unit) {
+    push({ metric: name, value: value, unit: unit || "ms", ts: Date.now() });
+  }
+
+  var lcp;
+  try {
+    new PerformanceObserver(function (list) {
+      var entries = list.getEntries();
+      lcp = entries[entries.length - 1].startTime;
+    }).observe({ type: "largest-contentful-paint", buffered: true });
+  } catch (e) {}
+
+  var vitalsSent = false;
+  function onHidden() {
+    if (!vitalsSent) {
+      vitalsSent = true;
+      var nav = performance.getEntriesByType && performance.getEntriesByType("navigation")[0];
+      if (nav) metric("ttfb", nav.responseStart);
+      if (lcp !== undefined) metric("lcp", lcp);
+    }
+    flush();
+  }
+
+  document.addEventListener("visibilitychange", function () {
+    if (document.visibilityState === "hidden") onHidden();
+  });
+  window.addEventListener("pagehide", onHidden);
+  window.addEventListener("error", function (e) {
+    track("error", { message: String(e.message || ""), source: String(e.filename || "") });
+  });
+
+  track("page_view", { path: location.pathname, referrer: document.referrer });
+  window.appAnalytics = { track: track, metric: metric, flush: flush };
+})();
+"""
+
+
+def beacon_snippet(ingest_url: str, write_key: str) -> str:
+    separator = "&" if "?" in ingest_url else "?"
+    return _BEACON_TEMPLATE.replace("__ENDPOINT__", json.dumps(f"{ingest_url}{separator}key={write_key}"))
+
+
+def inject_beacon(files: List[Dict[str, Any]], ingest_url: str, write_key: str) -> bool:
+    """Append the beacon to the generated entry point (src/index.js[x]); False if there is none"""
+    for f in files:
+        path = f.get("path", "")
+        if path.endswith(("src/index.js", "src/index.jsx")):
+            content = f.get("content", "")
+            if BEACON_MARKER in content:
+                content = content[:content.index(BEACON_MARKER)].rstrip("\n") + "\n"
+            f["content"] = content.rstrip("\n") + "\n" + beacon_snippet(ingest_url, write_key)
+            return True
+    return False
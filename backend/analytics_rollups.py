@@ -0,0 +1,259 @@
+"""
+Analytics Rollups
+Minute / hour / day pre-aggregates of analytics events and performance metrics,
+updated incrementally on write. A time window is answered from the coarsest
+buckets that fit inside it (whole days in the middle, hours and then minutes at
+the edges), so reads touch a bounded number of small documents at any traffic.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from quantile_sketch import QuantileSketch
+
+GRANULARITIES = ("day", "hour", "minute")  # coarse to fine
+
+PERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+STEPS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# How long each granularity is kept (TTL on expires_at); day rollups are kept indefinitely
+RETENTION = {
+    "minute": timedelta(days=int(os.getenv("ANALYTICS_MINUTE_ROLLUP_DAYS", "3"))),
+    "hour": timedelta(days=int(os.getenv("ANALYTICS_HOUR_ROLLUP_DAYS", "90"))),
+    "day": None,
+}
+
+
+def floor_bucket(ts: datetime, granularity: str) -> datetime:
+    ts = ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+    if granularity == "day":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(second=0, microsecond=0)
+
+
+def ceil_bucket(ts: datetime, granularity: str) -> datetime:
+    floored = floor_bucket(ts, granularity)
+    return floored if floored == ts else floored + STEPS[granularity]
+
+
+def cover_window(start: datetime, end: datetime, now: Optional[datetime] = None) -> List[Tuple[str, datetime, datetime]]:
+    """
+    (granularity, from, to) bucket ranges covering [start, end)
+
+    Granularities already expired at `start` are skipped, so the edges round out to
+    the finest buckets still retained; the finest level always rounds outwards.
+    """
+    now = now or datetime.now(timezone.utc)
+    levels = [g for g in GRANULARITIES if RETENTION[g] is None or start >= now - RETENTION[g]]
+
+    def cover(lo: datetime, hi: datetime, remaining: List[str]) -> List[Tuple[str, datetime, datetime]]:
+        if lo >= hi:
+            return []
+        granularity = remaining[0]
+        if len(remaining) == 1:
+            return [(granularity, floor_bucket(lo, granularity), ceil_bucket(hi, granularity))]
+        inner_lo, inner_hi = ceil_bucket(lo, granularity), floor_bucket(hi, granularity)
+        if inner_lo >= inner_hi:
+            return cover(lo, hi, remaining[1:])
+        return cover(lo, inner_lo, remaining[1:]) + [(granularity, inner_lo, inner_hi)] + cover(inner_hi, hi, remaining[1:])
+
+    return cover(start, end, levels)
+
+
+def ranges_query(ranges: Iterable[Tuple[str, datetime, datetime]]) -> Dict[str, Any]:
+    return {"$or": [{"granularity": g, "bucket": {"$gte": lo, "$lt": hi}} for g, lo, hi in ranges]}
+
+
+# Distinct event types counted per bucket; further types are counted under OTHER_TYPE
+MAX_TYPES_PER_BUCKET = int(os.getenv("ANALYTICS_MAX_TYPES_PER_BUCKET", "100"))
+OTHER_TYPE = "other"
+
+BucketKey = Tuple[str, str, datetime]
+
+
+def field_key(name: Optional[str]) -> str:
+    """Event types become field names; Mongo forbids '.' and a leading '$'"""
+    return (name or "unknown").replace(".", "_").lstrip("$") or "unknown"
+
+
+def _expiry(bucket: datetime, granularity: str) -> Dict[str, Any]:
+    retention = RETENTION[granularity]
+    return {"expires_at": bucket + STEPS[granularity] + retention} if retention else {}
+
+
+def event_rollup_buckets(events: Iterable[Dict[str, Any]]) -> List[BucketKey]:
+    """(project_id, granularity, bucket) of every rollup document a batch of events touches"""
+    return list({
+        (event["project_id"], granularity, floor_bucket(event["created_at"], granularity))
+        for event in events
+        for granularity in GRANULARITIES
+    })
+
+
+def event_rollup_updates(
+    events: Iterable[Dict[str, Any]],
+    known_types: Optional[Dict[BucketKey, Iterable[str]]] = None
+) -> List[UpdateOne]:
+    """
+    Upserts adding a batch of events to their minute, hour and day buckets
+
+    Events sharing a bucket are coalesced into one $inc, so a flushed batch costs
+    a handful of writes rather than three per event. `known_types` holds the type
+    keys each bucket already counts; once a bucket has MAX_TYPES_PER_BUCKET, new
+    types go to OTHER_TYPE so a client inventing types cannot grow it without bound.
+    Concurrent flushes may each admit types up to the cap, so it can be overshot,
+    but only by a bounded amount.
+    """
+    known_types = known_types or {}
+    incs: Dict[BucketKey, Dict[str, int]] = {}
+    types: Dict[BucketKey, set] = {}
+    for event in events:
+        created_at = event["created_at"]
+        type_key = field_key(event.get("event_type"))
+        for granularity in GRANULARITIES:
+            bucket_key = (event["project_id"], granularity, floor_bucket(created_at, granularity))
+            inc = incs.setdefault(bucket_key, {})
+            counted = types.get(bucket_key)
+            if counted is None:
+                counted = types[bucket_key] = set(known_types.get(bucket_key, ()))
+            counted_as = type_key
+            if type_key not in counted:
+                if len(counted) < MAX_TYPES_PER_BUCKET:
+                    counted.add(type_key)
+                else:
+                    counted_as = OTHER_TYPE
+            keys = ["total", f"types.{counted_as}"]
+            if granularity == "day":
+                keys.append(f"hours.{floor_bucket(created_at, 'hour').hour}")
+            for key in keys:
+                inc[key] = inc.get(key, 0) + 1
+
+    updates = []
+    for (project_id, granularity, bucket), inc in incs.items():
+        update: Dict[str, Any] = {"$inc": inc}
+        expiry = _expiry(bucket, granularity)
+        if expiry:
+            update["$setOnInsert"] = expiry
+        updates.append(UpdateOne(
+            {"project_id": project_id, "granularity": granularity, "bucket": bucket},
+            update,
+            upsert=True
+        ))
+    return updates
+
+
+def user_rollup_updates(events: Iterable[Dict[str, Any]]) -> List[UpdateOne]:
+    """One (project, day, user) row per active user, for unique-user counts without raw events"""
+    first_seen: Dict[Tuple[str, datetime, str], datetime] = {}
+    for event in events:
+        if not event.get("user_id"):
+            continue
+        key = (event["project_id"], floor_bucket(event["created_at"], "day"), event["user_id"])
+        first_seen[key] = min(first_seen.get(key, event["created_at"]), event["created_at"])
+    return [
+        UpdateOne(
+            {"project_id": project_id, "day": day, "user_id": user_id},
+            {"$setOnInsert": {"first_seen": seen}},
+            upsert=True
+        )
+        for (project_id, day, user_id), seen in first_seen.items()
+    ]
+
+
+def metric_rollup_updates(metrics: Iterable[Dict[str, Any]]) -> List[UpdateOne]:
+    """
+    Upserts adding a batch of measurements to their minute, hour and day buckets,
+    coalesced per bucket; each bucket also carries a quantile sketch of its values
+    """
+    acc: Dict[Tuple[str, str, datetime, str], Dict[str, Any]] = {}
+    for metric in metrics:
+        value = metric["value"]
+        for granularity in GRANULARITIES:
+            key = (metric["project_id"], granularity, floor_bucket(metric["created_at"], granularity), metric["metric_name"])
+            entry = acc.get(key)
+            if entry is None:
+                entry = acc[key] = {
+                    "count": 0, "sum": 0, "min": value, "max": value,
+                    "sketch": QuantileSketch(), "unit": metric.get("unit", "")
+                }
+            entry["count"] += 1
+            entry["sum"] += value
+            entry["min"] = min(entry["min"], value)
+            entry["max"] = max(entry["max"], value)
+            entry["sketch"].add(value)
+
+    return [
+        UpdateOne(
+            {"project_id": project_id, "granularity": granularity, "bucket": bucket, "metric_name": name},
+            {
+                "$inc": {
+                    "count": entry["count"],
+                    "sum": entry["sum"],
+                    **{f"sketch.{k}": v for k, v in entry["sketch"].to_fields().items()},
+                },
+                "$min": {"min": entry["min"]},
+                "$max": {"max": entry["max"]},
+                "$setOnInsert": {"unit": entry["unit"], **_expiry(bucket, granularity)},
+            },
+            upsert=True
+        )
+        for (project_id, granularity, bucket, name), entry in acc.items()
+    ]
+
+
+def merge_event_rollups(docs: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """total_events / event_types / daily_events / peak_hours from a window's rollup documents"""
+    stats = {"total_events": 0, "event_types": {}, "daily_events": {}, "peak_hours": [0] * 24}
+    for doc in sorted(docs, key=lambda d: d["bucket"]):
+        stats["total_events"] += doc.get("total", 0)
+        for event_type, count in doc.get("types", {}).items():
+            stats["event_types"][event_type] = stats["event_types"].get(event_type, 0) + count
+        day = doc["bucket"].date().isoformat()
+        stats["daily_events"][day] = stats["daily_events"].get(day, 0) + doc.get("total", 0)
+        if doc["granularity"] == "day":
+            for hour, count in doc.get("hours", {}).items():
+                stats["peak_hours"][int(hour)] += count
+        else:
+            stats["peak_hours"][doc["bucket"].hour] += doc.get("total", 0)
+    return stats
+
+
+def percentiles(sketch: QuantileSketch, low: float, high: float) -> Dict[str, Optional[float]]:
+    """p50 / p90 / p99, clamped to the exact min and max the sketch's bins only approximate"""
+    result = {}
+    for name, q in PERCENTILES:
+        value = sketch.quantile(q)
+        result[name] = None if value is None else min(max(value, low), high)
+    return result
+
+
+def merge_metric_rollups(docs: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Per-metric min / max / avg / count and percentiles from a window's rollup documents"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for doc in docs:
+        entry = merged.get(doc["metric_name"])
+        sketch = QuantileSketch.from_document(doc.get("sketch"))
+        if entry is None:
+            merged[doc["metric_name"]] = {
+                "min": doc["min"], "max": doc["max"], "sum": doc["sum"], "count": doc["count"],
+                "unit": doc.get("unit", ""), "sketch": sketch
+            }
+            continue
+        entry["min"] = min(entry["min"], doc["min"])
+        entry["max"] = max(entry["max"], doc["max"])
+        entry["sum"] += doc["sum"]
+        entry["count"] += doc["count"]
+        entry["sketch"].merge(sketch)
+    for entry in merged.values():
+        entry["avg"] = entry.pop("sum") / entry["count"] if entry["count"] else 0
+        entry.update(percentiles(entry.pop("sketch"), entry["min"], entry["max"]))
+    return merged
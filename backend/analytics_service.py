@@ -2,12 +2,29 @@
 Analytics and Monitoring Service
 Track app usage, performance metrics, user behavior
 """
+import asyncio
 import logging
 from datetime import datetime, timezone, timedelta
 from typing import Dict, List, Optional
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
 import os
 
+from analytics_rollups import (
+    cover_window,
+    event_rollup_buckets,
+    event_rollup_updates,
+    floor_bucket,
+    merge_event_rollups,
+    merge_metric_rollups,
+    metric_rollup_updates,
+    percentiles,
+    ranges_query,
+    user_rollup_updates,
+)
+from ingest_buffer import IngestBuffer
+from quantile_sketch import QuantileSketch
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,6 +35,109 @@ class AnalyticsService:
         self.db = db
         self.analytics_collection = db.analytics
         self.metrics_collection = db.metrics
+        self.event_rollups = db.analytics_rollups
+        self.user_rollups = db.analytics_rollup_users
+        self.metric_rollups = db.metrics_rollups
+        # Dashboards read rollups; raw events/metrics expire via TTL (see index_bootstrap)
+        self.rollups_enabled = os.getenv("ANALYTICS_ROLLUPS_ENABLED", "true").lower() not in ("0", "false", "no")
+        # Once started, track_* calls enqueue here and return without a database round trip
+        self.event_buffer = IngestBuffer("analytics", self._persist_events)
+        self.metric_buffer = IngestBuffer("metrics", self._persist_metrics)
+    
+    def start(self) -> None:
+        self.event_buffer.start()
+        self.metric_buffer.start()
+    
+    async def stop(self) -> None:
+        await asyncio.gather(self.event_buffer.stop(), self.metric_buffer.stop())
+    
+    def stats(self) -> Dict:
+        return {"events": self.event_buffer.stats(), "metrics": self.metric_buffer.stats()}
+    
+    @property
+    def buffering(self) -> bool:
+        return self.event_buffer.running and self.metric_buffer.running
+    
+    def enqueue(self, events: List[Dict], metrics: List[Dict]) -> int:
+        """Hand prepared documents to the running buffers; returns how many were dropped"""
+        accepted = sum(self.event_buffer.add(e) for e in events) + sum(self.metric_buffer.add(m) for m in metrics)
+        return len(events) + len(metrics) - accepted
+    
+    async def persist(self, events: List[Dict], metrics: List[Dict]) -> None:
+        """Write prepared documents straight away (used when the buffers are not running)"""
+        try:
+            if events:
+                await self._persist_events(events)
+            if metrics:
+                await self._persist_metrics(metrics)
+        except Exception as e:
+            logger.error(f"Failed to persist analytics batch: {e}")
+    
+    @staticmethod
+    async def _insert_batch(collection, docs: List[Dict]) -> List[Dict]:
+        """
+        insert_many(ordered=False); returns the documents that are now stored
+        
+        Duplicate-key errors mean an earlier, interrupted attempt already wrote that
+        document (ids are assigned at enqueue time). That attempt raised before its
+        rollups were updated, so those documents count as written here.
+        """
+        try:
+            await collection.insert_many(docs, ordered=False)
+            return docs
+        except BulkWriteError as e:
+            rejected = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if rejected:
+                logger.error(f"Dropped {len(rejected)} documents rejected by {collection.name}: {rejected[0].get('errmsg')}")
+            failed = {err["index"] for err in rejected}
+            return [doc for i, doc in enumerate(docs) if i not in failed]
+    
+    async def _persist_events(self, events: List[Dict]) -> int:
+        written = await self._insert_batch(self.analytics_collection, events)
+        if self.rollups_enabled and written:
+            try:
+                await self._write_event_rollups(written)
+            except Exception as e:
+                # Raw events are in; retrying the batch would not re-run rollups for them anyway
+                logger.error(f"Failed to update analytics rollups: {e}")
+        return len(events) - len(written)
+    
+    async def _persist_metrics(self, metrics: List[Dict]) -> int:
+        written = await self._insert_batch(self.metrics_collection, metrics)
+        if self.rollups_enabled and written:
+            try:
+                await self._write_metric_rollups(written)
+            except Exception as e:
+                logger.error(f"Failed to update metric rollups: {e}")
+        return len(metrics) - len(written)
+    
+    @staticmethod
+    async def _aggregate(collection, pipeline: List[Dict]) -> List[Dict]:
+        """Run a pipeline server-side, reading the (small) grouped result from the cursor as it streams"""
+        return [doc async for doc in collection.aggregate(pipeline, allowDiskUse=True)]
+    
+    async def _known_event_types(self, events: List[Dict]) -> Dict:
+        """Type keys the rollup documents a batch touches already count, per bucket"""
+        buckets = event_rollup_buckets(events)
+        docs = await self.event_rollups.find(
+            {"$or": [{"project_id": p, "granularity": g, "bucket": b} for p, g, b in buckets]},
+            {"_id": 0, "project_id": 1, "granularity": 1, "bucket": 1, "types": 1}
+        ).to_list(length=None)
+        # floor_bucket re-attaches UTC to the naive datetimes the driver returns
+        return {
+            (d["project_id"], d["granularity"], floor_bucket(d["bucket"], d["granularity"])): d.get("types", {}).keys()
+            for d in docs
+        }
+    
+    async def _write_event_rollups(self, events: List[Dict]) -> None:
+        known_types = await self._known_event_types(events)
+        await self.event_rollups.bulk_write(event_rollup_updates(events, known_types), ordered=False)
+        user_updates = user_rollup_updates(events)
+        if user_updates:
+            await self.user_rollups.bulk_write(user_updates, ordered=False)
+    
+    async def _write_metric_rollups(self, metrics: List[Dict]) -> None:
+        await self.metric_rollups.bulk_write(metric_rollup_updates(metrics), ordered=False)
     
     async def track_event(
         self,
@@ -37,7 +157,11 @@ class AnalyticsService:
                 "created_at": datetime.now(timezone.utc)
             }
             
+            if self.event_buffer.running:
+                return self.event_buffer.add(event_doc)
             await self.analytics_collection.insert_one(event_doc)
+            if self.rollups_enabled:
+                await self._write_event_rollups([event_doc])
             return True
         
         except Exception as e:
@@ -48,9 +172,16 @@ class AnalyticsService:
         self,
         project_id: str,
         start_date: Optional[datetime] = None,
-        end_date: Optional[datetime] = None
+        end_date: Optional[datetime] = None,
+        use_rollups: Optional[bool] = None
     ) -> Dict:
-        """Get analytics for a project"""
+        """
+        Get analytics for a project
+        
+        Rollups answer at minute resolution (the window's edges round out to whole
+        minutes, unique users to whole days); pass use_rollups=False for exact
+        per-event counts from the raw collection.
+        """
         try:
             # Default to last 30 days
             if not start_date:
@@ -67,32 +198,10 @@ class AnalyticsService:
                 }
             }
             
-            events = await self.analytics_collection.find(query).to_list(length=10000)
-            
-            # Aggregate statistics
-            stats = {
-                "total_events": len(events),
-                "unique_users": len(set(e.get("user_id") for e in events if e.get("user_id"))),
-                "event_types": {},
-                "daily_events": {},
-                "peak_hours": [0] * 24
-            }
-            
-            for event in events:
-                # Count by event type
-                event_type = event.get("event_type", "unknown")
-                stats["event_types"][event_type] = stats["event_types"].get(event_type, 0) + 1
-                
-                # Count by day
-                date_str = event.get("timestamp", "")[:10]  # YYYY-MM-DD
-                stats["daily_events"][date_str] = stats["daily_events"].get(date_str, 0) + 1
-                
-                # Track peak hours
-                try:
-                    hour = datetime.fromisoformat(event.get("timestamp", "")).hour
-                    stats["peak_hours"][hour] += 1
-                except:
-                    pass
+            if self.rollups_enabled if use_rollups is None else use_rollups:
+                stats = await self._rollup_project_stats(project_id, start_date, end_date)
+            else:
+                stats = await self._event_project_stats(query)
             
             return {
                 "project_id": project_id,
@@ -107,6 +216,59 @@ class AnalyticsService:
             logger.error(f"Failed to get analytics: {e}")
             return {"error": str(e)}
     
+    async def _rollup_project_stats(self, project_id: str, start: datetime, end: datetime) -> Dict:
+        ranges = cover_window(start, end)
+        docs, unique_users = await asyncio.gather(
+            self.event_rollups.find({"project_id": project_id, **ranges_query(ranges)}, {"_id": 0}).to_list(length=None),
+            self._aggregate(self.user_rollups, [
+                {"$match": {"project_id": project_id, "day": {"$gte": floor_bucket(start, "day"), "$lte": end}}},
+                {"$group": {"_id": "$user_id"}},
+                {"$count": "users"},
+            ]),
+        )
+        stats = merge_event_rollups(docs)
+        stats["unique_users"] = unique_users[0]["users"] if unique_users else 0
+        return stats
+    
+    async def _event_project_stats(self, query: Dict) -> Dict:
+        by_type, by_day, by_hour, unique_users = await asyncio.gather(
+            self._aggregate(self.analytics_collection, [
+                {"$match": query},
+                {"$group": {"_id": "$event_type", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+            ]),
+            self._aggregate(self.analytics_collection, [
+                {"$match": query},
+                {"$group": {
+                    "_id": {"$dateTrunc": {"date": "$created_at", "unit": "day", "timezone": "UTC"}},
+                    "count": {"$sum": 1},
+                }},
+                {"$sort": {"_id": 1}},
+            ]),
+            self._aggregate(self.analytics_collection, [
+                {"$match": query},
+                {"$group": {"_id": {"$hour": "$created_at"}, "count": {"$sum": 1}}},
+            ]),
+            # Grouping on user_id (rather than one $addToSet array) keeps this under
+            # the 16 MB document limit however many users there are
+            self._aggregate(self.analytics_collection, [
+                {"$match": {**query, "user_id": {"$nin": [None, ""]}}},
+                {"$group": {"_id": "$user_id"}},
+                {"$count": "users"},
+            ]),
+        )
+        
+        stats = {
+            "total_events": sum(row["count"] for row in by_type),
+            "unique_users": unique_users[0]["users"] if unique_users else 0,
+            "event_types": {(row["_id"] or "unknown"): row["count"] for row in by_type},
+            "daily_events": {row["_id"].date().isoformat(): row["count"] for row in by_day},
+            "peak_hours": [0] * 24
+        }
+        for row in by_hour:
+            stats["peak_hours"][row["_id"]] = row["count"]
+        return stats
+    
     async def track_performance_metric(
         self,
         project_id: str,
@@ -125,7 +287,11 @@ class AnalyticsService:
                 "created_at": datetime.now(timezone.utc)
             }
             
+            if self.metric_buffer.running:
+                return self.metric_buffer.add(metric_doc)
             await self.metrics_collection.insert_one(metric_doc)
+            if self.rollups_enabled:
+                await self._write_metric_rollups([metric_doc])
             return True
         
         except Exception as e:
@@ -136,11 +302,29 @@ class AnalyticsService:
         self,
         project_id: str,
         metric_name: Optional[str] = None,
-        hours: int = 24
+        hours: int = 24,
+        use_rollups: Optional[bool] = None
     ) -> Dict:
-        """Get performance metrics for a project"""
+        """
+        Get performance metrics for a project
+        
+        p50/p90/p99 come from quantile sketches (within 1% of the true value): merged
+        per-bucket sketches from rollups, or one built from streamed raw metrics.
+        """
         try:
-            start_time = datetime.now(timezone.utc) - timedelta(hours=hours)
+            now = datetime.now(timezone.utc)
+            start_time = now - timedelta(hours=hours)
+            
+            if self.rollups_enabled if use_rollups is None else use_rollups:
+                query = {"project_id": project_id, **ranges_query(cover_window(start_time, now, now))}
+                if metric_name:
+                    query["metric_name"] = metric_name
+                docs = await self.metric_rollups.find(query, {"_id": 0}).to_list(length=None)
+                return {
+                    "project_id": project_id,
+                    "period_hours": hours,
+                    "metrics": merge_metric_rollups(docs)
+                }
             
             query = {
                 "project_id": project_id,
@@ -150,31 +334,37 @@ class AnalyticsService:
             if metric_name:
                 query["metric_name"] = metric_name
             
-            metrics = await self.metrics_collection.find(query).to_list(length=10000)
+            # Count / min / max / avg are computed server-side over every matching metric
+            groups = await self._aggregate(self.metrics_collection, [
+                {"$match": query},
+                {"$group": {
+                    "_id": "$metric_name",
+                    "count": {"$sum": 1},
+                    "min": {"$min": "$value"},
+                    "max": {"$max": "$value"},
+                    "avg": {"$avg": "$value"},
+                    "unit": {"$first": "$unit"},
+                }},
+            ])
             
-            # Aggregate by metric name
-            aggregated = {}
-            for metric in metrics:
-                name = metric.get("metric_name", "unknown")
-                value = metric.get("value", 0)
-                
-                if name not in aggregated:
-                    aggregated[name] = {
-                        "values": [],
-                        "min": value,
-                        "max": value,
-                        "unit": metric.get("unit", "")
-                    }
-                
-                aggregated[name]["values"].append(value)
-                aggregated[name]["min"] = min(aggregated[name]["min"], value)
-                aggregated[name]["max"] = max(aggregated[name]["max"], value)
+            # Percentiles from sketches fed by a streamed cursor: memory stays bounded by
+            # the sketch bins, however many metrics the window holds
+            sketches: Dict[str, QuantileSketch] = {}
+            async for metric in self.metrics_collection.find(query, {"_id": 0, "metric_name": 1, "value": 1}):
+                value = metric.get("value")
+                if value is not None:
+                    sketches.setdefault(metric.get("metric_name"), QuantileSketch()).add(value)
             
-            # Calculate averages
-            for name, data in aggregated.items():
-                if data["values"]:
-                    data["avg"] = sum(data["values"]) / len(data["values"])
-                    data["count"] = len(data["values"])
+            aggregated = {}
+            for row in groups:
+                aggregated[row["_id"] or "unknown"] = {
+                    "min": row["min"],
+                    "max": row["max"],
+                    "unit": row.get("unit") or "",
+                    "avg": row["avg"],
+                    "count": row["count"],
+                    **percentiles(sketches.get(row["_id"], QuantileSketch()), row["min"], row["max"]),
+                }
             
             return {
                 "project_id": project_id,
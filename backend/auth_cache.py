@@ -0,0 +1,97 @@
+"""
+Authenticated User Cache
+Short-lived cache of resolved user + team documents for get_current_user
+"""
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class UserResolutionCache:
+    """Bounded TTL cache keyed by user_id and a fingerprint of the session token"""
+
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def fingerprint(token: str) -> str:
+        """Hash the token so raw credentials never sit in memory as dict keys"""
+        return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+    def get(self, user_id: str, token: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached user document, or None on miss/expiry"""
+        key = (user_id, self.fingerprint(token))
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user_doc = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(user_doc)
+
+    def set(self, user_id: str, token: str, user_doc: Dict[str, Any]) -> None:
+        """Cache a resolved user document for this token"""
+        if self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return
+
+        key = (user_id, self.fingerprint(token))
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, dict(user_doc))
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_user(self, user_id: str) -> int:
+        """Drop every cached session of a user (profile or password change)"""
+        keys = [key for key in self._entries if key[0] == user_id]
+        for key in keys:
+            del self._entries[key]
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def invalidate_team(self, team_id: Optional[str]) -> int:
+        """Drop every cached member of a team (plan or membership change)"""
+        if not team_id:
+            return 0
+        keys = [
+            key for key, (_, user_doc) in self._entries.items()
+            if user_doc.get("team_id") == team_id
+        ]
+        for key in keys:
+            del self._entries[key]
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
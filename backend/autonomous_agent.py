@@ -7,7 +7,7 @@ import logging
 from typing import Dict, List, Optional, Callable
 from datetime import datetime
 import json
-from openai import AsyncOpenAI
+from services.llm_clients import llm_clients
 import os
 
 logger = logging.getLogger(__name__)
@@ -18,7 +18,7 @@ class AutonomousAgent:
     
     def __init__(self, project_id: str, openai_api_key: str):
         self.project_id = project_id
-        self.client = AsyncOpenAI(api_key=openai_api_key)
+        self.api_key = openai_api_key
         self.running = False
         self.max_iterations = 50  # Prevent infinite loops
         self.iteration_count = 0
@@ -124,7 +124,8 @@ Generate the following files:
         
         self.iteration_count += 1
         
-        response = await self.client.chat.completions.create(
+        response = await llm_clients.chat_completion(
+            api_key=self.api_key,
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": """You are an expert full-stack developer building production-ready applications.
@@ -338,7 +339,8 @@ Current code:
 Return ONLY the fixed code, no explanations.
 """
             
-            response = await self.client.chat.completions.create(
+            response = await llm_clients.chat_completion(
+                api_key=self.api_key,
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "You are a code fixing expert. Return only the fixed code."},
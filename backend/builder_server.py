@@ -38,6 +38,10 @@ except Exception as e:
     print(f'Failed to connect to MongoDB: {e}')
     sys.exit(1)
 
+# Project files live in content-addressed blobs shared with server.py (see project_file_store)
+from project_file_store import ProjectFileStore
+project_store = ProjectFileStore(db)
+
 # Add MongoDB connection test to FastAPI startup event
 app = FastAPI(title="AI Application Builder")
 api_router = APIRouter(prefix="/api")
@@ -51,6 +55,10 @@ async def test_mongo_connection():
         print(f"MongoDB connection failed: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_services():
+    password_hasher.shutdown()
+
 # --- Strict CORS config ---
 from starlette.middleware.cors import CORSMiddleware
 frontend_origin = os.environ.get('CORS_ORIGINS', 'http://localhost:3000')
@@ -144,11 +152,24 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+from password_hasher import PasswordHasher, PasswordHasherSaturated
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+    max_queue=int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32")),
+)
+
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherSaturated:
+        raise HTTPException(status_code=503, detail="Authentication is busy, please retry shortly", headers={"Retry-After": "1"})
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+async def verify_password(plain: str, hashed: str) -> bool:
+    try:
+        return await password_hasher.verify(plain, hashed)
+    except PasswordHasherSaturated:
+        raise HTTPException(status_code=503, detail="Authentication is busy, please retry shortly", headers={"Retry-After": "1"})
 
 async def get_current_user(request: Request) -> User:
     auth_header = request.headers.get("Authorization")
@@ -185,7 +206,7 @@ async def register(user_data: UserCreate):
         created_at=datetime.now(timezone.utc)
     )
     user_dict = user.model_dump()
-    user_dict['password_hash'] = hash_password(user_data.password)
+    user_dict['password_hash'] = await hash_password(user_data.password)
     user_dict['created_at'] = user_dict['created_at'].isoformat()
     await db.users.insert_one(user_dict)
     access_token = create_access_token(data={"user_id": user.user_id})
@@ -198,7 +219,7 @@ async def login(credentials: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     if not user_doc.get('password_hash'):
         raise HTTPException(status_code=401, detail="This account uses Google sign-in. Please sign in with Google.")
-    if not verify_password(credentials.password, user_doc.get('password_hash')):
+    if not await verify_password(credentials.password, user_doc.get('password_hash')):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     if isinstance(user_doc.get('created_at'), str):
         user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
@@ -312,6 +333,7 @@ async def process_google_oauth_code(code: str):
 @api_router.get("/projects", response_model=List[Project])
 async def get_projects(current_user: User = Depends(get_current_user)):
     projects = await db.projects.find({"user_id": current_user.user_id}, {"_id": 0}).to_list(100)
+    await project_store.hydrate_many(projects)
     for proj in projects:
         if isinstance(proj.get('created_at'), str):
             proj['created_at'] = datetime.fromisoformat(proj['created_at'])
@@ -327,6 +349,7 @@ async def get_project(project_id: str, current_user: User = Depends(get_current_
     )
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    await project_store.hydrate(project)
     if isinstance(project.get('created_at'), str):
         project['created_at'] = datetime.fromisoformat(project['created_at'])
     if isinstance(project.get('updated_at'), str):
@@ -373,12 +396,13 @@ async def generate_project(project_data: ProjectCreate, current_user: User = Dep
         "description": project_data.prompt or "",
         "prompt": project_data.prompt or "",
         "tech_stack": project_data.tech_stack,
-        "files": normalized_files,
+        **(await project_store.manifest_fields(normalized_files)),
         "status": "active",
         "created_at": now.isoformat(),
         "updated_at": now.isoformat()
     }
     await db.projects.insert_one(project_doc)
+    project_doc['files'] = normalized_files
     project_doc['created_at'] = now
     project_doc['updated_at'] = now
     return Project(**project_doc)
@@ -426,34 +450,33 @@ def _apply_simple_build(message: str, app_js: str) -> str:
 
 @api_router.post("/projects/{project_id}/chat/build", response_model=ChatBuildResponse)
 async def project_chat_build(project_id: str, req: ChatRequest, current_user: User = Depends(get_current_user)):
-    project = await db.projects.find_one({"project_id": project_id, "user_id": current_user.user_id}, {"_id": 0})
+    project_query = {"project_id": project_id, "user_id": current_user.user_id}
+    project = await db.projects.find_one(project_query, {"_id": 0})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-    files = project.get("files", [])
-    app_file = None
-    for f in files:
-        if f.get("path", "").endswith("App.js") or f.get("path", "").endswith("App.jsx") or "App.js" in f.get("path",""):
-            app_file = f
+    manifest = await project_store.ensure_manifest(project, project_query)
+    app_entry = None
+    for entry in manifest:
+        if entry.get("path", "").endswith("App.js") or entry.get("path", "").endswith("App.jsx") or "App.js" in entry.get("path",""):
+            app_entry = entry
             break
-    if not app_file:
+    if app_entry:
+        app_file = (await project_store.load_files([app_entry]))[0]
+    else:
         # create a minimal App.js if missing
         app_file = {"path": "src/App.js", "content": "export default function App(){return <div style={{padding:24}}>Hello</div>;}", "language": "js"}
-        files.append(app_file)
     new_content = _apply_simple_build(req.message, app_file.get("content",""))
     if new_content == app_file.get("content",""):
         reply = "I evaluated your request, but no changes were necessary. Try asking to add tabs (Home, About, Contact, FAQ) or to change the theme color (e.g., set theme color to #ff4500)."
         return ChatBuildResponse(response=reply, file_updates=[])
     update = FileUpdate(path=app_file["path"], content=new_content)
-    # Apply update in DB
-    for i, f in enumerate(files):
-        if f.get("path") == update.path:
-            files[i] = {"path": update.path, "content": update.content, "language": f.get("language","js")}
-            break
-    else:
-        files.append({"path": update.path, "content": update.content, "language": "js"})
-    await db.projects.update_one(
-        {"project_id": project_id, "user_id": current_user.user_id},
-        {"$set": {"files": files, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    # Apply update in DB: only this file's manifest entry is rewritten
+    await project_store.write_file(
+        project_query,
+        update.path,
+        update.content,
+        language=app_file.get("language", "js"),
+        extra_set={"updated_at": datetime.now(timezone.utc).isoformat()}
     )
     reply = "Applied your change. Preview should update. Ask me to add About/Contact/FAQ tabs or adjust theme colors for more."
     return ChatBuildResponse(response=reply, file_updates=[update])
@@ -464,6 +487,7 @@ async def export_project(project_id: str, current_user: User = Depends(get_curre
     project = await db.projects.find_one({"project_id": project_id, "user_id": current_user.user_id}, {"_id": 0})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    await project_store.hydrate(project)
     return {
         "project_id": project_id,
         "name": project.get("name"),
@@ -477,6 +501,7 @@ async def export_project_github(project_id: str, current_user: User = Depends(ge
     project = await db.projects.find_one({"project_id": project_id, "user_id": current_user.user_id}, {"_id": 0})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    await project_store.hydrate(project)
     return {
         "project_name": project.get("name", f"project_{project_id}"),
         "description": project.get("description", ""),
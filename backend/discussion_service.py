@@ -5,7 +5,7 @@ Inspired by Base44's discussion mode
 """
 import logging
 from typing import Dict, List, Optional
-from openai import AsyncOpenAI
+from services.llm_clients import llm_clients
 from datetime import datetime, timezone
 import os
 
@@ -19,7 +19,6 @@ class DiscussionService:
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY not found")
-        self.client = AsyncOpenAI(api_key=self.api_key)
     
     async def discuss(
         self,
@@ -87,7 +86,8 @@ Be conversational, helpful, and collaborative."""
             })
             
             # Get AI response
-            response = await self.client.chat.completions.create(
+            response = await llm_clients.chat_completion(
+                api_key=self.api_key,
                 model="gpt-4o",
                 messages=messages,
                 temperature=0.8,  # More creative for planning
@@ -140,7 +140,8 @@ Format as a structured plan that a developer can follow."""
             if project_context:
                 prompt += f"\n\nCurrent project has {len(project_context.get('files', []))} files."
             
-            response = await self.client.chat.completions.create(
+            response = await llm_clients.chat_completion(
+                api_key=self.api_key,
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "You are an expert software architect creating implementation plans."},
@@ -197,7 +198,8 @@ Provide:
             if ask_questions:
                 prompt += "5. 5-10 clarifying questions to ask the user\n"
             
-            response = await self.client.chat.completions.create(
+            response = await llm_clients.chat_completion(
+                api_key=self.api_key,
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "You are a requirements analyst helping clarify project needs."},
@@ -258,7 +260,8 @@ Provide suggestions for:
 
 Be specific and actionable."""
 
-            response = await self.client.chat.completions.create(
+            response = await llm_clients.chat_completion(
+                api_key=self.api_key,
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "You are a senior software architect reviewing code for improvements."},
@@ -318,7 +321,8 @@ For each approach, provide:
 
 Then provide your recommendation."""
 
-            response = await self.client.chat.completions.create(
+            response = await llm_clients.chat_completion(
+                api_key=self.api_key,
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": "You are a technical advisor comparing implementation approaches."},
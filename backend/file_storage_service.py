@@ -4,23 +4,128 @@ Handle file uploads, images, documents
 Like Base44's automatic storage system
 """
 import os
+import sys
 import uuid
+import time
+import hmac
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Optional, BinaryIO, List
-from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Optional, BinaryIO, List, Tuple
+from datetime import datetime, timedelta, timezone
 import mimetypes
 import aiofiles
 from pathlib import Path
+from pymongo import ReturnDocument
+
+from image_pipeline import ImagePipeline, MEDIA_TYPES, RENDITIONS
 
 logger = logging.getLogger(__name__)
 
+CATEGORIES = ("images", "documents", "media")
+# Served to anyone with a shared cache; every other category needs its owner or a signed URL
+PUBLIC_CATEGORIES = ("images", "media")
+
+# Largest single upload per billing plan, in MB; override with STORAGE_UPLOAD_LIMITS_MB="free=25,pro=500"
+DEFAULT_UPLOAD_LIMITS_MB = {"free": 25, "pro": 500, "business": 5 * 1024}
+
+
+def _parse_upload_limits(raw: str) -> Dict[str, int]:
+    limits = dict(DEFAULT_UPLOAD_LIMITS_MB)
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        plan, value = item.split("=", 1)
+        try:
+            limits[plan.strip()] = max(1, int(value))
+        except ValueError:
+            logger.warning(f"Ignoring invalid upload limit entry: {item}")
+    return limits
+
+
+class UploadRejected(Exception):
+    """A resumable upload request that cannot be applied"""
+
+    def __init__(self, status_code: int, message: str, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+class UploadTooLarge(Exception):
+    """Upload exceeds the plan's size limit"""
+
+    def __init__(self, limit_bytes: int):
+        super().__init__(f"File exceeds the {limit_bytes // (1024 * 1024)} MB upload limit")
+        self.limit_bytes = limit_bytes
+
+
+# Fields get_file returns from the project_files index
+INDEX_PROJECTION = {
+    "_id": 0, "file_id": 1, "filename": 1, "stored_filename": 1, "category": 1,
+    "mime_type": 1, "size": 1, "checksum": 1, "project_id": 1, "user_id": 1,
+}
+
+
+SCAN_BATCH = 500
+
+
+def _stale_batch(entries, cutoff: float, limit: int):
+    """Next `limit` directory entries; returns ([(name, path, size)] older than `cutoff`, exhausted)"""
+    batch = []
+    for scanned, entry in enumerate(entries, 1):
+        try:
+            if entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime < cutoff:
+                    batch.append((entry.name, entry.path, stat.st_size))
+        except FileNotFoundError:
+            pass
+        if scanned >= limit:
+            return batch, False
+    return batch, True
+
+
+def _unlink_all(paths) -> Tuple[int, int]:
+    files = freed = 0
+    for path, size in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        files += 1
+        freed += size
+    return files, freed
+
+
+def _file_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 
 class FileStorageService:
     """Manage file uploads and storage"""
     
-    def __init__(self, storage_path: str = "./storage"):
+    def __init__(self, storage_path: str = "./storage", db=None, signing_key: Optional[str] = None):
         self.storage_path = Path(storage_path)
         self.storage_path.mkdir(parents=True, exist_ok=True)
+        # project_files doubles as the file_id index; without a db, lookups fall back to scanning disk
+        self.files_collection = db.project_files if db is not None else None
+        # Stored bytes keyed by sha256 with a reference count, shared by identical uploads
+        self.objects_collection = db.storage_objects if db is not None else None
+        self.sessions_collection = db.upload_sessions if db is not None else None
+        self.upload_limits_mb = _parse_upload_limits(os.getenv("STORAGE_UPLOAD_LIMITS_MB", ""))
+        self.upload_chunk_bytes = int(os.getenv("STORAGE_UPLOAD_CHUNK_BYTES", str(8 * 1024 * 1024)))
+        self.upload_session_ttl = int(os.getenv("STORAGE_UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+        # Signs presigned URLs; must be shared by all workers for their links to verify anywhere
+        self.signing_key = (
+            signing_key or os.getenv("STORAGE_SIGNING_KEY") or os.getenv("JWT_SECRET") or uuid.uuid4().hex
+        ).encode("utf-8")
+        self.deduplicated = 0
+        self.images = ImagePipeline(self.storage_path / "derived")
         
         # Create subdirectories
         (self.storage_path / "images").mkdir(exist_ok=True)
@@ -48,39 +153,21 @@ class FileStorageService:
             Upload result with file URL
         """
         try:
-            # Generate unique file ID
-            file_id = f"{uuid.uuid4().hex[:12]}"
-            file_ext = Path(filename).suffix
-            
-            # Determine storage category
+            # Write to temp first so the stored file appears atomically
             mime_type, _ = mimetypes.guess_type(filename)
-            category = self._categorize_file(mime_type)
-            
-            # Generate storage path
-            stored_filename = f"{file_id}{file_ext}"
-            storage_subpath = self.storage_path / category / stored_filename
-            
-            # Save file
-            async with aiofiles.open(storage_subpath, 'wb') as f:
+            temp_path = self.storage_path / "temp" / f"{uuid.uuid4().hex[:12]}.part"
+            async with aiofiles.open(temp_path, 'wb') as f:
                 await f.write(file_content)
             
-            # Generate public URL
-            public_url = f"/storage/{category}/{stored_filename}"
-            
-            now = datetime.now(timezone.utc)
-            
-            file_info = {
-                "file_id": file_id,
-                "filename": filename,
-                "stored_filename": stored_filename,
-                "url": public_url,
-                "category": category,
-                "mime_type": mime_type or "application/octet-stream",
-                "size": len(file_content),
-                "user_id": user_id,
-                "project_id": project_id,
-                "uploaded_at": now.isoformat()
-            }
+            file_info = await self._commit_upload(
+                temp_path,
+                filename=filename,
+                mime_type=mime_type,
+                size=len(file_content),
+                checksum=hashlib.sha256(file_content).hexdigest(),
+                user_id=user_id,
+                project_id=project_id,
+            )
             
             logger.info(f"Uploaded file: {filename} ({len(file_content)} bytes)")
             
@@ -96,10 +183,414 @@ class FileStorageService:
                 "error": str(e)
             }
     
-    async def get_file(self, file_id: str) -> Optional[Dict]:
-        """Retrieve file information"""
-        # Search in all categories
-        for category in ["images", "documents", "media"]:
+    async def _place_object(self, temp_path: Path, category: str, stored_filename: str, size: int, checksum: str):
+        """
+        Move a finished temp file into storage, or drop it if identical content is already stored
+        
+        Returns:
+            (category, stored_filename) of the object the new record should point at
+        """
+        final_path = self.storage_path / category / stored_filename
+        os.replace(temp_path, final_path)
+        if self.objects_collection is None:
+            return category, stored_filename
+        
+        # One atomic upsert: either claims a reference on the existing object or registers ours.
+        # An object at refs 0 that delete_file is about to remove is revived rather than lost.
+        try:
+            stored = await self.objects_collection.find_one_and_update(
+                {"checksum": checksum},
+                {
+                    "$setOnInsert": {
+                        "checksum": checksum,
+                        "category": category,
+                        "stored_filename": stored_filename,
+                        "size": size,
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                    },
+                    "$inc": {"refs": 1},
+                },
+                projection={"_id": 0, "category": 1, "stored_filename": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except Exception:
+            final_path.unlink(missing_ok=True)
+            raise
+        if stored["stored_filename"] != stored_filename:
+            final_path.unlink(missing_ok=True)
+            self.deduplicated += 1
+        return stored["category"], stored["stored_filename"]
+    
+    async def _unlink_object(self, checksum: Optional[str], path: Path) -> None:
+        """Remove a stored file together with the renditions derived from it"""
+        path.unlink(missing_ok=True)
+        if checksum:
+            await asyncio.to_thread(self.images.discard, checksum)
+    
+    async def _release_object(self, checksum: Optional[str], path: Path) -> bool:
+        """Drop one reference to a stored object; unlinks the file with the last one"""
+        if self.objects_collection is None or not checksum:
+            await self._unlink_object(checksum, path)
+            return True
+        remaining = await self.objects_collection.find_one_and_update(
+            {"checksum": checksum, "stored_filename": path.name},
+            {"$inc": {"refs": -1}},
+            projection={"_id": 0, "refs": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if remaining is None:
+            # Stored before reference counting existed
+            await self._unlink_object(checksum, path)
+            return True
+        if remaining["refs"] > 0:
+            return False
+        # Only the caller whose delete wins may unlink; a concurrent upload may have revived it
+        result = await self.objects_collection.delete_one({"checksum": checksum, "refs": {"$lte": 0}})
+        if result.deleted_count:
+            await self._unlink_object(checksum, path)
+            return True
+        return False
+    
+    async def _commit_upload(
+        self,
+        temp_path: Path,
+        filename: str,
+        mime_type: Optional[str],
+        size: int,
+        checksum: str,
+        user_id: str,
+        project_id: Optional[str]
+    ) -> Dict:
+        """Store a finished temp file (deduplicated by checksum) and add its record to the index"""
+        file_id = f"{uuid.uuid4().hex[:12]}"
+        category, stored_filename = await self._place_object(
+            temp_path,
+            self._categorize_file(mime_type),
+            f"{file_id}{Path(filename).suffix}",
+            size,
+            checksum,
+        )
+        file_info = {
+            "file_id": file_id,
+            "filename": filename,
+            "stored_filename": stored_filename,
+            "url": f"/storage/{category}/{stored_filename}",
+            "category": category,
+            "mime_type": mime_type or "application/octet-stream",
+            "size": size,
+            "checksum": checksum,
+            "user_id": user_id,
+            "project_id": project_id,
+            "uploaded_at": datetime.now(timezone.utc).isoformat()
+        }
+        if self.files_collection is not None:
+            try:
+                await self.files_collection.insert_one(dict(file_info))
+            except Exception:
+                await self._release_object(checksum, self.storage_path / category / stored_filename)
+                raise
+        return {**file_info, **self._rendition_urls(file_info)}
+    
+    def max_upload_bytes(self, plan: Optional[str]) -> int:
+        limit_mb = self.upload_limits_mb.get(plan or "free", self.upload_limits_mb["free"])
+        return limit_mb * 1024 * 1024
+    
+    async def upload_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        filename: str,
+        user_id: str,
+        project_id: Optional[str] = None,
+        max_bytes: Optional[int] = None
+    ) -> Dict:
+        """
+        Upload a file from an async byte stream without buffering it
+        
+        Chunks go to a temp file while being hashed and counted; the finished
+        file is renamed into its category directory in one step.
+        
+        Raises:
+            UploadTooLarge: as soon as more than `max_bytes` have arrived;
+            errors from `chunks` or the disk propagate after the temp file is removed
+        """
+        mime_type, _ = mimetypes.guess_type(filename)
+        temp_path = self.storage_path / "temp" / f"{uuid.uuid4().hex[:12]}.part"
+        
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(temp_path, 'wb') as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise UploadTooLarge(max_bytes)
+                    digest.update(chunk)
+                    await f.write(chunk)
+        except BaseException:
+            # Includes errors raised by `chunks` itself (client disconnect, malformed body)
+            temp_path.unlink(missing_ok=True)
+            raise
+        
+        try:
+            file_info = await self._commit_upload(
+                temp_path,
+                filename=filename,
+                mime_type=mime_type,
+                size=size,
+                checksum=digest.hexdigest(),
+                user_id=user_id,
+                project_id=project_id,
+            )
+        except Exception as e:
+            temp_path.unlink(missing_ok=True)
+            logger.error(f"Streaming upload failed: {e}")
+            return {
+                "success": False,
+                "error": str(e)
+            }
+        
+        logger.info(f"Uploaded file: {filename} ({size} bytes, streamed)")
+        return {
+            "success": True,
+            **file_info
+        }
+    
+    # ---- Resumable uploads: init -> put_chunk (repeat, resumable by offset) -> complete ----
+    
+    def _session_path(self, upload_id: str) -> Path:
+        return self.storage_path / "temp" / f"{upload_id}.part"
+    
+    async def init_upload(
+        self,
+        filename: str,
+        size: int,
+        user_id: str,
+        project_id: Optional[str] = None,
+        checksum: Optional[str] = None,
+        max_bytes: Optional[int] = None
+    ) -> Dict:
+        """
+        Start a resumable upload
+        
+        Args:
+            filename: Original filename
+            size: Total size in bytes, fixed up front
+            checksum: Optional sha256 of the whole file; if this user already stored
+                that content the upload completes immediately without sending any bytes.
+                Other users' content is only deduplicated once the bytes are received and
+                hashed, so knowing a hash never grants access to someone else's file.
+            
+        Returns:
+            {"complete": True, ...file record} on a checksum hit, otherwise
+            {"upload_id", "offset": 0, "chunk_size"}
+        """
+        if self.sessions_collection is None:
+            return {"success": False, "error": "Resumable uploads need a database"}
+        if size < 0:
+            raise UploadRejected(400, "Size must not be negative")
+        if max_bytes is not None and size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        
+        mime_type, _ = mimetypes.guess_type(filename)
+        if checksum and await self.files_collection.find_one(
+            {"user_id": user_id, "checksum": checksum, "size": size}, {"_id": 0, "file_id": 1}
+        ):
+            stored = await self.objects_collection.find_one_and_update(
+                {"checksum": checksum, "size": size, "refs": {"$gt": 0}},
+                {"$inc": {"refs": 1}},
+                projection={"_id": 0, "category": 1, "stored_filename": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            if stored:
+                self.deduplicated += 1
+                file_info = await self._link_object(stored, filename, mime_type, size, checksum, user_id, project_id)
+                return {"success": True, "complete": True, **file_info}
+        
+        upload_id = uuid.uuid4().hex
+        now = datetime.now(timezone.utc)
+        async with aiofiles.open(self._session_path(upload_id), 'wb'):
+            pass
+        await self.sessions_collection.insert_one({
+            "upload_id": upload_id,
+            "user_id": user_id,
+            "project_id": project_id,
+            "filename": filename,
+            "mime_type": mime_type,
+            "size": size,
+            "checksum": checksum,
+            "offset": 0,
+            "chunks": [],
+            "created_at": now.isoformat(),
+            "expires_at": now + timedelta(seconds=self.upload_session_ttl),
+        })
+        return {
+            "success": True,
+            "complete": False,
+            "upload_id": upload_id,
+            "offset": 0,
+            "chunk_size": self.upload_chunk_bytes,
+        }
+    
+    async def _link_object(self, stored: Dict, filename, mime_type, size, checksum, user_id, project_id) -> Dict:
+        """Index a new record for an object whose reference was already claimed"""
+        file_info = {
+            "file_id": f"{uuid.uuid4().hex[:12]}",
+            "filename": filename,
+            "stored_filename": stored["stored_filename"],
+            "url": f"/storage/{stored['category']}/{stored['stored_filename']}",
+            "category": stored["category"],
+            "mime_type": mime_type or "application/octet-stream",
+            "size": size,
+            "checksum": checksum,
+            "user_id": user_id,
+            "project_id": project_id,
+            "uploaded_at": datetime.now(timezone.utc).isoformat()
+        }
+        try:
+            await self.files_collection.insert_one(dict(file_info))
+        except Exception:
+            await self._release_object(checksum, self.storage_path / stored["category"] / stored["stored_filename"])
+            raise
+        return {**file_info, **self._rendition_urls(file_info)}
+    
+    async def upload_status(self, upload_id: str, user_id: str) -> Optional[Dict]:
+        """Where to resume: the session's committed offset and chunk digests"""
+        if self.sessions_collection is None:
+            return None
+        return await self.sessions_collection.find_one(
+            {"upload_id": upload_id, "user_id": user_id},
+            {"_id": 0, "upload_id": 1, "filename": 1, "size": 1, "offset": 1, "chunks": 1}
+        )
+    
+    async def put_chunk(
+        self,
+        upload_id: str,
+        user_id: str,
+        offset: int,
+        chunks: AsyncIterator[bytes],
+        chunk_checksum: Optional[str] = None
+    ) -> Dict:
+        """
+        Append bytes at `offset`, which must equal the session's committed offset
+        
+        The chunk is hashed as it is written; if `chunk_checksum` is given and does
+        not match, the file is truncated back to `offset` and nothing is committed.
+        
+        Raises:
+            UploadRejected: unknown session (404), wrong offset (409, carries the
+            expected offset), chunk past the declared size or checksum mismatch (400)
+        """
+        session = await self.upload_status(upload_id, user_id)
+        if session is None:
+            raise UploadRejected(404, "Upload not found")
+        if offset != session["offset"]:
+            raise UploadRejected(409, f"Expected offset {session['offset']}", offset=session["offset"])
+        
+        digest = hashlib.sha256()
+        written = 0
+        committed = False
+        async with aiofiles.open(self._session_path(upload_id), 'r+b') as f:
+            await f.seek(offset)
+            try:
+                async for chunk in chunks:
+                    written += len(chunk)
+                    if offset + written > session["size"]:
+                        raise UploadRejected(400, "Chunk runs past the declared upload size")
+                    digest.update(chunk)
+                    await f.write(chunk)
+                if chunk_checksum and digest.hexdigest() != chunk_checksum.lower():
+                    raise UploadRejected(400, "Chunk checksum mismatch")
+                
+                # Conditional on the offset so two clients resuming the same upload cannot both commit
+                result = await self.sessions_collection.update_one(
+                    {"upload_id": upload_id, "offset": offset},
+                    {
+                        "$set": {
+                            "offset": offset + written,
+                            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.upload_session_ttl),
+                        },
+                        "$push": {"chunks": {"offset": offset, "size": written, "sha256": digest.hexdigest()}},
+                    }
+                )
+                if not result.matched_count:
+                    raise UploadRejected(409, "Upload offset changed concurrently")
+                committed = True
+            finally:
+                if not committed:
+                    await f.truncate(offset)
+        
+        return {"success": True, "upload_id": upload_id, "offset": offset + written, "sha256": digest.hexdigest()}
+    
+    async def complete_upload(self, upload_id: str, user_id: str) -> Dict:
+        """Verify the assembled file and store it like any other upload"""
+        session = await self.sessions_collection.find_one(
+            {"upload_id": upload_id, "user_id": user_id}, {"_id": 0, "chunks": 0}
+        )
+        if session is None:
+            raise UploadRejected(404, "Upload not found")
+        if session["offset"] != session["size"]:
+            raise UploadRejected(409, f"Upload incomplete at offset {session['offset']}", offset=session["offset"])
+        
+        temp_path = self._session_path(upload_id)
+        checksum = await asyncio.to_thread(_file_checksum, temp_path)
+        if session.get("checksum") and session["checksum"].lower() != checksum:
+            await self.abort_upload(upload_id, user_id)
+            raise UploadRejected(400, "File checksum mismatch; upload discarded")
+        
+        # Claim the session so a retried complete cannot store the file twice
+        claimed = await self.sessions_collection.delete_one({"upload_id": upload_id, "user_id": user_id})
+        if not claimed.deleted_count:
+            raise UploadRejected(404, "Upload not found")
+        try:
+            file_info = await self._commit_upload(
+                temp_path,
+                filename=session["filename"],
+                mime_type=session.get("mime_type"),
+                size=session["size"],
+                checksum=checksum,
+                user_id=user_id,
+                project_id=session.get("project_id"),
+            )
+        except Exception:
+            temp_path.unlink(missing_ok=True)
+            raise
+        logger.info(f"Uploaded file: {session['filename']} ({session['size']} bytes, resumable)")
+        return {"success": True, "complete": True, **file_info}
+    
+    async def abort_upload(self, upload_id: str, user_id: str) -> bool:
+        result = await self.sessions_collection.delete_one({"upload_id": upload_id, "user_id": user_id})
+        if result.deleted_count:
+            self._session_path(upload_id).unlink(missing_ok=True)
+        return bool(result.deleted_count)
+    
+    def _record_info(self, record: Dict) -> Dict:
+        return {
+            **record,
+            "path": str(self.storage_path / record["category"] / record["stored_filename"]),
+            "url": f"/storage/{record['category']}/{record['stored_filename']}",
+            **self._rendition_urls(record),
+        }
+    
+    def _rendition_urls(self, file_info: Dict) -> Dict:
+        """Smaller derived versions to reference instead of the original image"""
+        if file_info.get("category") != "images":
+            return {}
+        return {"renditions": {
+            name: f"/api/storage/{file_info['file_id']}/renditions/{name}" for name in RENDITIONS
+        }}
+    
+    async def get_file(self, file_id: str, user_id: Optional[str] = None) -> Optional[Dict]:
+        """Retrieve file information; with `user_id`, only a file that user uploaded"""
+        if self.files_collection is not None:
+            query = {"file_id": file_id}
+            if user_id is not None:
+                query["user_id"] = user_id
+            record = await self.files_collection.find_one(query, INDEX_PROJECTION)
+            return self._record_info(record) if record else None
+        
+        # No index: search in all categories
+        for category in CATEGORIES:
             category_path = self.storage_path / category
             for file_path in category_path.glob(f"{file_id}*"):
                 if file_path.is_file():
@@ -113,10 +604,32 @@ class FileStorageService:
                     }
         return None
     
-    async def delete_file(self, file_id: str) -> Dict:
-        """Delete a file from storage"""
+    async def get_stored_file(self, category: str, stored_filename: str) -> Optional[Dict]:
+        """File information for a public `/storage/{category}/{stored_filename}` URL"""
+        if category not in CATEGORIES or Path(stored_filename).name != stored_filename:
+            return None
+        if self.files_collection is not None:
+            record = await self.files_collection.find_one(
+                {"category": category, "stored_filename": stored_filename}, INDEX_PROJECTION
+            )
+            return self._record_info(record) if record else None
+        
+        file_path = self.storage_path / category / stored_filename
+        if not file_path.is_file():
+            return None
+        mime_type, _ = mimetypes.guess_type(stored_filename)
+        return {
+            "file_id": file_path.stem,
+            "path": str(file_path),
+            "url": f"/storage/{category}/{stored_filename}",
+            "category": category,
+            "mime_type": mime_type or "application/octet-stream",
+        }
+    
+    async def delete_file(self, file_id: str, user_id: Optional[str] = None) -> Dict:
+        """Delete a file from storage; with `user_id`, only a file that user uploaded"""
         try:
-            file_info = await self.get_file(file_id)
+            file_info = await self.get_file(file_id, user_id)
             
             if not file_info:
                 return {
@@ -124,9 +637,10 @@ class FileStorageService:
                     "error": "File not found"
                 }
             
-            # Delete physical file
-            file_path = Path(file_info["path"])
-            file_path.unlink(missing_ok=True)
+            # Remove the record first, then the bytes once no other record shares them
+            if self.files_collection is not None:
+                await self.files_collection.delete_one({"file_id": file_id})
+            await self._release_object(file_info.get("checksum"), Path(file_info["path"]))
             
             logger.info(f"Deleted file: {file_id}")
             
@@ -171,23 +685,51 @@ class FileStorageService:
         else:
             return "documents"
     
+    def _url_signature(self, category: str, stored_filename: str, expires: int) -> str:
+        message = f"{category}/{stored_filename}:{expires}".encode("utf-8")
+        return hmac.new(self.signing_key, message, hashlib.sha256).hexdigest()
+    
     async def generate_presigned_url(
         self,
         file_id: str,
-        expiry_seconds: int = 3600
+        expiry_seconds: int = 3600,
+        user_id: Optional[str] = None
     ) -> Optional[str]:
         """
-        Generate a temporary presigned URL for file access
-        (For production, would use S3/CDN)
+        Temporary URL for a file: its stored URL with an expiry and an HMAC over both
+        
+        Anyone holding the URL can read the file until it expires.
         """
-        file_info = await self.get_file(file_id)
+        file_info = await self.get_file(file_id, user_id)
         if not file_info:
             return None
         
-        # In production, this would generate S3 presigned URL
-        # For now, return direct URL with expiry token
-        token = uuid.uuid4().hex[:16]
-        return f"{file_info['url']}?token={token}&expires={expiry_seconds}"
+        expires = int(time.time()) + expiry_seconds
+        signature = self._url_signature(file_info["category"], Path(file_info["path"]).name, expires)
+        return f"{file_info['url']}?expires={expires}&token={signature}"
+    
+    def verify_presigned(self, file_info: Dict, expires: Optional[str], token: Optional[str]) -> bool:
+        """Whether `expires`/`token` from a presigned URL grant access to this file right now"""
+        if not expires or not token:
+            return False
+        try:
+            expires_at = int(expires)
+        except ValueError:
+            return False
+        if expires_at < time.time():
+            return False
+        expected = self._url_signature(file_info["category"], Path(file_info["path"]).name, expires_at)
+        return hmac.compare_digest(expected, token)
+    
+    async def owns_stored_file(self, user_id: str, file_info: Dict) -> bool:
+        """Whether `user_id` has a record for the stored bytes behind `file_info`"""
+        if self.files_collection is None:
+            return False
+        record = await self.files_collection.find_one(
+            {"user_id": user_id, "category": file_info["category"], "stored_filename": Path(file_info["path"]).name},
+            {"_id": 0, "file_id": 1}
+        )
+        return record is not None
     
     async def optimize_image(
         self,
@@ -197,31 +739,18 @@ class FileStorageService:
     ) -> Dict:
         """
         Optimize uploaded images
-        Resize and compress for web delivery
+        Resize and compress for web delivery into the derived cache; the original is kept
         """
         try:
-            from PIL import Image
-            
-            img = Image.open(file_path)
-            
-            # Resize if too large
-            if img.width > max_width:
-                ratio = max_width / img.width
-                new_height = int(img.height * ratio)
-                img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Convert to RGB if necessary
-            if img.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
-            
-            # Save optimized
-            img.save(file_path, 'JPEG', quality=quality, optimize=True)
+            checksum = await asyncio.to_thread(_file_checksum, file_path)
+            optimized = await self.images.render(
+                Path(file_path), checksum, {"width": max_width, "format": "JPEG", "quality": quality}
+            )
             
             return {
                 "success": True,
-                "message": "Image optimized"
+                "message": "Image optimized",
+                "path": str(optimized)
             }
             
         except Exception as e:
@@ -231,22 +760,260 @@ class FileStorageService:
                 "error": str(e)
             }
     
+    async def get_rendition(self, file_id: str, name: str) -> Optional[Tuple[Path, str]]:
+        """
+        (path, media type) of a named rendition of an uploaded image, rendered on first request
+        
+        Returns None for unknown files, non-images and unknown rendition names.
+        """
+        spec = RENDITIONS.get(name)
+        if spec is None:
+            return None
+        file_info = await self.get_file(file_id)
+        if not file_info or file_info["category"] != "images":
+            return None
+        source = Path(file_info["path"])
+        checksum = file_info.get("checksum") or await asyncio.to_thread(_file_checksum, source)
+        return await self.images.render(source, checksum, spec), MEDIA_TYPES[spec["format"]]
+    
     async def cleanup_temp_files(self, age_hours: int = 24):
         """Clean up temporary files older than specified hours"""
         try:
-            temp_path = self.storage_path / "temp"
-            now = datetime.now().timestamp()
-            age_seconds = age_hours * 3600
-            
-            deleted = 0
-            for file_path in temp_path.glob("*"):
-                if file_path.is_file():
-                    file_age = now - file_path.stat().st_mtime
-                    if file_age > age_seconds:
-                        file_path.unlink()
-                        deleted += 1
-            
-            logger.info(f"Cleaned up {deleted} temporary files")
-            
+            result = await self.sweep_temp(age_hours * 3600)
+            logger.info(f"Cleaned up {result['files']} temporary files")
+            return result
         except Exception as e:
             logger.error(f"Temp file cleanup failed: {e}")
+    
+    async def _sweep(self, directory: Path, min_age_seconds: float, keep) -> Dict[str, int]:
+        """
+        Remove files in `directory` older than `min_age_seconds` unless `keep(batch)` claims them
+        
+        The directory is read SCAN_BATCH entries at a time in a worker thread, so neither
+        the event loop nor memory grows with the number of files.
+        """
+        cutoff = datetime.now(timezone.utc).timestamp() - min_age_seconds
+        removed = {"files": 0, "bytes": 0}
+        loop = asyncio.get_running_loop()
+        entries = await loop.run_in_executor(None, os.scandir, directory)
+        try:
+            while True:
+                batch, exhausted = await loop.run_in_executor(None, _stale_batch, entries, cutoff, SCAN_BATCH)
+                if batch:
+                    kept = await keep([name for name, _, _ in batch])
+                    doomed = [(path, size) for name, path, size in batch if name not in kept]
+                    files, freed = await loop.run_in_executor(None, _unlink_all, doomed)
+                    removed["files"] += files
+                    removed["bytes"] += freed
+                if exhausted:
+                    return removed
+        finally:
+            entries.close()
+    
+    async def sweep_temp(self, max_age_seconds: float) -> Dict[str, int]:
+        """Remove stale temp files, sparing the `.part` files of live resumable uploads"""
+        async def live_sessions(names: List[str]) -> set:
+            if self.sessions_collection is None:
+                return set()
+            upload_ids = [Path(name).stem for name in names if name.endswith(".part")]
+            live = await self.sessions_collection.find(
+                {"upload_id": {"$in": upload_ids}}, {"_id": 0, "upload_id": 1}
+            ).to_list(length=None)
+            return {f"{doc['upload_id']}.part" for doc in live}
+        
+        return await self._sweep(self.storage_path / "temp", max_age_seconds, live_sessions)
+    
+    async def sweep_orphans(self, min_age_seconds: float) -> Dict[str, int]:
+        """
+        Remove stored files that no project_files record or storage object references,
+        and cached renditions whose source checksum is no longer stored
+        """
+        if self.files_collection is None:
+            return {"files": 0, "bytes": 0}
+        
+        async def referenced(names: List[str]) -> set:
+            query = {"stored_filename": {"$in": names}}
+            projection = {"_id": 0, "stored_filename": 1}
+            found = {d["stored_filename"] for d in await self.files_collection.find(query, projection).to_list(length=None)}
+            if self.objects_collection is not None:
+                found |= {d["stored_filename"] for d in await self.objects_collection.find(query, projection).to_list(length=None)}
+            return found
+        
+        async def live_renditions(names: List[str]) -> set:
+            # Rendition files are named "<checksum>-<params>.<ext>"
+            checksums = list({name.split("-", 1)[0] for name in names})
+            query = {"checksum": {"$in": checksums}}
+            projection = {"_id": 0, "checksum": 1}
+            live = {d["checksum"] for d in await self.files_collection.find(query, projection).to_list(length=None)}
+            if self.objects_collection is not None:
+                live |= {d["checksum"] for d in await self.objects_collection.find(query, projection).to_list(length=None)}
+            return {name for name in names if name.split("-", 1)[0] in live}
+        
+        directories = [(self.storage_path / category, referenced) for category in CATEGORIES]
+        derived = await asyncio.to_thread(
+            lambda: sorted(p for p in self.images.cache_path.iterdir() if p.is_dir())
+        )
+        directories += [(prefix, live_renditions) for prefix in derived]
+        
+        removed = {"files": 0, "bytes": 0}
+        for directory, keep in directories:
+            swept = await self._sweep(directory, min_age_seconds, keep)
+            removed["files"] += swept["files"]
+            removed["bytes"] += swept["bytes"]
+        return removed
+
+    def _scan_disk(self) -> Dict[str, Dict[str, Any]]:
+        """stored_filename -> category/size/mtime for every stored file"""
+        found = {}
+        for category in CATEGORIES:
+            with os.scandir(self.storage_path / category) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        found[entry.name] = {
+                            "category": category,
+                            "size": stat.st_size,
+                            "mtime": stat.st_mtime,
+                        }
+        return found
+    
+    async def reconcile_index(self, dry_run: bool = False) -> Dict[str, List[str]]:
+        """
+        Repair drift between project_files, storage_objects and the files on disk
+        
+        Records whose file is gone are removed, files without a record are indexed,
+        records whose size no longer matches the file are re-hashed, and object
+        reference counts are reset to the number of records sharing each file.
+        
+        Returns:
+            file_ids per outcome (missing_on_disk, unindexed, size_mismatch) and
+            the stored filenames whose reference count was wrong (refs_repaired)
+        """
+        if self.files_collection is None:
+            raise RuntimeError("reconcile_index needs a database")
+        
+        on_disk = await asyncio.to_thread(self._scan_disk)
+        report = {"missing_on_disk": [], "unindexed": [], "size_mismatch": [], "refs_repaired": []}
+        # stored_filename -> {checksum, category, size, refs} as the index will look after repair
+        referenced: Dict[str, Dict[str, Any]] = {}
+        
+        async for record in self.files_collection.find(
+            {}, {"_id": 0, "file_id": 1, "category": 1, "stored_filename": 1, "size": 1, "checksum": 1}
+        ):
+            stored_filename = record.get("stored_filename")
+            disk = on_disk.get(stored_filename)
+            if disk is None:
+                report["missing_on_disk"].append(record["file_id"])
+                continue
+            checksum = record.get("checksum")
+            if disk["size"] != record.get("size") or disk["category"] != record.get("category"):
+                report["size_mismatch"].append(record["file_id"])
+                path = self.storage_path / disk["category"] / stored_filename
+                checksum = await asyncio.to_thread(_file_checksum, path)
+                if not dry_run:
+                    await self.files_collection.update_one(
+                        {"file_id": record["file_id"]},
+                        {"$set": {"category": disk["category"], "size": disk["size"], "checksum": checksum}}
+                    )
+            ref = referenced.setdefault(
+                stored_filename, {"checksum": checksum, "category": disk["category"], "size": disk["size"], "refs": 0}
+            )
+            ref["refs"] += 1
+        
+        if report["missing_on_disk"] and not dry_run:
+            await self.files_collection.delete_many({"file_id": {"$in": report["missing_on_disk"]}})
+        
+        for stored_filename, disk in on_disk.items():
+            if stored_filename in referenced:
+                continue
+            file_id = Path(stored_filename).stem
+            report["unindexed"].append(file_id)
+            path = self.storage_path / disk["category"] / stored_filename
+            checksum = await asyncio.to_thread(_file_checksum, path)
+            referenced[stored_filename] = {
+                "checksum": checksum, "category": disk["category"], "size": disk["size"], "refs": 1
+            }
+            if dry_run:
+                continue
+            mime_type, _ = mimetypes.guess_type(stored_filename)
+            await self.files_collection.insert_one({
+                "file_id": file_id,
+                "filename": stored_filename,
+                "stored_filename": stored_filename,
+                "url": f"/storage/{disk['category']}/{stored_filename}",
+                "category": disk["category"],
+                "mime_type": mime_type or "application/octet-stream",
+                "size": disk["size"],
+                "checksum": checksum,
+                "user_id": None,
+                "project_id": None,
+                "uploaded_at": datetime.fromtimestamp(disk["mtime"], timezone.utc).isoformat(),
+            })
+        
+        if self.objects_collection is not None:
+            async for obj in self.objects_collection.find(
+                {}, {"_id": 0, "checksum": 1, "stored_filename": 1, "refs": 1}
+            ):
+                expected = referenced.get(obj["stored_filename"])
+                refs = 0
+                if expected and expected["checksum"] == obj["checksum"]:
+                    refs = referenced.pop(obj["stored_filename"])["refs"]
+                if refs == obj.get("refs"):
+                    continue
+                report["refs_repaired"].append(obj["stored_filename"])
+                if dry_run:
+                    continue
+                if refs:
+                    await self.objects_collection.update_one({"checksum": obj["checksum"]}, {"$set": {"refs": refs}})
+                else:
+                    await self.objects_collection.delete_one({"checksum": obj["checksum"]})
+            # Shared files with no object (e.g. indexed before reference counting) get one
+            for stored_filename, ref in referenced.items():
+                if not ref["checksum"]:
+                    continue
+                if stored_filename not in report["refs_repaired"]:
+                    report["refs_repaired"].append(stored_filename)
+                if dry_run:
+                    continue
+                await self.objects_collection.update_one(
+                    {"checksum": ref["checksum"]},
+                    {"$setOnInsert": {
+                        "checksum": ref["checksum"],
+                        "category": ref["category"],
+                        "stored_filename": stored_filename,
+                        "size": ref["size"],
+                        "refs": ref["refs"],
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                    }},
+                    upsert=True
+                )
+        
+        logger.info(
+            f"Storage index reconcile{' (dry run)' if dry_run else ''}: "
+            + ", ".join(f"{len(ids)} {key}" for key, ids in report.items())
+        )
+        return report
+
+
+async def _main(dry_run: bool) -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[os.environ.get("DB_NAME", "digital_ninja_app")]
+    storage = FileStorageService(db=db)
+    report = await storage.reconcile_index(dry_run=dry_run)
+    for key, file_ids in report.items():
+        print(f"{key}: {len(file_ids)}")
+        for file_id in file_ids:
+            print(f"  - {file_id}")
+    client.close()
+
+
+if __name__ == "__main__":
+    # python file_storage_service.py reconcile [--dry-run]
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:2] != ["reconcile"]:
+        sys.exit("usage: python file_storage_service.py reconcile [--dry-run]")
+    asyncio.run(_main(dry_run="--dry-run" in sys.argv))
@@ -0,0 +1,152 @@
+"""
+Image Pipeline
+Resizes and re-encodes uploaded images on a process pool, so large images never
+block the event loop. Output goes to a derived-assets cache keyed by the source
+checksum and the rendition parameters; originals are never modified.
+"""
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    "thumb": {"width": 320, "format": "JPEG", "quality": 75},
+    "web": {"width": 1600, "format": "JPEG", "quality": 82},
+    "webp": {"width": 1600, "format": "WEBP", "quality": 80},
+}
+
+MEDIA_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+
+def _render(source: str, dest: str, width: int, fmt: str, quality: int) -> Dict[str, int]:
+    """Runs in a worker process: scale `source` down to `width` and save it as `fmt`"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as opened:
+        img = ImageOps.exif_transpose(opened)
+        if img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+        if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+            rgba = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.split()[-1])
+            img = background
+        temp = f"{dest}.{os.getpid()}.tmp"
+        img.save(temp, fmt, quality=quality, optimize=True)
+        os.replace(temp, dest)
+        return {"width": img.width, "height": img.height}
+
+
+class ImagePipeline:
+    """Lazily generated, cached image renditions rendered off the event loop"""
+
+    def __init__(self, cache_path: Path, max_workers: Optional[int] = None):
+        self.cache_path = Path(cache_path)
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max_workers or int(os.getenv("IMAGE_PIPELINE_WORKERS", str(min(2, os.cpu_count() or 1))))
+        self.available = importlib.util.find_spec("PIL") is not None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.generated = 0
+        self.failed = 0
+        self.pool_restarts = 0
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # Never fork: a forked worker inherits the event loop, the Mongo client's
+        # threads and their held locks from the server process
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context(method))
+
+    def rendition_path(self, checksum: str, spec: Dict[str, Any]) -> Path:
+        name = f"{checksum}-{spec['width']}w-q{spec['quality']}.{EXTENSIONS[spec['format']]}"
+        return self.cache_path / checksum[:2] / name
+
+    def discard(self, checksum: str) -> int:
+        """Delete every cached rendition of `checksum`; returns how many files went"""
+        removed = 0
+        try:
+            with os.scandir(self.cache_path / checksum[:2]) as entries:
+                doomed = [entry.path for entry in entries if entry.name.startswith(f"{checksum}-")]
+        except FileNotFoundError:
+            return 0
+        for path in doomed:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+        return removed
+
+    async def render(self, source: Path, checksum: str, spec: Dict[str, Any]) -> Path:
+        """
+        Path of the rendition of `source` described by `spec` (width/format/quality)
+
+        Concurrent requests for the same rendition share one render.
+        """
+        dest = self.rendition_path(checksum, spec)
+        if dest.exists():
+            self.hits += 1
+            return dest
+        if not self.available:
+            raise RuntimeError("Image processing unavailable: Pillow is not installed")
+
+        key = str(dest)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._run(source, dest, spec))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        # Shielded so one cancelled request does not abort the render others are waiting for
+        return await asyncio.shield(pending)
+
+    async def _run(self, source: Path, dest: Path, spec: Dict[str, Any]) -> Path:
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        args = (str(source), str(dest), spec["width"], spec["format"], spec["quality"])
+        try:
+            for attempt in range(2):
+                if self._executor is None:
+                    self._executor = self._new_executor()
+                executor = self._executor
+                try:
+                    await loop.run_in_executor(executor, _render, *args)
+                    break
+                except BrokenProcessPool:
+                    # A worker died (OOM kill, segfault in a codec): replace the pool once
+                    if self._executor is executor:
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        self._executor = None
+                        self.pool_restarts += 1
+                    if attempt:
+                        raise
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Rendering {dest.name} from {source} failed: {e}")
+            raise
+        self.generated += 1
+        return dest
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "available": self.available,
+            "max_workers": self.max_workers,
+            "in_flight": len(self._pending),
+            "hits": self.hits,
+            "generated": self.generated,
+            "failed": self.failed,
+            "pool_restarts": self.pool_restarts,
+        }
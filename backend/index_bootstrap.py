@@ -0,0 +1,245 @@
+"""
+Index Bootstrap
+Declares the indexes behind every hot query path and creates them idempotently.
+Runs at API startup; also usable from the command line:
+
+    python index_bootstrap.py --dry-run
+"""
+import asyncio
+import logging
+import os
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ASC = 1
+DESC = -1
+
+# Raw analytics events / metric samples; dashboards read the rollups, which outlive these
+ANALYTICS_RAW_TTL_SECONDS = int(os.getenv("ANALYTICS_RAW_TTL_DAYS", "90")) * 86400
+METRICS_RAW_TTL_SECONDS = int(os.getenv("METRICS_RAW_TTL_DAYS", "30")) * 86400
+
+# (collection, keys, options). Names are explicit so reports stay readable.
+INDEX_SPECS: List[Tuple[str, List[Tuple[str, int]], Dict[str, Any]]] = [
+    # Projects
+    ("projects", [("project_id", ASC), ("user_id", ASC)], {"name": "projects_id_user"}),
+    ("projects", [("user_id", ASC)], {"name": "projects_user"}),
+    ("projects", [("user_id", ASC), ("updated_at", DESC), ("project_id", DESC)], {"name": "projects_user_updated_id"}),
+    # Write-key lookup for the public analytics ingest endpoint
+    ("projects", [("analytics_write_key_hash", ASC)], {"name": "projects_analytics_write_key", "unique": True, "sparse": True}),
+    ("file_blobs", [("blob_hash", ASC)], {"name": "file_blobs_hash", "unique": True}),
+    ("file_blobs", [("referenced_at", ASC)], {"name": "file_blobs_referenced"}),
+    ("generation_cache", [("cache_key", ASC)], {"name": "generation_cache_key", "unique": True}),
+    ("generation_cache", [("expires_at", ASC)], {"name": "generation_cache_ttl", "expireAfterSeconds": 0}),
+
+    # Users & teams (email is not unique: historical data may hold duplicates)
+    ("users", [("email", ASC)], {"name": "users_email"}),
+    ("users", [("user_id", ASC)], {"name": "users_user_id", "unique": True}),
+    ("users", [("team_id", ASC)], {"name": "users_team"}),
+    ("teams", [("team_id", ASC)], {"name": "teams_team_id", "unique": True}),
+
+    # Version control
+    ("project_snapshots", [("project_id", ASC), ("content_hash", ASC)], {"name": "snapshots_project_hash"}),
+    ("project_snapshots", [("project_id", ASC), ("created_at", DESC)], {"name": "snapshots_project_created"}),
+    ("project_snapshots", [("snapshot_id", ASC)], {"name": "snapshots_snapshot_id"}),
+    ("project_snapshots", [("project_id", ASC), ("keyframe_id", ASC)], {"name": "snapshots_project_keyframe"}),
+    ("project_snapshots", [("project_id", ASC), ("parent_id", ASC)], {"name": "snapshots_project_parent"}),
+
+    # Analytics
+    ("analytics", [("project_id", ASC), ("created_at", DESC)], {"name": "analytics_project_created"}),
+    ("metrics", [("project_id", ASC), ("metric_name", ASC), ("created_at", DESC)], {"name": "metrics_project_name_created"}),
+    ("analytics", [("created_at", ASC)], {"name": "analytics_raw_ttl", "expireAfterSeconds": ANALYTICS_RAW_TTL_SECONDS}),
+    ("metrics", [("created_at", ASC)], {"name": "metrics_raw_ttl", "expireAfterSeconds": METRICS_RAW_TTL_SECONDS}),
+    ("analytics_rollups", [("project_id", ASC), ("granularity", ASC), ("bucket", ASC)], {"name": "analytics_rollups_bucket", "unique": True}),
+    ("analytics_rollups", [("expires_at", ASC)], {"name": "analytics_rollups_ttl", "expireAfterSeconds": 0}),
+    ("analytics_rollup_users", [("project_id", ASC), ("day", ASC), ("user_id", ASC)], {"name": "analytics_rollup_users_day", "unique": True}),
+    ("metrics_rollups", [("project_id", ASC), ("granularity", ASC), ("bucket", ASC), ("metric_name", ASC)], {"name": "metrics_rollups_bucket", "unique": True}),
+    ("metrics_rollups", [("expires_at", ASC)], {"name": "metrics_rollups_ttl", "expireAfterSeconds": 0}),
+
+    # Uploads
+    ("project_files", [("project_id", ASC), ("uploaded_at", DESC)], {"name": "project_files_project_uploaded"}),
+    ("project_files", [("file_id", ASC)], {"name": "project_files_file_id", "unique": True}),
+    ("project_files", [("stored_filename", ASC)], {"name": "project_files_stored_filename"}),
+    ("storage_objects", [("checksum", ASC)], {"name": "storage_objects_checksum", "unique": True}),
+    ("upload_sessions", [("upload_id", ASC)], {"name": "upload_sessions_upload_id", "unique": True}),
+    ("upload_sessions", [("expires_at", ASC)], {"name": "upload_sessions_ttl", "expireAfterSeconds": 0}),
+
+    # CRM / content modules (routes_extensions)
+    ("contacts", [("team_id", ASC)], {"name": "contacts_team"}),
+    ("leads", [("team_id", ASC)], {"name": "leads_team"}),
+    ("blog_posts", [("team_id", ASC), ("created_at", DESC)], {"name": "blog_posts_team_created"}),
+    ("landing_pages", [("team_id", ASC)], {"name": "landing_pages_team"}),
+]
+
+
+# Options compared against the live index; the name is not (older deployments use default names)
+COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+
+class IndexBootstrap:
+    """Compare declared indexes with the database and create what is missing"""
+
+    def __init__(self, db, specs: Optional[List[Tuple[str, List[Tuple[str, int]], Dict[str, Any]]]] = None):
+        self.db = db
+        self.specs = specs if specs is not None else INDEX_SPECS
+        self.last_report: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def _key_tuple(keys) -> Tuple[Tuple[str, Any], ...]:
+        # Server-reported directions may be floats (1.0); text/2dsphere/hashed stay strings
+        return tuple(
+            (field, int(direction) if isinstance(direction, (int, float)) else direction)
+            for field, direction in keys
+        )
+
+    async def _existing_indexes(self, collection_name: str) -> Dict[Tuple, Dict]:
+        indexes = await self.db[collection_name].index_information()
+        return {
+            self._key_tuple(info["key"]): {"name": name, **info}
+            for name, info in indexes.items()
+        }
+
+    @staticmethod
+    def _option_diff(declared: Dict[str, Any], existing: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """{option: {"declared": ..., "existing": ...}} for every compared option that differs"""
+        diff = {}
+        for option in COMPARED_OPTIONS:
+            want, have = declared.get(option), existing.get(option)
+            if option in ("unique", "sparse"):
+                want, have = bool(want), bool(have)
+            elif option == "expireAfterSeconds" and have is not None:
+                have = int(have)
+            if want != have:
+                diff[option] = {"declared": want, "existing": have}
+        return diff
+
+    async def _unused_indexes(self, collection_name: str) -> List[str]:
+        """Indexes with zero recorded accesses since the server last restarted"""
+        try:
+            stats = await self.db[collection_name].aggregate([{"$indexStats": {}}]).to_list(length=None)
+        except Exception as e:
+            logger.debug(f"$indexStats unavailable for {collection_name}: {e}")
+            return []
+        return [
+            f"{collection_name}.{s['name']}"
+            for s in stats
+            if s.get("name") != "_id_" and int(s.get("accesses", {}).get("ops", 0)) == 0
+        ]
+
+    async def ensure_indexes(self, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Create missing declared indexes
+
+        Args:
+            dry_run: Only report what would be created
+
+        Returns:
+            Report with present, created, missing, mismatched, modified, failed,
+            undeclared and unused indexes
+
+        A TTL that differs from the declared expireAfterSeconds is changed in place
+        with collMod; other option differences (unique, sparse, partial filter) need
+        a rebuild and are only reported as mismatched.
+        """
+        report: Dict[str, Any] = {
+            "dry_run": dry_run,
+            "present": [],
+            "created": [],
+            "missing": [],
+            "mismatched": [],
+            "modified": [],
+            "failed": [],
+            "undeclared": [],
+            "unused": [],
+        }
+
+        declared_by_collection: Dict[str, set] = {}
+        for collection_name, keys, options in self.specs:
+            declared_by_collection.setdefault(collection_name, set()).add(self._key_tuple(keys))
+
+        for collection_name in declared_by_collection:
+            try:
+                existing = await self._existing_indexes(collection_name)
+            except Exception as e:
+                report["failed"].append({"collection": collection_name, "error": str(e)})
+                continue
+
+            for spec_collection, keys, options in self.specs:
+                if spec_collection != collection_name:
+                    continue
+                label = f"{collection_name}.{options['name']}"
+                current = existing.get(self._key_tuple(keys))
+                if current is not None:
+                    diff = self._option_diff(options, current)
+                    if not diff:
+                        report["present"].append(label)
+                        continue
+                    ttl_only = set(diff) == {"expireAfterSeconds"} and None not in diff["expireAfterSeconds"].values()
+                    if dry_run or not ttl_only:
+                        report["mismatched"].append({"index": label, "existing": current["name"], "options": diff})
+                        continue
+                    try:
+                        await self.db.command(
+                            "collMod", collection_name,
+                            index={"name": current["name"], "expireAfterSeconds": options["expireAfterSeconds"]}
+                        )
+                        report["modified"].append(label)
+                    except Exception as e:
+                        logger.error(f"Failed to update TTL of index {label}: {e}")
+                        report["failed"].append({"index": label, "error": str(e)})
+                    continue
+                if dry_run:
+                    report["missing"].append(label)
+                    continue
+                try:
+                    await self.db[collection_name].create_index(keys, **options)
+                    report["created"].append(label)
+                except Exception as e:
+                    logger.error(f"Failed to create index {label}: {e}")
+                    report["failed"].append({"index": label, "error": str(e)})
+
+            report["undeclared"].extend(
+                f"{collection_name}.{info['name']}"
+                for key, info in existing.items()
+                if info["name"] != "_id_" and key not in declared_by_collection[collection_name]
+            )
+            report["unused"].extend(await self._unused_indexes(collection_name))
+
+        self.last_report = report
+        logger.info(
+            f"Index bootstrap{' (dry run)' if dry_run else ''}: "
+            f"{len(report['present'])} present, {len(report['created'])} created, "
+            f"{len(report['missing'])} missing, {len(report['mismatched'])} mismatched, "
+            f"{len(report['modified'])} modified, {len(report['failed'])} failed, "
+            f"{len(report['unused'])} unused"
+        )
+        return report
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.last_report:
+            return {"status": "pending"}
+        return {
+            "status": "complete",
+            **{key: len(value) if isinstance(value, list) else value for key, value in self.last_report.items()},
+        }
+
+
+async def _main(dry_run: bool) -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[os.environ.get("DB_NAME", "digital_ninja_app")]
+    report = await IndexBootstrap(db).ensure_indexes(dry_run=dry_run)
+    for key in ("present", "created", "missing", "mismatched", "modified", "failed", "undeclared", "unused"):
+        print(f"{key}: {len(report[key])}")
+        for item in report[key]:
+            print(f"  - {item}")
+    client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(dry_run="--dry-run" in sys.argv))
@@ -0,0 +1,245 @@
+"""
+Ingest Buffer
+In-process write buffer for high-volume, fire-and-forget documents (analytics
+events, performance metrics). Callers enqueue without a database round trip; a
+background task flushes batches on a size or time threshold. Memory is bounded:
+past `max_queued` documents are either dropped or spilled to an append-only
+file that is replayed once the database keeps up again. Each worker process
+spills to its own file; files left behind by workers that have exited are
+replayed by whichever worker finds them first.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from bson import ObjectId, json_util
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("spill", "drop")
+
+_JSON_OPTIONS = json_util.JSONOptions(tz_aware=True, tzinfo=timezone.utc)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IngestBuffer:
+    """
+    Bounded queue flushed in batches by `flush_batch(docs)`
+
+    `flush_batch` returns how many documents the database rejected outright (they
+    are counted, not retried) and raises on transient failures, in which case the
+    batch is put back and retried on the next flush. Every document gets its _id
+    when it is queued, so a retried insert of a batch that partly landed is
+    rejected as a duplicate rather than stored twice.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush_batch: Callable[[List[Dict[str, Any]]], Awaitable[int]],
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_queued: Optional[int] = None,
+        overflow: Optional[str] = None,
+        spill_path: Optional[str] = None
+    ):
+        self.name = name
+        self.flush_batch = flush_batch
+        self.batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", "500"))
+        self.flush_interval = flush_interval or float(os.getenv("INGEST_FLUSH_SECONDS", "1"))
+        self.max_queued = max_queued or int(os.getenv("INGEST_MAX_QUEUED", "50000"))
+        self.overflow = (overflow or os.getenv("INGEST_OVERFLOW", "spill")).lower()
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {self.overflow!r}; expected one of {OVERFLOW_POLICIES}")
+        self.spill_dir = Path(spill_path or os.getenv("INGEST_SPILL_PATH", "./storage/ingest_spill"))
+        # One file per process: workers never append to, or replay, each other's live file
+        self.pid = os.getpid()
+        self.spill_file = self.spill_dir / f"{name}.{self.pid}.jsonl"
+        self._replay_file = self.spill_dir / f"{name}.{self.pid}.replay"
+        self._leftover_name = re.compile(rf"{re.escape(name)}\.(\d+)\.(jsonl|replay)")
+
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._spill_handle = None
+        self._task: Optional[asyncio.Task] = None
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_flush: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._task and not self._task.done())
+
+    def add(self, doc: Dict[str, Any]) -> bool:
+        """Queue one document; False if it was dropped because the buffer is full"""
+        doc.setdefault("_id", ObjectId())
+        if len(self._queue) >= self.max_queued:
+            if self.overflow == "drop" or not self._spill(doc):
+                self.dropped += 1
+                return False
+            return True
+        self._queue.append(doc)
+        self.queued += 1
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def _spill(self, doc: Dict[str, Any]) -> bool:
+        try:
+            if self._spill_handle is None:
+                self.spill_file.parent.mkdir(parents=True, exist_ok=True)
+                self._spill_handle = open(self.spill_file, "a", encoding="utf-8")
+            self._spill_handle.write(json_util.dumps(doc, json_options=_JSON_OPTIONS) + "\n")
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Ingest buffer {self.name}: spill to {self.spill_file} failed: {e}")
+            return False
+        self.spilled += 1
+        return True
+
+    def _close_spill(self) -> None:
+        if self._spill_handle is not None:
+            self._spill_handle.close()
+            self._spill_handle = None
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        rejected = await self.flush_batch(batch)
+        self.batches += 1
+        self.rejected += rejected
+        self.flushed += len(batch) - rejected
+
+    async def flush(self) -> int:
+        """Write everything queued (then anything spilled) in batches; returns documents written"""
+        async with self._lock:
+            started, before = time.monotonic(), self.flushed
+            try:
+                while self._queue:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                    try:
+                        await self._write(batch)
+                    except BaseException:
+                        # Back to the front, in order; the next flush retries
+                        self._queue.extendleft(reversed(batch))
+                        raise
+                await self._replay_spill()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ingest buffer {self.name}: flush failed, {len(self._queue)} documents kept queued: {e}")
+            written = self.flushed - before
+            if written:
+                self.last_flush = {
+                    "documents": written,
+                    "finished_at": datetime.now(timezone.utc).isoformat(),
+                    "duration_seconds": round(time.monotonic() - started, 3),
+                }
+            return written
+
+    def _leftover_spills(self) -> List[Path]:
+        """Spill and interrupted replay files of this buffer's name whose process has exited"""
+        if not self.spill_dir.is_dir():
+            return []
+        leftovers = []
+        for path in self.spill_dir.iterdir():
+            found = self._leftover_name.fullmatch(path.name)
+            if found and int(found.group(1)) != self.pid and not _process_alive(int(found.group(1))):
+                leftovers.append(path)
+        return sorted(leftovers)
+
+    async def _replay_spill(self) -> None:
+        self._close_spill()
+        # A replay of our own that was interrupted first, then our spill file, then dead workers' files
+        for path in [self._replay_file, self.spill_file] + self._leftover_spills():
+            await self._replay_file_contents(path)
+
+    async def _replay_file_contents(self, path: Path) -> None:
+        if path != self._replay_file:
+            try:
+                # The rename claims the file: of several workers finding it, one wins
+                os.replace(path, self._replay_file)
+            except FileNotFoundError:
+                return
+        elif not path.exists():
+            return
+        replaying = self._replay_file
+        with open(replaying, encoding="utf-8") as handle:
+            while True:
+                chunk = [line for line in (handle.readline() for _ in range(self.batch_size)) if line.strip()]
+                if not chunk:
+                    break
+                try:
+                    await self._write([json_util.loads(line, json_options=_JSON_OPTIONS) for line in chunk])
+                except BaseException:
+                    # Whatever is left goes back to our spill file for the next attempt
+                    with open(self.spill_file, "a", encoding="utf-8") as rest:
+                        rest.writelines(chunk)
+                        rest.writelines(handle)
+                    replaying.unlink()
+                    raise
+                self.replayed += len(chunk)
+        replaying.unlink()
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Stop the flusher and write out what is queued; spill whatever cannot be written"""
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        await self.flush()
+        while self._queue:
+            doc = self._queue.popleft()
+            if self.overflow == "drop" or not self._spill(doc):
+                self.dropped += 1
+        self._close_spill()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "pending": len(self._queue),
+            "queued": self.queued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "batches": self.batches,
+            "errors": self.errors,
+            "overflow": self.overflow,
+            "last_flush": self.last_flush,
+        }
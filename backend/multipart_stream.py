@@ -0,0 +1,100 @@
+"""
+Multipart Stream
+Incremental multipart/form-data parser: body bytes are yielded as they arrive,
+so an upload can be written to disk without ever being held in memory.
+"""
+import re
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+MAX_HEADER_BYTES = 16 * 1024
+
+_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+_PARAM_RE = re.compile(r';\s*([\w*-]+)="?([^";]*)"?')
+
+
+class MultipartError(ValueError):
+    """Malformed multipart body"""
+
+
+def parse_boundary(content_type: Optional[str]) -> bytes:
+    if not content_type or not content_type.lower().startswith("multipart/form-data"):
+        raise MultipartError("Expected multipart/form-data")
+    match = _BOUNDARY_RE.search(content_type)
+    if not match:
+        raise MultipartError("Missing multipart boundary")
+    return match.group(1).encode("latin-1")
+
+
+def disposition_params(headers: Dict[str, str]) -> Dict[str, str]:
+    """name/filename parameters of a part's Content-Disposition header"""
+    return {key.lower(): value for key, value in _PARAM_RE.findall(headers.get("content-disposition", ""))}
+
+
+def _parse_headers(block: bytes) -> Dict[str, str]:
+    headers = {}
+    for line in block.decode("utf-8", "replace").split("\r\n"):
+        if ":" in line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+async def iter_parts(
+    stream: AsyncIterator[bytes],
+    boundary: bytes
+) -> AsyncIterator[Tuple[str, object]]:
+    """
+    Yield ("headers", dict) at the start of each part, ("data", bytes) for its body
+    in arrival-sized pieces, and ("end", None) when the part closes.
+
+    At most one delimiter's worth of body is held back between chunks.
+    """
+    opening = b"--" + boundary
+    delimiter = b"\r\n" + opening
+    buffer = b""
+    state = "preamble"
+
+    async for chunk in stream:
+        buffer += chunk
+        while True:
+            if state == "preamble":
+                index = buffer.find(opening)
+                if index < 0:
+                    buffer = buffer[-len(opening):]
+                    break
+                buffer = buffer[index + len(opening):]
+                state = "after_delimiter"
+            elif state == "after_delimiter":
+                if len(buffer) < 2:
+                    break
+                if buffer.startswith(b"--"):
+                    return
+                if not buffer.startswith(b"\r\n"):
+                    raise MultipartError("Malformed multipart delimiter")
+                buffer = buffer[2:]
+                state = "headers"
+            elif state == "headers":
+                index = buffer.find(b"\r\n\r\n")
+                if index < 0:
+                    if len(buffer) > MAX_HEADER_BYTES:
+                        raise MultipartError("Multipart headers too large")
+                    break
+                yield "headers", _parse_headers(buffer[:index])
+                buffer = buffer[index + 4:]
+                state = "body"
+            else:
+                index = buffer.find(delimiter)
+                if index < 0:
+                    # Keep a possible partial delimiter for the next chunk
+                    keep = len(delimiter) - 1
+                    if len(buffer) > keep:
+                        yield "data", buffer[:-keep]
+                        buffer = buffer[-keep:]
+                    break
+                if index:
+                    yield "data", buffer[:index]
+                yield "end", None
+                buffer = buffer[index + len(delimiter):]
+                state = "after_delimiter"
+
+    raise MultipartError("Multipart body ended early")
@@ -0,0 +1,334 @@
+"""
+Parallel App Generator
+Two-phase generation: one cheap planning call produces the file manifest and the
+interfaces between files, then every file body is generated concurrently.
+Wall-clock time follows the slowest file instead of the sum of all files, and no
+single response has to fit the whole app.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from services.generation_cache import generation_cache
+from services.llm_clients import llm_clients
+from streaming_json import FilesArrayParser
+
+logger = logging.getLogger(__name__)
+
+MAX_PLANNED_FILES = 40
+# Follow-up requests allowed when a file body hits max_tokens
+MAX_CONTINUATIONS = int(os.getenv("GENERATION_FILE_MAX_CONTINUATIONS", "2"))
+
+PLAN_PROMPT = """You are a senior full-stack architect. Plan the files for the application the user asks for.
+Do NOT write file contents. Return ONLY valid JSON:
+{{
+  "app_name": "Professional App Name",
+  "description": "One paragraph description",
+  "files": [
+    {{
+      "path": "frontend/src/App.js",
+      "language": "javascript",
+      "purpose": "What this file does",
+      "exports": ["App (default) - root component with routes"],
+      "imports": ["Header from ./components/Header"]
+    }}
+  ]
+}}
+
+Rules:
+- Scale the number of files to the request (a calculator needs 3-5 files, a clone 15-30), at most {max_files}
+- Always include frontend/package.json listing every dependency the files will import
+- `exports` must name every component, function, prop and route other files rely on
+- Paths are unique and relative to the repository root
+
+{context}"""
+
+FILE_PROMPT = """You are writing ONE file of an application that is being generated in parallel.
+Other files are written at the same time by other developers, so follow the plan exactly:
+import only what the plan exports, and export exactly what the plan says this file exports.
+
+APPLICATION: {app_name} - {description}
+USER REQUEST: {prompt}
+{context}
+
+FULL PLAN:
+{manifest}
+
+Write the COMPLETE contents of `{path}` ({language}).
+Purpose: {purpose}
+No placeholders, no Lorem Ipsum, no "Product 1". Return ONLY the file contents, no Markdown fences."""
+
+
+CONTINUE_PROMPT = (
+    "Your reply was cut off. Continue the file exactly where it stopped: no repetition, "
+    "no commentary, no Markdown fences."
+)
+
+_COMMENT_STYLES = {
+    (".py", ".txt", ".yml", ".yaml", ".toml", ".sh", ".env", ".example", ".cfg", ".ini"): ("# ", ""),
+    (".css", ".scss"): ("/* ", " */"),
+    (".html", ".md", ".svg", ".xml"): ("<!-- ", " -->"),
+}
+
+
+class FileTruncated(ValueError):
+    """A file body still hit max_tokens after every continuation"""
+
+
+def stub_file(entry: Dict[str, Any], reason: str) -> Dict[str, Any]:
+    """Placeholder for a file that could not be generated, so the rest of the app survives"""
+    path = entry["path"]
+    note = f"Generation failed for {path} ({reason}). Regenerate this file from the editor."
+    if path.endswith(".json"):
+        content = "{}\n"
+    else:
+        prefix, suffix = next(
+            (style for suffixes, style in _COMMENT_STYLES.items() if path.endswith(suffixes)),
+            ("// ", "")
+        )
+        content = f"{prefix}{note}{suffix}\n"
+        if path.endswith((".js", ".jsx", ".ts", ".tsx")):
+            content += "export default function Placeholder() {\n  return null;\n}\n"
+    return {"path": path, "content": content, "language": entry.get("language", "")}
+
+
+def _strip_fences(text: str) -> str:
+    match = re.match(r"^\s*```[\w.+-]*\n(.*?)\n?```\s*$", text, re.DOTALL)
+    return match.group(1) if match else text.strip("\n")
+
+
+class ParallelAppGenerator:
+    """Plan once with a cheap model, then generate file bodies concurrently"""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = "gpt-4o",
+        plan_model: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        file_max_tokens: Optional[int] = None,
+    ):
+        self.api_key = api_key
+        self.model = model
+        self.plan_model = plan_model or os.getenv("GENERATION_PLAN_MODEL", "gpt-4o-mini")
+        self.max_concurrency = max_concurrency or int(os.getenv("GENERATION_FILE_CONCURRENCY", "6"))
+        self.file_max_tokens = file_max_tokens or int(os.getenv("GENERATION_FILE_MAX_TOKENS", "4000"))
+
+    async def plan(self, prompt: str, context: str = "") -> Dict[str, Any]:
+        """Ask for the manifest and cross-file interfaces only"""
+        response = await llm_clients.chat_completion(
+            api_key=self.api_key,
+            model=self.plan_model,
+            messages=[
+                {"role": "system", "content": PLAN_PROMPT.format(max_files=MAX_PLANNED_FILES, context=context)},
+                {"role": "user", "content": f"Build this: {prompt}"}
+            ],
+            temperature=0.4,
+            response_format={"type": "json_object"},
+        )
+        plan = json.loads(response.choices[0].message.content)
+
+        seen = set()
+        entries = []
+        for entry in plan.get("files", []):
+            path = (entry.get("path") or "").strip()
+            if path and path not in seen:
+                seen.add(path)
+                entries.append({**entry, "path": path})
+        if not entries:
+            raise ValueError("Plan contains no files")
+        if len(entries) > MAX_PLANNED_FILES:
+            logger.warning(f"Plan has {len(entries)} files, keeping the first {MAX_PLANNED_FILES}")
+            entries = entries[:MAX_PLANNED_FILES]
+        plan["files"] = entries
+        logger.info(f"Planned {len(entries)} files for: {prompt}")
+        return plan
+
+    async def generate_file(self, plan: Dict, entry: Dict, prompt: str, context: str = "") -> Dict[str, Any]:
+        manifest = json.dumps(
+            [{k: e.get(k) for k in ("path", "purpose", "exports", "imports")} for e in plan["files"]],
+            indent=1
+        )
+        message = FILE_PROMPT.format(
+            app_name=plan.get("app_name", "App"),
+            description=plan.get("description", ""),
+            prompt=prompt,
+            context=context,
+            manifest=manifest,
+            path=entry["path"],
+            language=entry.get("language", ""),
+            purpose=entry.get("purpose", ""),
+        )
+        messages = [{"role": "user", "content": message}]
+        content = ""
+        # A truncated body is continued from where it stopped; re-asking would truncate again
+        for _ in range(MAX_CONTINUATIONS + 1):
+            response = await llm_clients.chat_completion(
+                api_key=self.api_key,
+                model=self.model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=self.file_max_tokens,
+            )
+            choice = response.choices[0]
+            content += choice.message.content or ""
+            if choice.finish_reason != "length":
+                return {
+                    "path": entry["path"],
+                    "content": _strip_fences(content),
+                    "language": entry.get("language", ""),
+                }
+            messages = [
+                {"role": "user", "content": message},
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": CONTINUE_PROMPT},
+            ]
+        raise FileTruncated(f"{entry['path']} was still truncated after {MAX_CONTINUATIONS} continuations")
+
+    async def _generate_file_with_retry(self, plan: Dict, entry: Dict, prompt: str, context: str) -> Dict:
+        """The generated file, or {"file": stub, "error": ...} once retries are exhausted"""
+        try:
+            return {"file": await self.generate_file(plan, entry, prompt, context)}
+        except FileTruncated as e:
+            error = str(e)
+        except Exception as e:
+            logger.warning(f"Retrying {entry['path']}: {e}")
+            try:
+                return {"file": await self.generate_file(plan, entry, prompt, context)}
+            except Exception as e:
+                error = str(e)
+        logger.error(f"Giving up on {entry['path']}, using a placeholder: {error}")
+        return {"file": stub_file(entry, error), "error": error}
+
+    async def stream(self, prompt: str, context: str = "") -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield {"type": "plan", "plan": ...} once, then {"type": "file", "file": ...}
+        for every file in completion order. A file that cannot be generated is
+        yielded as a placeholder with an extra "error" key; only planning failures raise.
+        """
+        plan = await self.plan(prompt, context)
+        yield {"type": "plan", "plan": plan}
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded(entry):
+            async with semaphore:
+                return await self._generate_file_with_retry(plan, entry, prompt, context)
+
+        tasks = [asyncio.create_task(bounded(entry)) for entry in plan["files"]]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield {"type": "file", **(await next_done)}
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def assemble(
+        plan: Dict[str, Any],
+        files_by_path: Dict[str, Dict],
+        errors: Optional[List[Dict[str, str]]] = None
+    ) -> Dict[str, Any]:
+        """
+        App structure (app_name, description, files in plan order) from a plan and its
+        generated files, plus `errors` ({"path", "error"}) for placeholder files
+        """
+        files: List[Dict] = [files_by_path[e["path"]] for e in plan.get("files", []) if e["path"] in files_by_path]
+        structure = {
+            "app_name": plan.get("app_name", "Generated App"),
+            "description": plan.get("description", ""),
+            "files": files,
+        }
+        if errors:
+            structure["errors"] = errors
+        return structure
+
+    async def generate(self, prompt: str, context: str = "") -> Dict[str, Any]:
+        """Non-streaming form of `stream`"""
+        plan: Dict[str, Any] = {}
+        by_path: Dict[str, Dict] = {}
+        errors: List[Dict[str, str]] = []
+        async for event in self.stream(prompt, context):
+            if event["type"] == "plan":
+                plan = event["plan"]
+            else:
+                by_path[event["file"]["path"]] = event["file"]
+                if "error" in event:
+                    errors.append({"path": event["file"]["path"], "error": event["error"]})
+        return self.assemble(plan, by_path, errors)
+
+
+async def stream_app(
+    cache_key: str,
+    use_cache: bool,
+    generator: Optional[ParallelAppGenerator],
+    prompt: str,
+    context: str,
+    model_stream: Callable[[], AsyncIterator[str]],
+    finalize: Callable[[str], Dict[str, Any]],
+    post_process: Callable[[Dict[str, Any]], Dict[str, Any]],
+    fallback: Callable[[], Dict[str, Any]],
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Event stream shared by the builders' stream_app_structure
+
+    With a `generator` yields {"type": "plan", "paths": [...]} first, then {"type": "file", "file": ...}
+    as each file finishes; without one, `model_stream()` is parsed and each file is yielded as soon
+    as its object in the `files` array closes, and `finalize(text)` builds the result. Files added
+    or changed by post-processing follow, and finally {"type": "structure", "app_structure": ...}.
+    If generation fails after files were yielded, {"type": "reset"} precedes the fallback app's files.
+    """
+    if use_cache:
+        cached = await generation_cache.get(cache_key)
+        if cached:
+            logger.info(f"Generation cache hit for: {prompt}")
+            for f in cached.get("files", []):
+                yield {"type": "file", "file": f}
+            yield {"type": "structure", "app_structure": cached}
+            return
+
+    streamed: Dict[str, str] = {}
+    try:
+        if generator is not None:
+            plan: Dict[str, Any] = {}
+            generated: Dict[str, Dict] = {}
+            errors: List[Dict[str, str]] = []
+            async for event in generator.stream(prompt, context):
+                if event["type"] == "plan":
+                    plan = event["plan"]
+                    yield {"type": "plan", "paths": [e["path"] for e in plan["files"]]}
+                else:
+                    f = event["file"]
+                    generated[f["path"]] = f
+                    streamed[f["path"]] = f["content"]
+                    if "error" in event:
+                        errors.append({"path": f["path"], "error": event["error"]})
+                    yield event
+            app_structure = post_process(ParallelAppGenerator.assemble(plan, generated, errors))
+        else:
+            logger.info(f"Streaming app for: {prompt}")
+            parser = FilesArrayParser()
+            async for delta in model_stream():
+                for f in parser.feed(delta):
+                    streamed[f.get("path", "")] = f.get("content", "")
+                    yield {"type": "file", "file": f}
+            app_structure = finalize(parser.text)
+    except Exception as e:
+        logger.error(f"Error streaming app: {e}")
+        if streamed:
+            # Files already sent belong to the failed attempt; tell the client to discard them
+            yield {"type": "reset", "message": "Generation failed part-way; switching to a template app"}
+            streamed.clear()
+        app_structure = fallback()
+    else:
+        # Apps with placeholder files are not cached, so asking again retries them
+        if not app_structure.get("errors"):
+            await generation_cache.set(cache_key, app_structure)
+
+    for f in app_structure.get("files", []):
+        if streamed.get(f.get("path", "")) != f.get("content", ""):
+            yield {"type": "file", "file": f}
+    yield {"type": "structure", "app_structure": app_structure}
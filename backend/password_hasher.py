@@ -0,0 +1,76 @@
+"""
+Password Hashing Executor
+Runs bcrypt hashing/verification on a dedicated, bounded thread pool
+so login bursts never stall the event loop (and the SSE streams on it)
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHasherSaturated(Exception):
+    """Raised when the hashing queue is full and the caller should back off"""
+
+
+class PasswordHasher:
+    """Bounded executor around a passlib CryptContext"""
+
+    def __init__(self, pwd_context, max_workers: int = 2, max_queue: int = 32):
+        self.pwd_context = pwd_context
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Jobs waiting for a free worker (excludes the ones being hashed)"""
+        return max(0, self._in_flight - self.max_workers)
+
+    async def _submit(self, func: Callable, *args) -> Any:
+        if self._in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            logger.warning(f"Password hasher saturated ({self._in_flight} in flight), rejecting request")
+            raise PasswordHasherSaturated("Password hashing queue is full")
+
+        self._in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+        try:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="password-hash"
+                )
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._in_flight -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(self.pwd_context.hash, password)
+
+    async def verify(self, plain: str, hashed: str) -> bool:
+        return await self._submit(self.pwd_context.verify, plain, hashed)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "queue_depth": self.queue_depth,
+            "peak_in_flight": self.peak_in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
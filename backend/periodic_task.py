@@ -0,0 +1,142 @@
+"""
+Periodic Task
+Scaffolding shared by the background maintenance jobs: a jittered run loop with
+start/stop and run counters, plus an optional Mongo lease so that only one API
+worker runs a job at a time.
+"""
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class MongoLease:
+    """
+    Time-limited lock held in one `job_leases` document per job
+
+    A holder that dies simply lets its lease expire; `ttl_seconds` must therefore
+    exceed the time between renewals.
+    """
+
+    def __init__(self, db, name: str, ttl_seconds: float):
+        self.collection = db.job_leases
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.holder = uuid.uuid4().hex
+
+    async def acquire(self) -> bool:
+        """Take (or extend) the lease; False while another holder's lease is live"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"expires_at": {"$lte": now}}, {"holder": self.holder}]},
+                {"$set": {"holder": self.holder, "expires_at": now + timedelta(seconds=self.ttl_seconds)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The document exists but is held by someone else; the upsert collided with it
+            return False
+        return True
+
+    async def release(self) -> None:
+        await self.collection.update_one(
+            {"_id": self.name, "holder": self.holder},
+            {"$set": {"expires_at": datetime.now(timezone.utc)}}
+        )
+
+
+class LeaseLost(RuntimeError):
+    """Another worker took the lease while this one was still running"""
+
+
+class PeriodicTask:
+    """
+    Calls `run_once()` every `interval_seconds` (± `jitter`) in a background task
+
+    Subclasses implement `run_once` and count their own `runs`; failures are
+    logged and counted here. With a `lease`, a worker that cannot take it skips
+    the run.
+    """
+
+    name = "periodic task"
+
+    def __init__(self, interval_seconds: float, jitter: float = 0.0, lease: Optional[MongoLease] = None):
+        self.interval_seconds = interval_seconds
+        self.jitter = jitter
+        self.lease = lease
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.errors = 0
+        self.skipped = 0
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return bool(self._task and not self._task.done())
+
+    async def run_once(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    async def keep_lease(self) -> None:
+        """Extend the lease between steps of a long run; raises LeaseLost if it expired meanwhile"""
+        if self.lease is not None and not await self.lease.acquire():
+            raise LeaseLost(f"{self.name} lease was taken over by another worker")
+
+    def _next_delay(self) -> float:
+        return self.interval_seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _run_leased(self) -> None:
+        if self.lease is None:
+            await self.run_once()
+            return
+        if not await self.lease.acquire():
+            self.skipped += 1
+            return
+        try:
+            await self.run_once()
+        finally:
+            await self.lease.release()
+
+    async def _loop(self) -> None:
+        # Jittered start so several API workers do not all run at once
+        await asyncio.sleep(random.uniform(0, min(60.0, self.interval_seconds)))
+        while True:
+            try:
+                await self._run_leased()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"{self.name.capitalize()} run failed: {e}")
+            await asyncio.sleep(self._next_delay())
+
+    def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "running": self.running,
+            "interval_seconds": self.interval_seconds,
+            "runs": self.runs,
+            "errors": self.errors,
+            "last_run": self.last_run,
+        }
+        if self.lease is not None:
+            stats["skipped_not_leader"] = self.skipped
+        return stats
@@ -0,0 +1,301 @@
+"""
+Project File Store
+Content-addressed blob storage for generated project files.
+Projects keep a path -> SHA-256 manifest; identical files are stored once.
+Blobs that no project or snapshot references any more are removed by a
+mark-and-sweep pass (see collect_garbage).
+"""
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content: str) -> str:
+    """SHA-256 of a file body, used as the blob key"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def manifest_entry(path: str, content: str, language: Optional[str] = None) -> Dict[str, Any]:
+    """Manifest record for one file: path, blob hash, UTF-8 size in bytes and optional language"""
+    data = content.encode("utf-8")
+    entry = {
+        "path": path,
+        "hash": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+    }
+    if language is not None:
+        entry["language"] = language
+    return entry
+
+
+def manifest_root_hash(manifest: Iterable[Dict]) -> str:
+    """
+    Merkle root of a manifest: every directory hashes its sorted children's
+    (name, hash) lines, so equal subtrees hash equally and only per-file hashes are read
+    """
+    tree: Dict[str, Any] = {}
+    for entry in manifest:
+        node = tree
+        parts = entry.get("path", "").split("/")
+        for part in parts[:-1]:
+            node = node.setdefault(part + "/", {})
+        node[parts[-1]] = entry.get("hash", "")
+
+    def digest(node: Dict[str, Any]) -> str:
+        h = hashlib.sha256()
+        for name in sorted(node):
+            child = node[name]
+            h.update(f"{name}\0{digest(child) if isinstance(child, dict) else child}\n".encode("utf-8"))
+        return h.hexdigest()
+
+    return digest(tree)
+
+
+class ProjectFileStore:
+    """Store project files as deduplicated blobs referenced by a manifest"""
+
+    def __init__(self, db):
+        self.db = db
+        self.blobs_collection = db.file_blobs
+        self.projects_collection = db.projects
+
+    def manifest_entry(self, path: str, content: str, language: Optional[str] = None) -> Dict[str, Any]:
+        return manifest_entry(path, content, language)
+
+    async def put_blobs(self, blobs: Dict[str, str]) -> int:
+        """
+        Persist blobs and renew the sweep grace period of those already stored
+
+        Every blob is upserted, never skipped as "known": a blob the sweep deletes
+        between a lookup and this write would otherwise leave the new manifest
+        pointing at nothing. The upsert recreates it instead.
+
+        Args:
+            blobs: Mapping of content hash -> content
+
+        Returns:
+            Number of newly written blobs
+        """
+        if not blobs:
+            return 0
+
+        now = datetime.now(timezone.utc).isoformat()
+        operations = [
+            UpdateOne(
+                {"blob_hash": blob_hash},
+                {
+                    "$set": {"referenced_at": now},
+                    "$setOnInsert": {
+                        "blob_hash": blob_hash,
+                        "content": content,
+                        "size": len(content.encode("utf-8")),
+                        "created_at": now,
+                    },
+                },
+                upsert=True
+            )
+            for blob_hash, content in blobs.items()
+        ]
+        result = await self.blobs_collection.bulk_write(operations, ordered=False)
+        return result.upserted_count
+
+    async def store_files(self, files: Iterable[Dict]) -> List[Dict[str, Any]]:
+        """Write file bodies as blobs and return the project manifest"""
+        manifest = []
+        blobs: Dict[str, str] = {}
+        for f in files:
+            content = f.get("content", "") or ""
+            entry = self.manifest_entry(f.get("path", ""), content, f.get("language"))
+            blobs[entry["hash"]] = content
+            manifest.append(entry)
+
+        written = await self.put_blobs(blobs)
+        logger.info(f"Stored {len(manifest)} files ({written} new blobs, {len(blobs) - written} deduplicated)")
+        return manifest
+
+    def manifest_stats(self, manifest: List[Dict]) -> Dict[str, int]:
+        """Listing counters kept on the project so summaries never read bodies"""
+        return {
+            "file_count": len(manifest),
+            "total_size": sum(entry.get("size", 0) for entry in manifest),
+        }
+
+    async def manifest_fields(self, files: Iterable[Dict]) -> Dict[str, Any]:
+        """Project document fields replacing an embedded `files` array"""
+        manifest = await self.store_files(files)
+        return {"file_manifest": manifest, **self.manifest_stats(manifest)}
+
+    async def load_blobs(self, hashes: Iterable[str]) -> Dict[str, str]:
+        wanted = list(set(hashes))
+        if not wanted:
+            return {}
+        docs = await self.blobs_collection.find(
+            {"blob_hash": {"$in": wanted}},
+            {"_id": 0, "blob_hash": 1, "content": 1}
+        ).to_list(length=len(wanted))
+        return {doc["blob_hash"]: doc.get("content", "") for doc in docs}
+
+    def _materialize(self, manifest: List[Dict], blobs: Dict[str, str]) -> List[Dict]:
+        files = []
+        for entry in manifest:
+            blob_hash = entry.get("hash")
+            if blob_hash not in blobs:
+                logger.error(f"Missing blob {blob_hash} for {entry.get('path')}")
+            f = {"path": entry.get("path", ""), "content": blobs.get(blob_hash, "")}
+            if entry.get("language") is not None:
+                f["language"] = entry["language"]
+            files.append(f)
+        return files
+
+    async def load_files(self, manifest: List[Dict]) -> List[Dict]:
+        """Rebuild the `files` list (path/content/language) from a manifest"""
+        blobs = await self.load_blobs(entry.get("hash") for entry in manifest)
+        return self._materialize(manifest, blobs)
+
+    async def hydrate(self, project: Optional[Dict]) -> Optional[Dict]:
+        """Fill `project["files"]` from its manifest; legacy documents pass through"""
+        if project and "file_manifest" in project:
+            project["files"] = await self.load_files(project["file_manifest"])
+        return project
+
+    async def hydrate_many(self, projects: List[Dict]) -> List[Dict]:
+        """Hydrate several projects with a single blob query"""
+        with_manifest = [p for p in projects if "file_manifest" in p]
+        blobs = await self.load_blobs(
+            entry.get("hash")
+            for p in with_manifest
+            for entry in p["file_manifest"]
+        )
+        for p in with_manifest:
+            p["files"] = self._materialize(p["file_manifest"], blobs)
+        return projects
+
+    async def ensure_manifest(self, project: Dict, query: Dict) -> List[Dict]:
+        """Migrate a legacy project with embedded files to a manifest"""
+        if "file_manifest" in project:
+            return project["file_manifest"]
+        manifest = await self.store_files(project.get("files", []))
+        await self.projects_collection.update_one(
+            query,
+            {"$set": {"file_manifest": manifest, **self.manifest_stats(manifest)}, "$unset": {"files": ""}}
+        )
+        project["file_manifest"] = manifest
+        return manifest
+
+    async def write_file(
+        self,
+        query: Dict,
+        path: str,
+        content: str,
+        language: Optional[str] = None,
+        extra_set: Optional[Dict] = None
+    ) -> Dict[str, Any]:
+        """
+        Store one file and rewrite only its manifest entry
+
+        Args:
+            query: Filter selecting the project document
+            path: File path inside the project
+            content: New file body
+            language: Optional language tag
+            extra_set: Additional fields to $set on the project (e.g. updated_at)
+
+        Returns:
+            The new manifest entry
+        """
+        entry = self.manifest_entry(path, content, language)
+        await self.put_blobs({entry["hash"]: content})
+
+        updates = dict(extra_set or {})
+        updates["file_manifest.$"] = entry
+        result = await self.projects_collection.update_one(
+            {**query, "file_manifest.path": path},
+            {"$set": updates}
+        )
+        if result.matched_count == 0:
+            update: Dict[str, Any] = {"$push": {"file_manifest": entry}}
+            if extra_set:
+                update["$set"] = dict(extra_set)
+            await self.projects_collection.update_one(query, update)
+
+        # Refresh listing counters server-side from the updated manifest. Snapshots derive
+        # the Merkle root from the manifest itself, so no root hash is stored on the project
+        # (and one left by older writes is dropped rather than going stale).
+        await self.projects_collection.update_one(query, [
+            {"$set": {
+                "file_count": {"$size": "$file_manifest"},
+                "total_size": {"$sum": "$file_manifest.size"},
+            }},
+            {"$unset": "root_hash"},
+        ])
+        return entry
+
+    async def live_hashes(self) -> Set[str]:
+        """Every blob hash referenced by a project manifest or a keyframe/delta snapshot"""
+        live: Set[str] = set()
+        async for project in self.projects_collection.find(
+            {"file_manifest": {"$exists": True}},
+            {"_id": 0, "file_manifest.hash": 1}
+        ):
+            live.update(e["hash"] for e in project.get("file_manifest", []) if e.get("hash"))
+        # "full" snapshots embed their files and reference no blobs
+        async for snapshot in self.db.project_snapshots.find(
+            {"format": {"$in": ["keyframe", "delta"]}},
+            {"_id": 0, "manifest.hash": 1, "changed.hash": 1}
+        ):
+            for key in ("manifest", "changed"):
+                live.update(e["hash"] for e in snapshot.get(key, []) if e.get("hash"))
+        return live
+
+    async def collect_garbage(self, min_age_seconds: float, batch_size: int = 500) -> Dict[str, int]:
+        """
+        Delete blobs nothing references (mark and sweep)
+
+        Args:
+            min_age_seconds: Grace period since a blob was last stored or reused; covers
+                blobs written a moment before the manifest that references them
+            batch_size: Blobs per delete
+
+        Returns:
+            {"blobs": deleted, "bytes": content bytes freed}
+        """
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=min_age_seconds)).isoformat()
+        idle = {"$or": [
+            {"referenced_at": {"$lt": cutoff}},
+            # Blobs written before referenced_at existed
+            {"referenced_at": {"$exists": False}, "created_at": {"$lt": cutoff}},
+        ]}
+        live = await self.live_hashes()
+
+        report = {"blobs": 0, "bytes": 0}
+
+        async def sweep(batch: Dict[str, int]) -> None:
+            # Re-check idleness: a blob reused since the scan keeps its newer referenced_at
+            result = await self.blobs_collection.delete_many({"blob_hash": {"$in": list(batch)}, **idle})
+            if result.deleted_count < len(batch):
+                survivors = await self.blobs_collection.find(
+                    {"blob_hash": {"$in": list(batch)}}, {"_id": 0, "blob_hash": 1}
+                ).to_list(length=len(batch))
+                for doc in survivors:
+                    batch.pop(doc["blob_hash"], None)
+            report["blobs"] += result.deleted_count
+            report["bytes"] += sum(batch.values())
+
+        batch: Dict[str, int] = {}
+        async for blob in self.blobs_collection.find(idle, {"_id": 0, "blob_hash": 1, "size": 1}):
+            if blob["blob_hash"] in live:
+                continue
+            batch[blob["blob_hash"]] = blob.get("size", 0)
+            if len(batch) >= batch_size:
+                await sweep(batch)
+                batch = {}
+        if batch:
+            await sweep(batch)
+        if report["blobs"]:
+            logger.info(f"Blob sweep: deleted {report['blobs']} unreferenced blobs, {report['bytes']} bytes")
+        return report
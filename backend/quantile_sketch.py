@@ -0,0 +1,105 @@
+"""
+Quantile Sketch
+DDSketch-style mergeable quantile sketch: values land in logarithmically sized
+bins, so any quantile is answered within a fixed relative error and two
+sketches merge by adding bin counts. Bins are keyed by their integer index,
+which lets rollup documents hold them as plain counters updated with $inc.
+"""
+import math
+from typing import Dict, Iterable, Optional
+
+# 1% relative error; every stored sketch shares this, so bins from any bucket line up
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(GAMMA)
+
+# Magnitudes below this count as zero (keeps the index range, and document size, bounded)
+MIN_INDEXABLE = 1e-9
+
+
+def bin_index(magnitude: float) -> int:
+    return math.ceil(math.log(magnitude) / _LOG_GAMMA)
+
+
+def bin_value(index: int) -> float:
+    """Representative value of a bin: within RELATIVE_ACCURACY of everything in it"""
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class QuantileSketch:
+    """Counts per bin for positive and negative values, plus a zero count"""
+
+    def __init__(
+        self,
+        positive: Optional[Dict[int, int]] = None,
+        negative: Optional[Dict[int, int]] = None,
+        zero: int = 0
+    ):
+        self.positive: Dict[int, int] = dict(positive or {})
+        self.negative: Dict[int, int] = dict(negative or {})
+        self.zero = zero
+
+    @property
+    def count(self) -> int:
+        return self.zero + sum(self.positive.values()) + sum(self.negative.values())
+
+    def add(self, value: float, count: int = 1) -> None:
+        if abs(value) < MIN_INDEXABLE:
+            self.zero += count
+            return
+        bins = self.positive if value > 0 else self.negative
+        index = bin_index(abs(value))
+        bins[index] = bins.get(index, 0) + count
+
+    def merge(self, other: "QuantileSketch") -> None:
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+        self.zero += other.zero
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile q (0..1), or None for an empty sketch"""
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        # Ascending value order: most negative first, then zero, then positives
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -bin_value(index)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return bin_value(index)
+        return bin_value(max(self.positive)) if self.positive else 0.0
+
+    def to_fields(self) -> Dict[str, int]:
+        """Flat counters ("pos.<i>", "neg.<i>", "zero") for a $inc on a rollup document's sketch"""
+        fields = {f"pos.{i}": c for i, c in self.positive.items()}
+        fields.update({f"neg.{i}": c for i, c in self.negative.items()})
+        if self.zero:
+            fields["zero"] = self.zero
+        return fields
+
+    @classmethod
+    def from_document(cls, doc: Optional[Dict]) -> "QuantileSketch":
+        """Inverse of to_fields once Mongo has nested the dotted keys"""
+        doc = doc or {}
+        return cls(
+            positive={int(i): c for i, c in doc.get("pos", {}).items()},
+            negative={int(i): c for i, c in doc.get("neg", {}).items()},
+            zero=doc.get("zero", 0)
+        )
+
+    @classmethod
+    def of(cls, values: Iterable[float]) -> "QuantileSketch":
+        sketch = cls()
+        for value in values:
+            sketch.add(value)
+        return sketch
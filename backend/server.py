@@ -2,9 +2,9 @@ from dotenv import load_dotenv, find_dotenv
 import sys
 load_dotenv(find_dotenv(), override=True)
 
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Body
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Body, Query, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import StreamingResponse, HTMLResponse, RedirectResponse, FileResponse, Response
 from motor.motor_asyncio import AsyncIOMotorClient
 from pydantic import BaseModel, EmailStr, ConfigDict
 from typing import List, Optional, Dict, Any
@@ -20,6 +20,7 @@ import base64
 import httpx
 import re
 import asyncio
+import math
 import json
 import json
 
@@ -41,12 +42,53 @@ except Exception as e:
 
 # Initialize services
 from version_control_service import VersionControlService
-from file_storage_service import FileStorageService
+from file_storage_service import PUBLIC_CATEGORIES, FileStorageService, UploadRejected, UploadTooLarge
+from multipart_stream import MultipartError, disposition_params, iter_parts, parse_boundary
 from discussion_service import DiscussionService
+from project_file_store import ProjectFileStore
+from index_bootstrap import IndexBootstrap
+from services.llm_clients import llm_clients
+from services.generation_cache import generation_cache, MongoCacheBackend
+from services.sse import sse_hub
+from periodic_task import MongoLease
+from snapshot_retention import SnapshotRetentionEngine
+from storage_janitor import StorageJanitor
+from analytics_service import AnalyticsService
+import analytics_ingest
+from analytics_ingest import (
+    IngestRateLimiter,
+    IngestRejected,
+    WriteKeyCache,
+    beacon_snippet,
+    generate_write_key,
+    hash_write_key,
+    inject_beacon,
+    parse_records,
+    read_body,
+)
 
-version_control = VersionControlService(db)
-file_storage = FileStorageService()
+project_store = ProjectFileStore(db)
+index_bootstrap = IndexBootstrap(db)
+version_control = VersionControlService(db, file_store=project_store)
+snapshot_retention = SnapshotRetentionEngine(
+    db,
+    version_control,
+    file_store=project_store,
+    # One retention runner across all workers; renewed per project, so it outlives a slow project
+    lease=MongoLease(db, "snapshot_retention", float(os.getenv("SNAPSHOT_RETENTION_LEASE_SECONDS", "900")))
+)
+file_storage = FileStorageService(db=db)
+storage_janitor = StorageJanitor(file_storage)
+analytics_service = AnalyticsService(db)
+write_key_cache = WriteKeyCache(ttl_seconds=float(os.getenv("ANALYTICS_WRITE_KEY_CACHE_TTL_SECONDS", "60")))
+ingest_rate_limiter = IngestRateLimiter(
+    records_per_second=float(os.getenv("ANALYTICS_INGEST_RECORDS_PER_SECOND", "200")),
+    burst=float(os.getenv("ANALYTICS_INGEST_BURST_RECORDS", "2000"))
+)
 discussion_service = DiscussionService()
+# Shared tier behind the in-process LRU so repeated prompts hit across workers/restarts
+if os.getenv("GENERATION_CACHE_BACKEND", "mongodb").lower() == "mongodb":
+    generation_cache.attach_backend(MongoCacheBackend(db.generation_cache))
 
 # Add MongoDB connection test to FastAPI startup event
 app = FastAPI(title="AI Application Builder")
@@ -61,6 +103,53 @@ async def test_mongo_connection():
         print(f"MongoDB connection failed: {e}")
         raise
 
+async def _run_index_bootstrap(dry_run: bool):
+    try:
+        await index_bootstrap.ensure_indexes(dry_run=dry_run)
+    except Exception as e:
+        logger.warning(f"Index bootstrap failed: {e}")
+
+@app.on_event("startup")
+async def start_index_bootstrap():
+    # INDEX_BOOTSTRAP_MODE: "apply" (default), "dry-run" or "off"
+    mode = os.getenv("INDEX_BOOTSTRAP_MODE", "apply").lower()
+    if mode == "off":
+        return
+    # Runs in the background so a first build on a large collection never delays startup
+    app.state.index_bootstrap_task = asyncio.create_task(_run_index_bootstrap(dry_run=mode == "dry-run"))
+
+@app.on_event("startup")
+async def start_snapshot_retention():
+    if os.getenv("SNAPSHOT_RETENTION_ENABLED", "true").lower() in ("0", "false", "no"):
+        return
+    snapshot_retention.start()
+
+@app.on_event("startup")
+async def start_storage_janitor():
+    if os.getenv("STORAGE_JANITOR_ENABLED", "true").lower() in ("0", "false", "no"):
+        return
+    storage_janitor.start()
+
+@app.on_event("startup")
+async def start_analytics_ingest():
+    # With the buffer off, every tracked event/metric is written synchronously
+    if os.getenv("ANALYTICS_BUFFER_ENABLED", "true").lower() in ("0", "false", "no"):
+        return
+    analytics_service.start()
+
+@app.on_event("shutdown")
+async def shutdown_services():
+    task = getattr(app.state, "index_bootstrap_task", None)
+    if task and not task.done():
+        task.cancel()
+    await snapshot_retention.stop()
+    await storage_janitor.stop()
+    await analytics_service.stop()
+    password_hasher.shutdown()
+    file_storage.images.shutdown()
+    await sse_hub.aclose()
+    await llm_clients.aclose()
+
 # --- Strict CORS config ---
 from starlette.middleware.cors import CORSMiddleware
 frontend_origin = os.environ.get("CORS_ORIGINS", "http://localhost:3000")
@@ -111,6 +200,10 @@ class ProjectCreate(BaseModel):
         "backend": "FastAPI",
         "database": "MongoDB"
     }
+    # Skip the generation cache and force a fresh model call
+    bypass_cache: bool = False
+    # Issue an analytics write key and inject the batching beacon into src/index.js
+    analytics_beacon: bool = False
 
 class SnapshotCreate(BaseModel):
     message: Optional[str] = None
@@ -137,6 +230,24 @@ class Project(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+class ProjectSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    project_id: str
+    user_id: str
+    name: str
+    description: str
+    prompt: str
+    tech_stack: Dict[str, str]
+    status: str = "active"
+    file_count: int = 0
+    total_size: int = 0
+    created_at: datetime
+    updated_at: datetime
+
+class ProjectPage(BaseModel):
+    projects: List[ProjectSummary]
+    next_cursor: Optional[str] = None
+
 class FileUpdate(BaseModel):
     path: str
     content: str
@@ -208,6 +319,12 @@ class PasswordUpdate(BaseModel):
     current_password: str
     new_password: str
 
+class UploadInit(BaseModel):
+    filename: str
+    size: int
+    project_id: Optional[str] = None
+    checksum: Optional[str] = None
+
 # ==================== AUTH HELPERS ====================
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 JWT_SECRET = os.getenv("JWT_SECRET", "your-jwt-secret-key")
@@ -215,6 +332,12 @@ JWT_ALGORITHM = "HS256"
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+from auth_cache import UserResolutionCache
+user_cache = UserResolutionCache(
+    ttl_seconds=float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60")),
+    max_entries=int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000")),
+)
+
 DEFAULT_PLAN = "free"
 TEAM_OWNER_ROLE = "owner"
 BILLING_ALLOWED_ROLES = {"owner", "admin"}
@@ -297,11 +420,31 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+from password_hasher import PasswordHasher, PasswordHasherSaturated
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+    max_queue=int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32")),
+)
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain, hashed)
+def _password_hasher_busy() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Authentication is busy, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherSaturated:
+        raise _password_hasher_busy()
+
+async def verify_password(plain: str, hashed: str) -> bool:
+    try:
+        return await password_hasher.verify(plain, hashed)
+    except PasswordHasherSaturated:
+        raise _password_hasher_busy()
 
 async def get_current_user(request: Request) -> User:
     auth_header = request.headers.get("Authorization")
@@ -317,9 +460,13 @@ async def get_current_user(request: Request) -> User:
             raise HTTPException(status_code=401, detail="Invalid token")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    cached_doc = user_cache.get(user_id, token)
+    if cached_doc is not None:
+        return User(**cached_doc)
     user_doc = await load_user_document(user_id)
     if not user_doc:
         raise HTTPException(status_code=404, detail="User not found")
+    user_cache.set(user_id, token, user_doc)
     return User(**user_doc)
 
 # ==================== AUTH ENDPOINTS ====================
@@ -349,7 +496,7 @@ async def register(user_data: UserCreate):
         "role": TEAM_OWNER_ROLE,
         "plan": DEFAULT_PLAN,
         "picture": "",
-        "password_hash": hash_password(user_data.password),
+        "password_hash": await hash_password(user_data.password),
     }
     await db.teams.insert_one(team_payload)
     await db.users.insert_one(user_payload)
@@ -366,7 +513,7 @@ async def login(credentials: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     if not user_doc.get("password_hash"):
         raise HTTPException(status_code=401, detail="This account uses Google sign-in. Please sign in with Google.")
-    if not verify_password(credentials.password, user_doc.get("password_hash")):
+    if not await verify_password(credentials.password, user_doc.get("password_hash")):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     user_doc = dict(user_doc)
     parse_datetime_field(user_doc, "created_at")
@@ -507,6 +654,7 @@ async def update_account_profile(update: ProfileUpdate, current_user: User = Dep
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     if update_data:
         await db.users.update_one({"user_id": current_user.user_id}, {"$set": update_data})
+    user_cache.invalidate_user(current_user.user_id)
     refreshed = await load_user_document(current_user.user_id)
     if not refreshed:
         raise HTTPException(status_code=404, detail="User not found after update")
@@ -517,10 +665,11 @@ async def update_account_password(payload: PasswordUpdate, current_user: User =
     user_doc = await db.users.find_one({"user_id": current_user.user_id}, {"_id": 0})
     if not user_doc or not user_doc.get("password_hash"):
         raise HTTPException(status_code=400, detail="Password-based login not configured for this account")
-    if not verify_password(payload.current_password, user_doc["password_hash"]):
+    if not await verify_password(payload.current_password, user_doc["password_hash"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
-    new_hash = hash_password(payload.new_password)
+    new_hash = await hash_password(payload.new_password)
     await db.users.update_one({"user_id": current_user.user_id}, {"$set": {"password_hash": new_hash}})
+    user_cache.invalidate_user(current_user.user_id)
     return {"status": "success"}
 
 @api_router.get("/teams/current", response_model=Team)
@@ -571,6 +720,7 @@ async def invite_team_member(invite: TeamInvite, current_user: User = Depends(ge
         "expires_at": (now + timedelta(days=7)).isoformat(),
     }
     await db.team_invitations.insert_one(invitation)
+    user_cache.invalidate_team(current_user.team_id)
     return {"status": "pending", "token": token, "message": f"Invitation sent to {invite.email}"}
 
 # ==================== BILLING ENDPOINTS ====================
@@ -587,6 +737,7 @@ async def subscribe_to_plan(plan_id: str, current_user: User = Depends(get_curre
         raise HTTPException(status_code=403, detail="Insufficient permissions to change billing plan")
     await db.teams.update_one({"team_id": current_user.team_id}, {"$set": {"plan": plan_id}})
     await db.users.update_many({"team_id": current_user.team_id}, {"$set": {"plan": plan_id}})
+    user_cache.invalidate_team(current_user.team_id)
     event = {
         "team_id": current_user.team_id,
         "plan_id": plan_id,
@@ -636,6 +787,7 @@ async def update_payment_method(method: PaymentMethod, current_user: User = Depe
 @api_router.get("/projects", response_model=List[Project])
 async def get_projects(current_user: User = Depends(get_current_user)):
     projects = await db.projects.find({"user_id": current_user.user_id}, {"_id": 0}).to_list(100)
+    await project_store.hydrate_many(projects)
     for proj in projects:
         if isinstance(proj.get("created_at"), str):
             proj["created_at"] = datetime.fromisoformat(proj["created_at"])
@@ -643,6 +795,71 @@ async def get_projects(current_user: User = Depends(get_current_user)):
             proj["updated_at"] = datetime.fromisoformat(proj["updated_at"])
     return projects
 
+PROJECT_PAGE_MAX = 100
+
+def _encode_project_cursor(updated_at: str, project_id: str) -> str:
+    raw = json.dumps([updated_at, project_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_project_cursor(cursor: str) -> List[str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        updated_at, project_id = json.loads(base64.urlsafe_b64decode(padded))
+        return [str(updated_at), str(project_id)]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@api_router.get("/projects/page", response_model=ProjectPage)
+async def get_projects_page(
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Paged project listing without file bodies, newest first (keyset on updated_at, project_id)"""
+    limit = max(1, min(limit, PROJECT_PAGE_MAX))
+    match: Dict[str, Any] = {"user_id": current_user.user_id}
+    if cursor:
+        updated_at, project_id = _decode_project_cursor(cursor)
+        match["$or"] = [
+            {"updated_at": {"$lt": updated_at}},
+            {"updated_at": updated_at, "project_id": {"$lt": project_id}},
+        ]
+    legacy_files = {"$ifNull": ["$files", []]}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"updated_at": -1, "project_id": -1}},
+        {"$limit": limit + 1},
+        {"$project": {
+            "_id": 0,
+            "project_id": 1,
+            "user_id": 1,
+            "name": 1,
+            "description": 1,
+            "prompt": 1,
+            "tech_stack": 1,
+            "status": 1,
+            "created_at": 1,
+            "updated_at": 1,
+            # Counters are written with the manifest; legacy documents fall back to a server-side count
+            "file_count": {"$ifNull": ["$file_count", {"$size": legacy_files}]},
+            "total_size": {"$ifNull": ["$total_size", {"$sum": {"$map": {
+                "input": legacy_files,
+                "as": "f",
+                "in": {"$strLenCP": {"$ifNull": ["$$f.content", ""]}},
+            }}}]},
+        }},
+    ]
+    rows = await db.projects.aggregate(pipeline).to_list(limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_project_cursor(last["updated_at"], last["project_id"])
+    for row in rows:
+        parse_datetime_field(row, "created_at")
+        parse_datetime_field(row, "updated_at")
+    return ProjectPage(projects=[ProjectSummary(**row) for row in rows], next_cursor=next_cursor)
+
 @api_router.get("/projects/{project_id}", response_model=Project)
 async def get_project(project_id: str, current_user: User = Depends(get_current_user)):
     project = await db.projects.find_one(
@@ -651,20 +868,32 @@ async def get_project(project_id: str, current_user: User = Depends(get_current_
     )
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    await project_store.hydrate(project)
     if isinstance(project.get("created_at"), str):
         project["created_at"] = datetime.fromisoformat(project["created_at"])
     if isinstance(project.get("updated_at"), str):
         project["updated_at"] = datetime.fromisoformat(project["updated_at"])
     return Project(**project)
 
+def _analytics_ingest_url(request: Request) -> str:
+    # Generated apps run on other origins, so they need an absolute URL
+    return os.getenv("ANALYTICS_INGEST_URL") or f"{str(request.base_url).rstrip('/')}/api/analytics/ingest"
+
+def _attach_beacon(files: List[Dict[str, Any]], request: Request) -> Dict[str, Any]:
+    """Issue a write key, inject the beacon using it; returns the project fields to store"""
+    write_key = generate_write_key()
+    if not inject_beacon(files, _analytics_ingest_url(request), write_key):
+        logging.info("Analytics beacon requested but no src/index.js was generated; key issued without it")
+    return {"analytics_write_key_hash": hash_write_key(write_key)}
+
 @api_router.post("/projects/generate", response_model=Project)
-async def generate_project(project_data: ProjectCreate, current_user: User = Depends(get_current_user)):
+async def generate_project(project_data: ProjectCreate, request: Request, current_user: User = Depends(get_current_user)):
     """Generate a project using AIBuilderService V2 (ENHANCED with real APIs); fallback to V1 or basic if unavailable."""
     try:
         # Try V2 first (with API integrations, backend generation, etc.)
         from ai_builder_service_v2 import AIBuilderServiceV2
         ai_builder = AIBuilderServiceV2()
-        app_struct = await ai_builder.generate_app_structure(project_data.prompt, project_data.tech_stack)
+        app_struct = await ai_builder.generate_app_structure(project_data.prompt, project_data.tech_stack, use_cache=not project_data.bypass_cache)
         files = app_struct.get("files", [])
         logging.info("✅ Using AI Builder V2 (Enhanced)")
     except Exception as e1:
@@ -672,7 +901,7 @@ async def generate_project(project_data: ProjectCreate, current_user: User = Dep
         try:
             from ai_builder_service import AIBuilderService
             ai_builder = AIBuilderService()
-            app_struct = await ai_builder.generate_app_structure(project_data.prompt, project_data.tech_stack)
+            app_struct = await ai_builder.generate_app_structure(project_data.prompt, project_data.tech_stack, use_cache=not project_data.bypass_cache)
             files = app_struct.get("files", [])
             logging.info("✅ Using AI Builder V1 (Basic)")
         except Exception as e2:
@@ -709,6 +938,7 @@ async def generate_project(project_data: ProjectCreate, current_user: User = Dep
         p = re.sub(r"^client/", "", p)
         p = re.sub(r"^app/", "", p)
         normalized_files.append({"path": p, "content": f.get("content", ""), "language": f.get("language", "txt")})
+    beacon_fields = _attach_beacon(normalized_files, request) if project_data.analytics_beacon else {}
 
     project_id = f"proj_{uuid.uuid4().hex[:12]}"
     now = datetime.now(timezone.utc)
@@ -719,48 +949,59 @@ async def generate_project(project_data: ProjectCreate, current_user: User = Dep
         "description": project_data.prompt or "",
         "prompt": project_data.prompt or "",
         "tech_stack": project_data.tech_stack,
-        "files": normalized_files,
+        **(await project_store.manifest_fields(normalized_files)),
+        **beacon_fields,
         "status": "active",
         "created_at": now.isoformat(),
         "updated_at": now.isoformat()
     }
     await db.projects.insert_one(project_doc)
+    project_doc["files"] = normalized_files
     project_doc["created_at"] = now
     project_doc["updated_at"] = now
     return Project(**project_doc)
 
 # ==================== STREAMING GENERATION ====================
 @api_router.post("/projects/generate/stream")
-async def generate_project_stream(project_data: ProjectCreate, current_user: User = Depends(get_current_user)):
-    """Stream real-time generation progress using Server-Sent Events"""
+async def generate_project_stream(project_data: ProjectCreate, request: Request, current_user: User = Depends(get_current_user)):
+    """Stream real-time generation progress using Server-Sent Events (resumable with Last-Event-ID)"""
     
-    async def event_generator():
+    async def produce(channel):
         try:
-            yield f"data: {json.dumps({'type': 'status', 'message': '🚀 Starting AI-powered generation...'})}\n\n"
-            await asyncio.sleep(0.1)
-            
-            yield f"data: {json.dumps({'type': 'status', 'message': '📊 Analyzing requirements...'})}\n\n"
-            await asyncio.sleep(0.1)
+            await channel.publish({'type': 'status', 'message': '🚀 Starting AI-powered generation...'})
+            await channel.publish({'type': 'status', 'message': '📊 Analyzing requirements...'})
             
             # Start actual AI generation - Try V2 first (enhanced), fallback to V1
             try:
                 from ai_builder_service_v2 import AIBuilderServiceV2
                 ai_builder = AIBuilderServiceV2()
-                yield f"data: {json.dumps({'type': 'status', 'message': '🤖 GPT-4o with API integrations...'})}\n\n"
+                await channel.publish({'type': 'status', 'message': '🤖 GPT-4o with API integrations...'})
             except:
                 from ai_builder_service import AIBuilderService
                 ai_builder = AIBuilderService()
-                yield f"data: {json.dumps({'type': 'status', 'message': '🤖 GPT-4o is thinking...'})}\n\n"
+                await channel.publish({'type': 'status', 'message': '🤖 GPT-4o is thinking...'})
             
-            app_struct = await ai_builder.generate_app_structure(project_data.prompt, project_data.tech_stack)
+            # Files are forwarded as soon as each one is ready (parallel mode) or its JSON object closes (single mode)
+            app_struct = {}
+            sent = 0
+            async for event in ai_builder.stream_app_structure(
+                project_data.prompt, project_data.tech_stack, use_cache=not project_data.bypass_cache
+            ):
+                if event["type"] == "file":
+                    await channel.publish({'type': 'file', 'file': event['file'], 'index': sent})
+                    sent += 1
+                    if "error" in event:
+                        await channel.publish({'type': 'status', 'message': f'⚠️ {event["file"]["path"]} could not be generated; added a placeholder'})
+                elif event["type"] == "reset":
+                    await channel.publish({'type': 'reset', 'message': event['message']})
+                    sent = 0
+                elif event["type"] == "plan":
+                    await channel.publish({'type': 'status', 'message': f'🗺️ Planned {len(event["paths"])} files, writing them in parallel...'})
+                else:
+                    app_struct = event["app_structure"]
             files = app_struct.get("files", [])
             
-            yield f"data: {json.dumps({'type': 'status', 'message': f'✨ Generated {len(files)} files!'})}\n\n"
-            
-            # Send each file
-            for idx, file in enumerate(files):
-                await asyncio.sleep(0.05)
-                yield f"data: {json.dumps({'type': 'file', 'file': file, 'index': idx, 'total': len(files)})}\n\n"
+            await channel.publish({'type': 'status', 'message': f'✨ Generated {len(files)} files!'})
             
             # Save to database
             now = datetime.now(timezone.utc)
@@ -776,6 +1017,7 @@ async def generate_project_stream(project_data: ProjectCreate, current_user: Use
                     "content": f.get("content", ""),
                     "language": f.get("language", "")
                 })
+            beacon_fields = _attach_beacon(normalized_files, request) if project_data.analytics_beacon else {}
             
             project_doc = {
                 "project_id": project_id,
@@ -784,20 +1026,21 @@ async def generate_project_stream(project_data: ProjectCreate, current_user: Use
                 "description": project_data.prompt or "",
                 "prompt": project_data.prompt or "",
                 "tech_stack": project_data.tech_stack,
-                "files": normalized_files,
+                **(await project_store.manifest_fields(normalized_files)),
+                **beacon_fields,
                 "status": "active",
                 "created_at": now.isoformat(),
                 "updated_at": now.isoformat()
             }
             await db.projects.insert_one(project_doc)
             
-            yield f"data: {json.dumps({'type': 'complete', 'project_id': project_id, 'files': normalized_files})}\n\n"
+            await channel.publish({'type': 'complete', 'project_id': project_id, 'files': normalized_files})
             
         except Exception as e:
             logging.error(f"Stream error: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            await channel.publish({'type': 'error', 'message': str(e)})
     
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return sse_hub.stream(produce, owner=current_user.user_id, last_event_id=request.headers.get("last-event-id"))
 
 # ==================== PROJECT CHAT (PLAN / BUILD) ====================
 @api_router.post("/projects/{project_id}/chat/plan", response_model=ChatResponse)
@@ -842,34 +1085,33 @@ def _apply_simple_build(message: str, app_js: str) -> str:
 
 @api_router.post("/projects/{project_id}/chat/build", response_model=ChatBuildResponse)
 async def project_chat_build(project_id: str, req: ChatRequest, current_user: User = Depends(get_current_user)):
-    project = await db.projects.find_one({"project_id": project_id, "user_id": current_user.user_id}, {"_id": 0})
+    project_query = {"project_id": project_id, "user_id": current_user.user_id}
+    project = await db.projects.find_one(project_query, {"_id": 0})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-    files = project.get("files", [])
-    app_file = None
-    for f in files:
-        if f.get("path", "").endswith("App.js") or f.get("path", "").endswith("App.jsx") or "App.js" in f.get("path",""):
-            app_file = f
+    manifest = await project_store.ensure_manifest(project, project_query)
+    app_entry = None
+    for entry in manifest:
+        if entry.get("path", "").endswith("App.js") or entry.get("path", "").endswith("App.jsx") or "App.js" in entry.get("path",""):
+            app_entry = entry
             break
-    if not app_file:
+    if app_entry:
+        app_file = (await project_store.load_files([app_entry]))[0]
+    else:
         # create a minimal App.js if missing
         app_file = {"path": "src/App.js", "content": "export default function App(){return <div style={{padding:24}}>Hello</div>;}", "language": "js"}
-        files.append(app_file)
     new_content = _apply_simple_build(req.message, app_file.get("content",""))
     if new_content == app_file.get("content",""):
         reply = "I evaluated your request, but no changes were necessary. Try asking to add tabs (Home, About, Contact, FAQ) or to change the theme color (e.g., set theme color to #ff4500)."
         return ChatBuildResponse(response=reply, file_updates=[])
     update = FileUpdate(path=app_file["path"], content=new_content)
-    # Apply update in DB
-    for i, f in enumerate(files):
-        if f.get("path") == update.path:
-            files[i] = {"path": update.path, "content": update.content, "language": f.get("language","js")}
-            break
-    else:
-        files.append({"path": update.path, "content": update.content, "language": "js"})
-    await db.projects.update_one(
-        {"project_id": project_id, "user_id": current_user.user_id},
-        {"$set": {"files": files, "updated_at": datetime.now(timezone.utc).isoformat()}}
+    # Apply update in DB: only this file's manifest entry is rewritten
+    await project_store.write_file(
+        project_query,
+        update.path,
+        update.content,
+        language=app_file.get("language", "js"),
+        extra_set={"updated_at": datetime.now(timezone.utc).isoformat()}
     )
     reply = "Applied your change. Preview should update. Ask me to add About/Contact/FAQ tabs or adjust theme colors for more."
     return ChatBuildResponse(response=reply, file_updates=[update])
@@ -880,6 +1122,7 @@ async def export_project(project_id: str, current_user: User = Depends(get_curre
     project = await db.projects.find_one({"project_id": project_id, "user_id": current_user.user_id}, {"_id": 0})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    await project_store.hydrate(project)
     return {
         "project_id": project_id,
         "name": project.get("name"),
@@ -893,6 +1136,7 @@ async def export_project_github(project_id: str, current_user: User = Depends(ge
     project = await db.projects.find_one({"project_id": project_id, "user_id": current_user.user_id}, {"_id": 0})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    await project_store.hydrate(project)
     return {
         "project_name": project.get("name", f"project_{project_id}"),
         "description": project.get("description", ""),
@@ -982,12 +1226,12 @@ async def push_github(req: GitHubPushRequest, current_user: User = Depends(get_c
 
 # ==================== AUTONOMOUS AGENT ENDPOINT ====================
 @api_router.post("/projects/autonomous/stream")
-async def autonomous_agent_stream(project_data: ProjectCreate, current_user: User = Depends(get_current_user)):
+async def autonomous_agent_stream(project_data: ProjectCreate, request: Request, current_user: User = Depends(get_current_user)):
     """
     Autonomous agent with 200-minute runtime, self-testing, and auto-fixing
     Like Replit Agent 3
     """
-    async def event_generator():
+    async def produce(channel):
         from autonomous_agent import AutonomousAgent
 
         openai_key = os.getenv("OPENAI_API_KEY")
@@ -997,25 +1241,22 @@ async def autonomous_agent_stream(project_data: ProjectCreate, current_user: Use
                 "message": "Autonomous agent is not configured. Set OPENAI_API_KEY in the backend environment.",
                 "timestamp": datetime.now().isoformat()
             }
-            yield f"data: {json.dumps(error_payload)}\n\n"
+            await channel.publish(error_payload)
             return
 
-        progress_queue: asyncio.Queue = asyncio.Queue()
-
         async def progress_callback(update):
-            payload = {
+            await channel.publish({
                 "type": update.get("level", "info"),
                 "message": update.get("message", ""),
                 "timestamp": update.get("timestamp", datetime.now().isoformat())
-            }
-            await progress_queue.put(payload)
+            })
 
         agent = AutonomousAgent(
             project_id=str(uuid.uuid4()),
             openai_api_key=openai_key
         )
 
-        await progress_queue.put({
+        await channel.publish({
             "type": "info",
             "message": "🤖 Autonomous Agent starting...",
             "timestamp": datetime.now().isoformat()
@@ -1030,17 +1271,6 @@ async def autonomous_agent_stream(project_data: ProjectCreate, current_user: Use
         )
 
         try:
-            while True:
-                if agent_task.done() and progress_queue.empty():
-                    break
-
-                try:
-                    update = await asyncio.wait_for(progress_queue.get(), timeout=0.5)
-                except asyncio.TimeoutError:
-                    continue
-
-                yield f"data: {json.dumps(update)}\n\n"
-
             result = await agent_task
 
             if result.get("status") == "success":
@@ -1054,7 +1284,7 @@ async def autonomous_agent_stream(project_data: ProjectCreate, current_user: Use
                     "description": project_data.prompt or "",
                     "prompt": project_data.prompt or "",
                     "tech_stack": project_data.tech_stack,
-                    "files": result["files"],
+                    **(await project_store.manifest_fields(result["files"])),
                     "status": "active",
                     "autonomous_build": True,
                     "test_results": result.get("test_results", {}),
@@ -1072,14 +1302,14 @@ async def autonomous_agent_stream(project_data: ProjectCreate, current_user: Use
                     "files": result["files"],
                     "test_results": result.get("test_results", {})
                 }
-                yield f"data: {json.dumps(completion_payload)}\n\n"
+                await channel.publish(completion_payload)
             else:
                 error_payload = {
                     "type": "error",
                     "message": result.get("error", "Unknown error occurred during autonomous build."),
                     "timestamp": datetime.now().isoformat()
                 }
-                yield f"data: {json.dumps(error_payload)}\n\n"
+                await channel.publish(error_payload)
 
         except Exception as e:
             logger.error(f"Autonomous agent error: {e}")
@@ -1088,14 +1318,14 @@ async def autonomous_agent_stream(project_data: ProjectCreate, current_user: Use
                 "message": str(e),
                 "timestamp": datetime.now().isoformat()
             }
-            yield f"data: {json.dumps(error_payload)}\n\n"
+            await channel.publish(error_payload)
         finally:
             if not agent_task.done():
                 agent_task.cancel()
                 with contextlib.suppress(asyncio.CancelledError):
                     await agent_task
     
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return sse_hub.stream(produce, owner=current_user.user_id, last_event_id=request.headers.get("last-event-id"))
 
 # ==================== VERSION CONTROL ENDPOINTS ====================
 @api_router.post("/projects/{project_id}/snapshots")
@@ -1105,16 +1335,21 @@ async def create_snapshot(
     current_user: User = Depends(get_current_user)
 ):
     """Create a snapshot of current project state"""
-    project = await db.projects.find_one({"project_id": project_id, "user_id": current_user.user_id})
+    project = await db.projects.find_one(
+        {"project_id": project_id, "user_id": current_user.user_id},
+        {"_id": 0, "file_manifest": 1, "files": 1}
+    )
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
     
+    # Manifest-backed projects snapshot by per-file hash; bodies are already stored as blobs
     result = await version_control.create_snapshot(
         project_id,
         current_user.user_id,
         project.get("files", []),
         snapshot_data.message,
-        auto=False
+        auto=False,
+        manifest=project.get("file_manifest")
     )
     return result
 
@@ -1139,6 +1374,47 @@ async def restore_snapshot(
         raise HTTPException(status_code=400, detail=result.get("error"))
     return result
 
+@api_router.get("/projects/{project_id}/snapshots/{snapshot_a}/diff/{snapshot_b}")
+async def diff_snapshots(
+    project_id: str,
+    snapshot_a: str,
+    snapshot_b: str,
+    path: Optional[List[str]] = Query(None),
+    format: str = "json",
+    context: int = 3,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Changed paths between two snapshots, found by per-file hash without reading bodies.
+    format=patch streams unified diffs, limited to `path` (repeatable) when given.
+    """
+    project = await db.projects.find_one(
+        {"project_id": project_id, "user_id": current_user.user_id},
+        {"_id": 0, "project_id": 1}
+    )
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    diff = await version_control.resolve_diff(project_id, snapshot_a, snapshot_b)
+    if not diff:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+
+    if format == "patch":
+        return StreamingResponse(
+            version_control.iter_unified_diff(diff, paths=path, context=max(0, min(context, 20))),
+            media_type="text/x-diff; charset=utf-8"
+        )
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'patch'")
+    return {
+        "from": snapshot_a,
+        "to": snapshot_b,
+        "added": diff["added"],
+        "removed": diff["removed"],
+        "modified": diff["modified"],
+        "total_changes": len(diff["added"]) + len(diff["removed"]) + len(diff["modified"])
+    }
+
 # ==================== DISCUSSION MODE ENDPOINTS ====================
 @api_router.post("/discuss", response_model=ChatResponse)
 async def discussion_mode(
@@ -1153,6 +1429,7 @@ async def discussion_mode(
             "user_id": current_user.user_id
         })
         if project:
+            await project_store.hydrate(project)
             project_context = {
                 "name": project.get("name"),
                 "files": project.get("files", [])
@@ -1212,6 +1489,7 @@ async def deploy_project(
     project = await db.projects.find_one({"project_id": project_id, "user_id": current_user.user_id})
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    await project_store.hydrate(project)
     
     from deployment_service import DeploymentService
     deployment = DeploymentService()
@@ -1264,15 +1542,215 @@ async def upload_file(
     if not result["success"]:
         raise HTTPException(status_code=500, detail=result.get("error"))
     
-    # Save file reference in database
-    await db.project_files.insert_one(result)
-    
     return result
 
+@api_router.post("/storage/upload/stream")
+async def upload_file_stream(
+    request: Request,
+    project_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Upload the first file part of a multipart/form-data body, streamed straight to disk"""
+    max_bytes = file_storage.max_upload_bytes(current_user.plan)
+    declared = request.headers.get("content-length", "")
+    # Allow a little room for the multipart framing around the file itself
+    if declared.isdigit() and int(declared) > max_bytes + 64 * 1024:
+        raise HTTPException(status_code=413, detail=str(UploadTooLarge(max_bytes)))
+    try:
+        boundary = parse_boundary(request.headers.get("content-type"))
+    except MultipartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    parts = iter_parts(request.stream(), boundary)
+    filename = None
+    try:
+        async for kind, value in parts:
+            if kind == "headers":
+                filename = disposition_params(value).get("filename")
+                if filename:
+                    break
+
+        if not filename:
+            raise HTTPException(status_code=400, detail="No file part in upload")
+
+        async def file_body():
+            async for kind, value in parts:
+                if kind == "end":
+                    return
+                if kind == "data":
+                    yield value
+
+        result = await file_storage.upload_stream(
+            file_body(),
+            Path(filename).name,
+            current_user.user_id,
+            project_id,
+            max_bytes=max_bytes
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except MultipartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await parts.aclose()
+
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result.get("error"))
+    return result
+
+def _upload_rejected(e: UploadRejected) -> HTTPException:
+    headers = {"Upload-Offset": str(e.offset)} if e.offset is not None else None
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+
+@api_router.post("/storage/uploads")
+async def init_resumable_upload(body: UploadInit, current_user: User = Depends(get_current_user)):
+    """Start a resumable upload; completes immediately if `checksum` matches content this user stored"""
+    try:
+        result = await file_storage.init_upload(
+            Path(body.filename).name,
+            body.size,
+            current_user.user_id,
+            project_id=body.project_id,
+            checksum=body.checksum,
+            max_bytes=file_storage.max_upload_bytes(current_user.plan)
+        )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadRejected as e:
+        raise _upload_rejected(e)
+    if not result["success"]:
+        raise HTTPException(status_code=500, detail=result.get("error"))
+    return result
+
+@api_router.get("/storage/uploads/{upload_id}")
+async def get_resumable_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    """Committed offset to resume from"""
+    status = await file_storage.upload_status(upload_id, current_user.user_id)
+    if not status:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return status
+
+@api_router.put("/storage/uploads/{upload_id}")
+async def put_upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    """Append the raw request body at `offset`; X-Chunk-SHA256 is verified when sent"""
+    try:
+        return await file_storage.put_chunk(
+            upload_id,
+            current_user.user_id,
+            offset,
+            request.stream(),
+            chunk_checksum=request.headers.get("x-chunk-sha256")
+        )
+    except UploadRejected as e:
+        raise _upload_rejected(e)
+
+@api_router.post("/storage/uploads/{upload_id}/complete")
+async def complete_resumable_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    try:
+        return await file_storage.complete_upload(upload_id, current_user.user_id)
+    except UploadRejected as e:
+        raise _upload_rejected(e)
+
+@api_router.delete("/storage/uploads/{upload_id}")
+async def abort_resumable_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    if not await file_storage.abort_upload(upload_id, current_user.user_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"success": True, "message": "Upload aborted"}
+
+STORAGE_CACHE_MAX_AGE = int(os.getenv("STORAGE_CACHE_MAX_AGE_SECONDS", "86400"))
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+async def _stored_file_response(request: Request, file_info: Dict[str, Any]):
+    """
+    Serve an uploaded file with validators and caching
+
+    Images and media are public so pages can embed them. Other categories need a
+    presigned URL or the owner's session, and are only cached privately.
+
+    Range / If-Range requests and zero-copy sending (http.response.pathsend, where the
+    server offers it) are handled by FileResponse; the ETag is the content checksum,
+    so it stays valid across renames, reconciles and deduplicated copies.
+    """
+    public = file_info.get("category") in PUBLIC_CATEGORIES
+    if not public and not file_storage.verify_presigned(
+        file_info, request.query_params.get("expires"), request.query_params.get("token")
+    ):
+        current_user = await get_current_user(request)
+        if not await file_storage.owns_stored_file(current_user.user_id, file_info):
+            raise HTTPException(status_code=404, detail="File not found")
+    path = Path(file_info["path"])
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+    headers = {"Cache-Control": f"{'public' if public else 'private'}, max-age={STORAGE_CACHE_MAX_AGE}"}
+    if file_info.get("checksum"):
+        headers["ETag"] = f'"{file_info["checksum"]}"'
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+    return FileResponse(
+        path,
+        media_type=file_info.get("mime_type"),
+        headers=headers,
+        filename=file_info.get("filename"),
+        content_disposition_type="inline",
+    )
+
+# Images and media are public like their stored URL, so <img>/<video> tags can load them
+@api_router.get("/storage/{file_id}/download")
+async def download_file(file_id: str, request: Request):
+    """Uploaded file contents with Range, ETag and Cache-Control support"""
+    file_info = await file_storage.get_file(file_id)
+    if not file_info:
+        raise HTTPException(status_code=404, detail="File not found")
+    return await _stored_file_response(request, file_info)
+
+@app.get("/storage/{category}/{stored_filename}")
+async def serve_stored_file(category: str, stored_filename: str, request: Request):
+    """The `url` returned by uploads; documents also accept a presigned `expires`/`token` pair"""
+    file_info = await file_storage.get_stored_file(category, stored_filename)
+    if not file_info:
+        raise HTTPException(status_code=404, detail="File not found")
+    return await _stored_file_response(request, file_info)
+
+@api_router.get("/storage/{file_id}/signed-url")
+async def get_signed_file_url(
+    file_id: str,
+    expires_in: int = Query(3600, ge=60, le=7 * 24 * 3600),
+    current_user: User = Depends(get_current_user)
+):
+    """Time-limited link to one of the user's files, for sharing documents without a session"""
+    url = await file_storage.generate_presigned_url(file_id, expires_in, current_user.user_id)
+    if not url:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"url": url, "expires_in": expires_in}
+
+# Public like the stored file URL itself, so generated sites and previews can use it in <img>
+@api_router.get("/storage/{file_id}/renditions/{name}")
+async def get_file_rendition(file_id: str, name: str):
+    """Thumbnail / web-size / WebP version of an uploaded image, generated on first request"""
+    try:
+        rendition = await file_storage.get_rendition(file_id, name)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception:
+        raise HTTPException(status_code=422, detail="Image could not be processed")
+    if not rendition:
+        raise HTTPException(status_code=404, detail="Rendition not found")
+    path, media_type = rendition
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "public, max-age=86400"})
+
 @api_router.get("/storage/{file_id}")
 async def get_file_info(file_id: str, current_user: User = Depends(get_current_user)):
     """Get file information"""
-    file_info = await file_storage.get_file(file_id)
+    file_info = await file_storage.get_file(file_id, current_user.user_id)
     if not file_info:
         raise HTTPException(status_code=404, detail="File not found")
     return file_info
@@ -1280,28 +1758,84 @@ async def get_file_info(file_id: str, current_user: User = Depends(get_current_u
 @api_router.delete("/storage/{file_id}")
 async def delete_file(file_id: str, current_user: User = Depends(get_current_user)):
     """Delete a file from storage"""
-    result = await file_storage.delete_file(file_id)
+    result = await file_storage.delete_file(file_id, current_user.user_id)
     if not result["success"]:
-        raise HTTPException(status_code=400, detail=result.get("error"))
+        status_code = 404 if result.get("error") == "File not found" else 400
+        raise HTTPException(status_code=status_code, detail=result.get("error"))
     return result
 
+# ==================== ANALYTICS INGEST ====================
+async def _project_for_write_key(write_key: str) -> Optional[str]:
+    key_hash = hash_write_key(write_key)
+    found, project_id = write_key_cache.get(key_hash)
+    if not found:
+        project = await db.projects.find_one({"analytics_write_key_hash": key_hash}, {"_id": 0, "project_id": 1})
+        project_id = project["project_id"] if project else None
+        write_key_cache.set(key_hash, project_id)
+    return project_id
+
+@api_router.post("/projects/{project_id}/analytics/write-key")
+async def rotate_analytics_write_key(project_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Issue a new write key (the old one stops working); the key is only shown in this response"""
+    write_key = generate_write_key()
+    result = await db.projects.update_one(
+        {"project_id": project_id, "user_id": current_user.user_id},
+        {"$set": {"analytics_write_key_hash": hash_write_key(write_key)}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Project not found")
+    write_key_cache.invalidate_project(project_id)
+    ingest_url = _analytics_ingest_url(request)
+    return {"write_key": write_key, "ingest_url": ingest_url, "snippet": beacon_snippet(ingest_url, write_key)}
+
+# Public: generated apps authenticate with their project's write key (?key= since sendBeacon cannot set headers)
+@api_router.post("/analytics/ingest", status_code=202)
+async def ingest_analytics(request: Request, background_tasks: BackgroundTasks, key: Optional[str] = None):
+    """Accept an NDJSON batch of events/metrics (optionally gzip); persisted after the response"""
+    write_key = key or request.headers.get("x-write-key")
+    if not write_key:
+        raise HTTPException(status_code=401, detail="Missing write key")
+    declared = request.headers.get("content-length", "")
+    try:
+        if declared.isdigit() and int(declared) > analytics_ingest.MAX_BODY_BYTES:
+            raise IngestRejected(413, f"Batch exceeds {analytics_ingest.MAX_BODY_BYTES} bytes")
+        project_id = await _project_for_write_key(write_key)
+        if project_id is None:
+            raise HTTPException(status_code=401, detail="Unknown write key")
+        # Limited per project, i.e. per live write key, so a rotated key does not reset it
+        retry_after = ingest_rate_limiter.retry_after(project_id)
+        if retry_after is not None:
+            raise HTTPException(
+                status_code=429,
+                detail="Ingest rate limit exceeded",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+        body = await read_body(request.stream(), request.headers.get("content-encoding"))
+        events, metrics, invalid = parse_records(body, project_id)
+        ingest_rate_limiter.charge(project_id, len(events) + len(metrics) + invalid)
+    except IngestRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    dropped = 0
+    if analytics_service.buffering:
+        dropped = analytics_service.enqueue(events, metrics)
+    elif events or metrics:
+        background_tasks.add_task(analytics_service.persist, events, metrics)
+    return {"accepted": len(events) + len(metrics) - dropped, "invalid": invalid, "dropped": dropped}
+
 # ==================== GENERIC CHAT ENDPOINT ====================
 @api_router.post("/chat/message", response_model=ChatResponse)
 async def chat_message(request: ChatRequest, current_user: User = Depends(get_current_user)):
     """Generic chat endpoint for general AI conversations"""
     try:
-        ai_builder = AIBuilderService()
-        # Use GPT-4 for general chat
-        from openai import AsyncOpenAI
-        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
         # Build conversation history
         messages = [{"role": "system", "content": "You are a helpful AI assistant for the Digital Ninja App Builder. Help users with their questions about building applications, coding, and technical topics."}]
         for msg in request.history:
             messages.append({"role": msg.role, "content": msg.content})
         messages.append({"role": "user", "content": request.message})
         
-        response = await client.chat.completions.create(
+        # Use GPT-4 for general chat (shared pooled client)
+        response = await llm_clients.chat_completion(
             model="gpt-4o",
             messages=messages,
             temperature=0.7,
@@ -1329,6 +1863,7 @@ async def deploy_project(
         )
         if not project:
             raise HTTPException(status_code=404, detail="Project not found")
+        await project_store.hydrate(project)
         
         from one_click_deploy import OneClickDeployService
         deploy_service = OneClickDeployService()
@@ -1383,6 +1918,22 @@ async def get_deployment_status(
 async def health_check():
     return {"status": "ok", "service": "Digital Ninja App Builder", "version": "2.0.0"}
 
+@app.get("/api/health/metrics")
+async def health_metrics():
+    """In-process counters for caches, pools and background workers"""
+    return {
+        "auth_cache": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "indexes": index_bootstrap.summary(),
+        "llm": llm_clients.stats(),
+        "generation_cache": generation_cache.stats(),
+        "sse": sse_hub.stats(),
+        "snapshot_retention": snapshot_retention.stats(),
+        "image_pipeline": file_storage.images.stats(),
+        "storage_janitor": storage_janitor.stats(),
+        "analytics_ingest": {**analytics_service.stats(), "write_keys": write_key_cache.stats(), "rate_limit": ingest_rate_limiter.stats()},
+    }
+
 @app.get("/")
 async def root():
     return {"message": "Digital Ninja App Builder API", "version": "2.0.0", "docs": "/docs"}
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case/whitespace-insensitive form so "Calculator app!" and "calculator  app" share an entry"""
+    text = " ".join((prompt or "").lower().split())
+    return re.sub(r"[\s.!?]+$", "", text)
+
+
+class MemoryCacheBackend:
+    """In-process LRU bounded by entry count and total payload bytes"""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    def _drop(self, key: str) -> None:
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return payload
+
+    async def set(self, key: str, payload: str, ttl_seconds: float) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (time.time() + ttl_seconds, payload)
+        self._bytes += len(payload)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def delete(self, key: str) -> None:
+        if key in self._entries:
+            self._drop(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+class MongoCacheBackend:
+    """Shared cache in a MongoDB collection; a TTL index on expires_at removes stale entries"""
+
+    name = "mongodb"
+
+    def __init__(self, collection, max_entry_bytes: int = 4 * 1024 * 1024):
+        self.collection = collection
+        self.max_entry_bytes = max_entry_bytes
+
+    async def get(self, key: str) -> Optional[str]:
+        doc = await self.collection.find_one(
+            {"cache_key": key, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+            {"_id": 0, "payload": 1}
+        )
+        return doc.get("payload") if doc else None
+
+    async def set(self, key: str, payload: str, ttl_seconds: float) -> None:
+        if len(payload) > self.max_entry_bytes:
+            return
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"cache_key": key},
+            {"$set": {
+                "cache_key": key,
+                "payload": payload,
+                "size": len(payload),
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=ttl_seconds),
+            }},
+            upsert=True
+        )
+
+    async def delete(self, key: str) -> None:
+        await self.collection.delete_one({"cache_key": key})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"max_entry_bytes": self.max_entry_bytes}
+
+
+class GenerationCache:
+    """Tiered cache of generate_app_structure results (memory first, then MongoDB)"""
+
+    def __init__(self):
+        self.enabled = os.getenv("GENERATION_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+        self.ttl_seconds = float(os.getenv("GENERATION_CACHE_TTL_SECONDS", "86400"))
+        self.backends: List[Any] = [MemoryCacheBackend(
+            max_entries=int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "256")),
+            max_bytes=int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        )]
+        self.hits: Dict[str, int] = {}
+        self.misses = 0
+        self.stores = 0
+        self.errors = 0
+
+    def attach_backend(self, backend) -> None:
+        """Add a slower, shared tier behind the in-memory LRU"""
+        self.backends = [b for b in self.backends if b.name != backend.name] + [backend]
+
+    @staticmethod
+    def make_key(prompt: str, tech_stack: Optional[Dict[str, str]], builder_version: str, model: str) -> str:
+        stack = sorted((str(k).lower(), str(v).strip().lower()) for k, v in (tech_stack or {}).items())
+        raw = json.dumps([normalize_prompt(prompt), stack, builder_version, model])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """Return a fresh copy of the cached structure, promoting it to faster tiers"""
+        if not self.enabled:
+            return None
+        for i, backend in enumerate(self.backends):
+            try:
+                payload = await backend.get(key)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Generation cache {backend.name} read failed: {e}")
+                continue
+            if payload is None:
+                continue
+            self.hits[backend.name] = self.hits.get(backend.name, 0) + 1
+            for faster in self.backends[:i]:
+                try:
+                    await faster.set(key, payload, self.ttl_seconds)
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning(f"Generation cache {faster.name} promote failed: {e}")
+            return json.loads(payload)
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, app_structure: Dict) -> None:
+        if not self.enabled:
+            return
+        payload = json.dumps(app_structure)
+        for backend in self.backends:
+            try:
+                await backend.set(key, payload, self.ttl_seconds)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Generation cache {backend.name} write failed: {e}")
+        self.stores += 1
+
+    async def delete(self, key: str) -> None:
+        for backend in self.backends:
+            try:
+                await backend.delete(key)
+            except Exception as e:
+                logger.warning(f"Generation cache {backend.name} delete failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "stores": self.stores,
+            "errors": self.errors,
+            "backends": {b.name: b.stats() for b in self.backends},
+        }
+
+
+generation_cache = GenerationCache()
@@ -0,0 +1,147 @@
+import asyncio
+import contextlib
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_model_limits(raw: str) -> Dict[str, int]:
+    """Parse LLM_MODEL_CONCURRENCY, e.g. "gpt-4o=8,gpt-4o-mini=16" """
+    limits = {}
+    for item in raw.split(","):
+        if "=" not in item:
+            continue
+        model, value = item.split("=", 1)
+        try:
+            limits[model.strip()] = max(1, int(value))
+        except ValueError:
+            logger.warning(f"Ignoring invalid LLM concurrency entry: {item}")
+    return limits
+
+
+class ModelGate:
+    """Concurrency limit and counters for one model"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.errors = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            yield
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class LLMClientRegistry:
+    """Process-wide AsyncOpenAI clients sharing one keep-alive connection pool per API key"""
+
+    def __init__(self):
+        self.max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+        self.max_keepalive_connections = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        self.keepalive_expiry = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "60"))
+        self.timeout = float(os.getenv("LLM_TIMEOUT_SECONDS", "600"))
+        self.default_model_concurrency = int(os.getenv("LLM_DEFAULT_MODEL_CONCURRENCY", "8"))
+        self.model_concurrency = _parse_model_limits(os.getenv("LLM_MODEL_CONCURRENCY", ""))
+        self._clients: Dict[str, AsyncOpenAI] = {}
+        self._gates: Dict[str, ModelGate] = {}
+
+    def get_client(self, api_key: Optional[str] = None) -> AsyncOpenAI:
+        """Return the shared client for this API key, creating it on first use"""
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY not found in environment variables")
+
+        client = self._clients.get(api_key)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+            )
+            client = AsyncOpenAI(api_key=api_key, http_client=http_client)
+            self._clients[api_key] = client
+        return client
+
+    def gate(self, model: str) -> ModelGate:
+        gate = self._gates.get(model)
+        if gate is None:
+            gate = ModelGate(self.model_concurrency.get(model, self.default_model_concurrency))
+            self._gates[model] = gate
+        return gate
+
+    async def chat_completion(self, model: str, api_key: Optional[str] = None, **kwargs) -> Any:
+        """chat.completions.create on the shared client, bounded by the model's concurrency limit"""
+        client = self.get_client(api_key)
+        async with self.gate(model).slot():
+            return await client.chat.completions.create(model=model, **kwargs)
+
+    async def stream_chat_completion(self, model: str, api_key: Optional[str] = None, **kwargs) -> AsyncIterator[str]:
+        """Yield content deltas as they arrive; the model slot is held until the stream ends or is closed"""
+        client = self.get_client(api_key)
+        async with self.gate(model).slot():
+            stream = await client.chat.completions.create(model=model, stream=True, **kwargs)
+            try:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                await stream.close()
+
+    def _open_connections(self, client: AsyncOpenAI) -> Optional[int]:
+        # httpx does not expose pool stats publicly; best effort only
+        try:
+            return len(client._client._transport._pool.connections)
+        except AttributeError:
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": len(self._clients),
+            "max_connections": self.max_connections,
+            "max_keepalive_connections": self.max_keepalive_connections,
+            "open_connections": [self._open_connections(c) for c in self._clients.values()],
+            "models": {model: gate.stats() for model, gate in self._gates.items()},
+        }
+
+    async def aclose(self) -> None:
+        for client in self._clients.values():
+            with contextlib.suppress(Exception):
+                await client.close()
+        self._clients.clear()
+
+
+llm_clients = LLMClientRegistry()
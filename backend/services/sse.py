@@ -0,0 +1,195 @@
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = b": keep-alive\n\n"
+
+
+class SSEChannel:
+    """
+    One logical event stream with a bounded replay log.
+
+    Payloads are serialised into SSE frames once, on publish; every reader
+    (including a reconnecting one) writes the same bytes.
+    """
+
+    def __init__(self, channel_id: str, owner: Optional[str], replay_limit: int, heartbeat_seconds: float):
+        self.channel_id = channel_id
+        self.owner = owner
+        self.heartbeat_seconds = heartbeat_seconds
+        self.frames: Deque[Tuple[int, bytes]] = deque(maxlen=replay_limit)
+        self.seq = 0
+        self.closed = False
+        self.closed_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Condition()
+
+    def _frame(self, data: Any, event: Optional[str]) -> bytes:
+        self.seq += 1
+        lines = [f"id: {self.channel_id}:{self.seq}"]
+        if event:
+            lines.append(f"event: {event}")
+        lines.append(f"data: {json.dumps(data)}")
+        return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+    async def publish(self, data: Any, event: Optional[str] = None) -> None:
+        async with self._changed:
+            frame = self._frame(data, event)
+            self.frames.append((self.seq, frame))
+            self._changed.notify_all()
+
+    async def close(self) -> None:
+        async with self._changed:
+            self.closed = True
+            self.closed_at = time.monotonic()
+            self._changed.notify_all()
+
+    def _pending(self, cursor: int) -> Tuple[int, bytes]:
+        if not self.frames or self.frames[-1][0] <= cursor:
+            return cursor, b""
+        first_seq = self.frames[0][0]
+        start = max(0, cursor + 1 - first_seq)
+        batch = list(itertools.islice(self.frames, start, None))
+        return batch[-1][0], b"".join(frame for _, frame in batch)
+
+    async def subscribe(self, after: int = 0) -> AsyncIterator[bytes]:
+        """Yield everything after `after`, coalescing queued frames into one write"""
+        cursor = after
+        self.subscribers += 1
+        try:
+            while True:
+                async with self._changed:
+                    cursor, chunk = self._pending(cursor)
+                    if not chunk:
+                        if self.closed:
+                            return
+                        try:
+                            await asyncio.wait_for(self._changed.wait(), timeout=self.heartbeat_seconds)
+                        except asyncio.TimeoutError:
+                            chunk = HEARTBEAT
+                        else:
+                            cursor, chunk = self._pending(cursor)
+                if chunk:
+                    yield chunk
+        finally:
+            self.subscribers -= 1
+
+
+class SSEHub:
+    """Runs stream producers as tasks so a dropped connection can resume with Last-Event-ID"""
+
+    def __init__(self):
+        self.heartbeat_seconds = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+        self.replay_limit = int(os.getenv("SSE_REPLAY_EVENTS", "1000"))
+        self.retention_seconds = float(os.getenv("SSE_RETENTION_SECONDS", "300"))
+        self.orphan_grace_seconds = float(os.getenv("SSE_ORPHAN_GRACE_SECONDS", "120"))
+        self._channels: Dict[str, SSEChannel] = {}
+        self.started = 0
+        self.resumed = 0
+        self.orphaned = 0
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for channel_id, channel in list(self._channels.items()):
+            if channel.closed and now - channel.closed_at > self.retention_seconds:
+                del self._channels[channel_id]
+
+    def start(self, producer: Callable[[SSEChannel], Awaitable[None]], owner: Optional[str] = None) -> SSEChannel:
+        """Create a channel and run `producer(channel)` in the background; the channel closes when it returns"""
+        self._prune()
+        channel = SSEChannel(uuid.uuid4().hex, owner, self.replay_limit, self.heartbeat_seconds)
+        self._channels[channel.channel_id] = channel
+
+        async def run():
+            try:
+                await producer(channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"SSE producer {channel.channel_id} failed: {e}")
+                await channel.publish({"type": "error", "message": str(e)})
+            finally:
+                await channel.close()
+
+        channel.task = asyncio.create_task(run())
+        self.started += 1
+        return channel
+
+    def find(self, last_event_id: Optional[str], owner: Optional[str] = None) -> Optional[Tuple[SSEChannel, int]]:
+        """Resolve a Last-Event-ID ("<channel>:<seq>") to a live channel owned by `owner`"""
+        if not last_event_id or ":" not in last_event_id:
+            return None
+        channel_id, _, seq = last_event_id.partition(":")
+        channel = self._channels.get(channel_id)
+        if channel is None or channel.owner != owner or not seq.isdigit():
+            return None
+        return channel, int(seq)
+
+    def _cancel_if_orphaned(self, channel: SSEChannel) -> None:
+        if channel.subscribers == 0 and not channel.closed and channel.task and not channel.task.done():
+            logger.info(f"Cancelling SSE producer {channel.channel_id}: no client reconnected")
+            self.orphaned += 1
+            channel.task.cancel()
+
+    async def _body(self, channel: SSEChannel, after: int) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in channel.subscribe(after):
+                yield chunk
+        finally:
+            if channel.subscribers == 0 and not channel.closed:
+                asyncio.get_running_loop().call_later(
+                    self.orphan_grace_seconds, self._cancel_if_orphaned, channel
+                )
+
+    def response(self, channel: SSEChannel, after: int = 0) -> StreamingResponse:
+        return StreamingResponse(
+            self._body(channel, after),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    def stream(
+        self,
+        producer: Callable[[SSEChannel], Awaitable[None]],
+        owner: Optional[str] = None,
+        last_event_id: Optional[str] = None,
+    ) -> StreamingResponse:
+        """Resume the stream named by Last-Event-ID, or start a new one"""
+        found = self.find(last_event_id, owner)
+        if found:
+            self.resumed += 1
+            return self.response(*found)
+        return self.response(self.start(producer, owner))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "channels": len(self._channels),
+            "active": sum(1 for c in self._channels.values() if not c.closed),
+            "subscribers": sum(c.subscribers for c in self._channels.values()),
+            "started": self.started,
+            "resumed": self.resumed,
+            "orphaned": self.orphaned,
+        }
+
+    async def aclose(self) -> None:
+        for channel in self._channels.values():
+            if channel.task and not channel.task.done():
+                channel.task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await channel.task
+        self._channels.clear()
+
+
+sse_hub = SSEHub()
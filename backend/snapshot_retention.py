@@ -0,0 +1,222 @@
+"""
+Snapshot Retention
+Background thinning of project_snapshots: keep the latest N, one per hour and
+one per day inside configurable windows, and every manual snapshot.
+Delta chains are compacted before anything is deleted. Snapshots share file
+blobs with projects, so deleting one frees only its own document; blobs left
+unreferenced are reclaimed by the file store's sweep at the end of each run.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from periodic_task import MongoLease, PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_created_at(value) -> datetime:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class RetentionPolicy:
+    """Which snapshots survive a retention pass"""
+
+    def __init__(
+        self,
+        keep_latest: int = 20,
+        hourly_hours: int = 24,
+        daily_days: int = 30,
+        keep_manual: bool = True
+    ):
+        self.keep_latest = keep_latest
+        self.hourly_window = timedelta(hours=hourly_hours)
+        self.daily_window = timedelta(days=daily_days)
+        self.keep_manual = keep_manual
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        return cls(
+            keep_latest=int(os.getenv("SNAPSHOT_RETENTION_KEEP_LATEST", "20")),
+            hourly_hours=int(os.getenv("SNAPSHOT_RETENTION_HOURLY_HOURS", "24")),
+            daily_days=int(os.getenv("SNAPSHOT_RETENTION_DAILY_DAYS", "30")),
+            keep_manual=os.getenv("SNAPSHOT_RETENTION_KEEP_MANUAL", "true").lower() not in ("0", "false", "no"),
+        )
+
+    def select_deletions(self, snapshots: List[Dict], now: datetime) -> List[str]:
+        """
+        Args:
+            snapshots: snapshot_id / created_at / auto_created, newest first
+            now: Reference time for the hourly and daily windows
+
+        Returns:
+            IDs to delete; the newest snapshot of each kept hour/day bucket survives
+        """
+        hours_kept = set()
+        days_kept = set()
+        doomed = []
+        for rank, snapshot in enumerate(snapshots):
+            if rank < self.keep_latest:
+                continue
+            if self.keep_manual and not snapshot.get("auto_created"):
+                continue
+            created = _parse_created_at(snapshot["created_at"])
+            age = now - created
+            if age <= self.hourly_window:
+                bucket = created.strftime("%Y%m%d%H")
+                if bucket not in hours_kept:
+                    hours_kept.add(bucket)
+                    continue
+            elif age <= self.daily_window:
+                bucket = created.strftime("%Y%m%d")
+                if bucket not in days_kept:
+                    days_kept.add(bucket)
+                    continue
+            doomed.append(snapshot["snapshot_id"])
+        return doomed
+
+
+class SnapshotRetentionEngine(PeriodicTask):
+    """Periodically applies a RetentionPolicy to every project with snapshots, then sweeps unreferenced blobs"""
+
+    name = "snapshot retention"
+    SELECT_PROJECTION = {"_id": 0, "snapshot_id": 1, "created_at": 1, "auto_created": 1}
+
+    def __init__(
+        self,
+        db,
+        version_control,
+        policy: Optional[RetentionPolicy] = None,
+        interval_seconds: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        file_store=None,
+        blob_min_age_seconds: Optional[float] = None,
+        lease: Optional[MongoLease] = None
+    ):
+        # Compaction rewrites delta chains, so two workers must never run it concurrently;
+        # pass a lease whenever more than one process shares the database
+        super().__init__(
+            interval_seconds or float(os.getenv("SNAPSHOT_RETENTION_INTERVAL_SECONDS", "3600")),
+            lease=lease
+        )
+        self.snapshots_collection = db.project_snapshots
+        self.version_control = version_control
+        # Optional ProjectFileStore whose unreferenced blobs are swept after each run
+        self.file_store = file_store
+        self.blob_min_age_seconds = blob_min_age_seconds or float(os.getenv("FILE_BLOB_GC_MIN_AGE_HOURS", "24")) * 3600
+        self.policy = policy or RetentionPolicy.from_env()
+        self.batch_size = batch_size or int(os.getenv("SNAPSHOT_RETENTION_BATCH_SIZE", "500"))
+        self.snapshots_deleted = 0
+        self.snapshot_bytes_deleted = 0
+        self.blobs_deleted = 0
+        self.blob_bytes_reclaimed = 0
+        self.chains_promoted = 0
+        self.chains_folded = 0
+
+    async def _batch_bytes(self, project_id: str, snapshot_ids: List[str]) -> int:
+        """
+        Stored document size of the snapshots about to be deleted
+
+        Not a net saving: compaction may have rewritten survivors as keyframes, and
+        blob bytes are only freed by the blob sweep.
+        """
+        try:
+            result = await self.snapshots_collection.aggregate([
+                {"$match": {"project_id": project_id, "snapshot_id": {"$in": snapshot_ids}}},
+                {"$group": {"_id": None, "bytes": {"$sum": {"$bsonSize": "$$ROOT"}}}},
+            ]).to_list(length=1)
+            return int(result[0]["bytes"]) if result else 0
+        except Exception as e:
+            logger.debug(f"$bsonSize unavailable, not measuring reclaimed bytes: {e}")
+            return 0
+
+    async def apply_project(self, project_id: str, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Run the policy for one project"""
+        now = now or datetime.now(timezone.utc)
+        snapshots = await self.snapshots_collection.find(
+            {"project_id": project_id},
+            self.SELECT_PROJECTION
+        ).sort("created_at", -1).to_list(length=None)
+
+        delete_ids = self.policy.select_deletions(snapshots, now)
+        report = {"deleted": 0, "snapshot_bytes_deleted": 0, "promoted": 0, "folded": 0}
+        if not delete_ids:
+            return report
+
+        compacted = await self.version_control.compact_before_delete(project_id, delete_ids)
+        report["promoted"] = compacted["promoted"]
+        report["folded"] = compacted["folded"]
+
+        for start in range(0, len(delete_ids), self.batch_size):
+            batch = delete_ids[start:start + self.batch_size]
+            report["snapshot_bytes_deleted"] += await self._batch_bytes(project_id, batch)
+            result = await self.snapshots_collection.delete_many(
+                {"project_id": project_id, "snapshot_id": {"$in": batch}}
+            )
+            report["deleted"] += result.deleted_count
+        return report
+
+    async def run_once(self) -> Dict[str, Any]:
+        """One pass over every project that has snapshots"""
+        started = time.monotonic()
+        totals = {
+            "projects": 0, "deleted": 0, "snapshot_bytes_deleted": 0, "promoted": 0, "folded": 0,
+            "blobs_deleted": 0, "blob_bytes_reclaimed": 0, "errors": 0,
+        }
+        project_ids = await self.snapshots_collection.distinct("project_id")
+        for project_id in project_ids:
+            await self.keep_lease()
+            try:
+                report = await self.apply_project(project_id)
+            except Exception as e:
+                logger.error(f"Snapshot retention failed for project {project_id}: {e}")
+                totals["errors"] += 1
+                continue
+            totals["projects"] += 1
+            for key in ("deleted", "snapshot_bytes_deleted", "promoted", "folded"):
+                totals[key] += report[key]
+
+        if self.file_store is not None:
+            await self.keep_lease()
+            try:
+                swept = await self.file_store.collect_garbage(self.blob_min_age_seconds, self.batch_size)
+                totals["blobs_deleted"] = swept["blobs"]
+                totals["blob_bytes_reclaimed"] = swept["bytes"]
+            except Exception as e:
+                logger.error(f"Blob sweep failed: {e}")
+                totals["errors"] += 1
+
+        self.runs += 1
+        self.snapshots_deleted += totals["deleted"]
+        self.snapshot_bytes_deleted += totals["snapshot_bytes_deleted"]
+        self.blobs_deleted += totals["blobs_deleted"]
+        self.blob_bytes_reclaimed += totals["blob_bytes_reclaimed"]
+        self.chains_promoted += totals["promoted"]
+        self.chains_folded += totals["folded"]
+        self.errors += totals["errors"]
+        self.last_run = {
+            **totals,
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "duration_seconds": round(time.monotonic() - started, 3),
+        }
+        logger.info(
+            f"Snapshot retention: {totals['deleted']} deleted across {totals['projects']} projects, "
+            f"{totals['blobs_deleted']} unreferenced blobs swept ({totals['blob_bytes_reclaimed']} bytes)"
+        )
+        return self.last_run
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "snapshots_deleted": self.snapshots_deleted,
+            "snapshot_bytes_deleted": self.snapshot_bytes_deleted,
+            "blobs_deleted": self.blobs_deleted,
+            "blob_bytes_reclaimed": self.blob_bytes_reclaimed,
+            "chains_promoted": self.chains_promoted,
+            "chains_folded": self.chains_folded,
+        }
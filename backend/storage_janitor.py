@@ -0,0 +1,70 @@
+"""
+Storage Janitor
+Background sweep of the upload storage: stale temp files (abandoned uploads,
+expired resumable sessions) and stored files that nothing references any more.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from periodic_task import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+class StorageJanitor(PeriodicTask):
+    """Runs FileStorageService.sweep_temp / sweep_orphans on a jittered interval"""
+
+    name = "storage janitor"
+
+    def __init__(
+        self,
+        file_storage,
+        interval_seconds: Optional[float] = None,
+        temp_max_age_seconds: Optional[float] = None,
+        orphan_min_age_seconds: Optional[float] = None,
+        jitter: float = 0.1
+    ):
+        super().__init__(interval_seconds or float(os.getenv("STORAGE_JANITOR_INTERVAL_SECONDS", "3600")), jitter)
+        self.file_storage = file_storage
+        self.temp_max_age_seconds = temp_max_age_seconds or float(os.getenv("STORAGE_TEMP_MAX_AGE_HOURS", "24")) * 3600
+        # Grace period so a file renamed into place a moment before its record is inserted survives
+        self.orphan_min_age_seconds = orphan_min_age_seconds or float(os.getenv("STORAGE_ORPHAN_MIN_AGE_HOURS", "24")) * 3600
+        self.temp_files_removed = 0
+        self.temp_bytes_reclaimed = 0
+        self.orphan_files_removed = 0
+        self.orphan_bytes_reclaimed = 0
+
+    async def run_once(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        temp = await self.file_storage.sweep_temp(self.temp_max_age_seconds)
+        orphans = await self.file_storage.sweep_orphans(self.orphan_min_age_seconds)
+
+        self.runs += 1
+        self.temp_files_removed += temp["files"]
+        self.temp_bytes_reclaimed += temp["bytes"]
+        self.orphan_files_removed += orphans["files"]
+        self.orphan_bytes_reclaimed += orphans["bytes"]
+        self.last_run = {
+            "temp": temp,
+            "orphans": orphans,
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "duration_seconds": round(time.monotonic() - started, 3),
+        }
+        if temp["files"] or orphans["files"]:
+            logger.info(
+                f"Storage janitor: removed {temp['files']} temp and {orphans['files']} orphaned files, "
+                f"{temp['bytes'] + orphans['bytes']} bytes reclaimed"
+            )
+        return self.last_run
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "temp_files_removed": self.temp_files_removed,
+            "temp_bytes_reclaimed": self.temp_bytes_reclaimed,
+            "orphan_files_removed": self.orphan_files_removed,
+            "orphan_bytes_reclaimed": self.orphan_bytes_reclaimed,
+        }
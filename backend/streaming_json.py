@@ -0,0 +1,79 @@
+"""
+Streaming JSON
+Incremental scanner for model output that emits each element of the
+top-level `files` array as soon as its object closes.
+"""
+import json
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FilesArrayParser:
+    """
+    Feed raw model text chunk by chunk; `feed` returns the file objects completed by that chunk.
+
+    Text before the first `{` (e.g. a ```json fence) is ignored. The full text is kept in
+    `text` so the caller can parse the finished document (app_name, extra keys) at the end.
+    """
+
+    def __init__(self, key: str = "files"):
+        self.key = key
+        self.text = ""
+        self.files_emitted = 0
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._object_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Dict]:
+        self.text += chunk
+        text = self.text
+        completed = []
+
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == ":" and self._stack == ["{"]:
+                self._pending_key = self._last_string
+            elif c == "," and self._stack == ["{"]:
+                self._pending_key = None
+            elif c in "{[":
+                self._stack.append(c)
+                if c == "[" and len(self._stack) == 2 and self._pending_key == self.key:
+                    self._array_depth = 2
+                elif c == "{" and self._array_depth is not None and len(self._stack) == self._array_depth + 1:
+                    self._object_start = i
+            elif c in "}]":
+                if c == "}" and self._object_start is not None and len(self._stack) == self._array_depth + 1:
+                    try:
+                        completed.append(json.loads(text[self._object_start:i + 1]))
+                        self.files_emitted += 1
+                    except ValueError as e:
+                        logger.warning(f"Skipping unparsable streamed file object: {e}")
+                    self._object_start = None
+                elif c == "]" and self._array_depth is not None and len(self._stack) == self._array_depth:
+                    self._array_depth = None
+                if self._stack:
+                    self._stack.pop()
+
+        self._pos = len(text)
+        return completed
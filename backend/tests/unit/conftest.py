@@ -0,0 +1,253 @@
+"""
+In-memory stand-ins for the Motor collections the unit tests drive: query
+matching, projections, cursors and the update operators the services use.
+"""
+import copy
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _compare(value, op, operand):
+    if value is _MISSING or value is None:
+        return False
+    return {
+        "$gt": lambda: value > operand,
+        "$gte": lambda: value >= operand,
+        "$lt": lambda: value < operand,
+        "$lte": lambda: value <= operand,
+    }[op]()
+
+
+def matches(doc, query):
+    """Equality, $or/$and and the comparison operators the services query with"""
+    for key, cond in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, clause) for clause in cond):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(doc, clause) for clause in cond):
+                return False
+            continue
+        value = _get(doc, key)
+        if isinstance(cond, dict) and any(op.startswith("$") for op in cond):
+            for op, operand in cond.items():
+                if op == "$in":
+                    ok = (None if value is _MISSING else value) in operand
+                elif op == "$nin":
+                    ok = (None if value is _MISSING else value) not in operand
+                elif op == "$ne":
+                    ok = (None if value is _MISSING else value) != operand
+                elif op == "$exists":
+                    ok = (value is not _MISSING) == bool(operand)
+                else:
+                    ok = _compare(value, op, operand)
+                if not ok:
+                    return False
+        elif (None if value is _MISSING else value) != cond:
+            return False
+    return True
+
+
+def project(doc, projection):
+    """Copy of `doc` shaped by a top-level inclusion or exclusion projection"""
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    if projection.get("_id", 1) == 0:
+        doc.pop("_id", None)
+    fields = {k: flag for k, flag in projection.items() if k != "_id"}
+    if any(not flag for flag in fields.values()):
+        for key in fields:
+            doc.pop(key, None)
+        return doc
+    if fields:
+        keep = {key.split(".")[0] for key in fields} | ({"_id"} if projection.get("_id", 1) else set())
+        return {k: v for k, v in doc.items() if k in keep}
+    return doc
+
+
+def _parent(doc, path):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    return doc, leaf
+
+
+def apply_update(doc, update, inserted=False):
+    """Apply $set/$setOnInsert/$unset/$inc/$min/$max/$push (dotted paths allowed) in place"""
+    if inserted:
+        for path, value in update.get("$setOnInsert", {}).items():
+            target, leaf = _parent(doc, path)
+            target[leaf] = value
+    for path, value in update.get("$set", {}).items():
+        target, leaf = _parent(doc, path)
+        target[leaf] = value
+    for path in update.get("$unset", {}):
+        target, leaf = _parent(doc, path)
+        target.pop(leaf, None)
+    for path, delta in update.get("$inc", {}).items():
+        target, leaf = _parent(doc, path)
+        target[leaf] = target.get(leaf, 0) + delta
+    for path, value in update.get("$min", {}).items():
+        target, leaf = _parent(doc, path)
+        target[leaf] = min(target.get(leaf, value), value)
+    for path, value in update.get("$max", {}).items():
+        target, leaf = _parent(doc, path)
+        target[leaf] = max(target.get(leaf, value), value)
+    for path, value in update.get("$push", {}).items():
+        target, leaf = _parent(doc, path)
+        target.setdefault(leaf, []).append(value)
+
+
+class FakeCursor:
+    """Sorts and limits the stored documents; the projection applies on the way out"""
+
+    def __init__(self, docs, projection=None):
+        self.docs = docs
+        self.projection = projection
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda d: d.get(field), reverse=order == -1)
+        return self
+
+    def limit(self, count):
+        if count:
+            self.docs = self.docs[:count]
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    def _output(self):
+        return [project(d, self.projection) for d in self.docs]
+
+    async def _iterate(self):
+        for doc in self._output():
+            yield doc
+
+    async def to_list(self, length=None):
+        docs = self._output()
+        return docs if length is None else docs[:length]
+
+
+class FakeCollection:
+    """List-backed collection; `key` names a field that must stay unique"""
+
+    def __init__(self, docs=None, key=None):
+        self.docs = docs if docs is not None else []
+        self.key = key
+
+    @property
+    def documents(self):
+        return {d[self.key]: d for d in self.docs}
+
+    def _first(self, query, sort=None):
+        docs = [d for d in self.docs if matches(d, query)]
+        if sort:
+            FakeCursor(docs).sort(sort)
+        return docs[0] if docs else None
+
+    def _check_unique(self, doc):
+        if self.key and doc.get(self.key) in self.documents:
+            raise DuplicateKeyError(f"E11000 duplicate key {self.key}: {doc.get(self.key)!r}")
+
+    async def insert_one(self, doc):
+        self._check_unique(doc)
+        self.docs.append(copy.deepcopy(doc))
+        return SimpleNamespace(inserted_id=doc.get("_id"))
+
+    async def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            await self.insert_one(doc)
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        doc = self._first(query, sort)
+        return project(doc, projection) if doc is not None else None
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([d for d in self.docs if matches(d, query)], projection)
+
+    def _upsert(self, query, update):
+        doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        apply_update(doc, update, inserted=True)
+        self._check_unique(doc)
+        self.docs.append(doc)
+        return doc
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self._first(query)
+        if doc is not None:
+            apply_update(doc, update)
+        elif upsert:
+            self._upsert(query, update)
+        return SimpleNamespace(matched_count=int(doc is not None), upserted_id=None)
+
+    async def update_many(self, query, update):
+        docs = [d for d in self.docs if matches(d, query)]
+        for doc in docs:
+            apply_update(doc, update)
+        return SimpleNamespace(matched_count=len(docs))
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        """Always returns the updated document"""
+        doc = self._first(query)
+        if doc is None:
+            if not upsert:
+                return None
+            doc = self._upsert(query, update)
+        else:
+            apply_update(doc, update)
+        return project(doc, projection)
+
+    async def bulk_write(self, operations, ordered=True):
+        upserted = 0
+        for op in operations:
+            result = await self.update_one(op.filter, op.update, upsert=op.upsert)
+            upserted += int(op.upsert and not result.matched_count)
+        return SimpleNamespace(upserted_count=upserted, matched_count=len(operations) - upserted)
+
+    async def delete_one(self, query):
+        doc = self._first(query)
+        if doc is not None:
+            self.docs.remove(doc)
+        return SimpleNamespace(deleted_count=int(doc is not None))
+
+    async def delete_many(self, query):
+        before = len(self.docs)
+        self.docs[:] = [d for d in self.docs if not matches(d, query)]
+        return SimpleNamespace(deleted_count=before - len(self.docs))
+
+
+class FakeUpdateOne:
+    """pymongo.UpdateOne with its filter and update readable (pymongo keeps them private)"""
+
+    def __init__(self, filter, update, upsert=False, **kwargs):
+        self.filter = filter
+        self.update = update
+        self.upsert = upsert
+
+
+@pytest.fixture
+def plain_update_ops(monkeypatch):
+    """Build bulk operations as FakeUpdateOne so FakeCollection.bulk_write can apply them"""
+    import analytics_rollups
+    import project_file_store
+
+    for module in (analytics_rollups, project_file_store):
+        monkeypatch.setattr(module, "UpdateOne", FakeUpdateOne)
@@ -0,0 +1,187 @@
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from analytics_ingest import (
+    BEACON_MARKER,
+    IngestRateLimiter,
+    IngestRejected,
+    WriteKeyCache,
+    generate_write_key,
+    hash_write_key,
+    inject_beacon,
+    parse_records,
+    read_body,
+)
+from analytics_service import AnalyticsService
+from conftest import FakeCollection
+
+
+async def _stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _ndjson(*records):
+    return "\n".join(json.dumps(r) for r in records).encode()
+
+
+@pytest.mark.asyncio
+async def test_read_body_inflates_gzip_with_or_without_header():
+    body = _ndjson({"type": "click"}) * 3
+    packed = gzip.compress(body)
+    assert await read_body(_stream(packed[:10], packed[10:]), "gzip") == body
+    # sendBeacon cannot set Content-Encoding; the magic number is enough
+    assert await read_body(_stream(packed)) == body
+    assert await read_body(_stream(body)) == body
+
+    with pytest.raises(IngestRejected) as e:
+        await read_body(_stream(b"x" * 11), max_bytes=10)
+    assert e.value.status_code == 413
+    with pytest.raises(IngestRejected) as e:
+        await read_body(_stream(gzip.compress(b"\n" * 10_000)), max_decoded=1000)
+    assert e.value.status_code == 413
+    with pytest.raises(IngestRejected) as e:
+        await read_body(_stream(body), "br")
+    assert e.value.status_code == 415
+
+
+def test_parse_records_splits_events_and_metrics_and_skips_bad_lines():
+    now = datetime(2026, 5, 1, 12, 0, tzinfo=timezone.utc)
+    recent = int((now - timedelta(minutes=30)).timestamp() * 1000)
+    body = _ndjson(
+        {"type": "page_view", "data": {"path": "/"}, "user_id": "anon-1", "ts": recent},
+        {"metric": "lcp", "value": 1234.5, "ts": "2026-05-01T11:59:00Z"},
+        {"type": "click", "ts": 0},
+        {"metric": "lcp", "value": "fast"},
+        {"type": "x" * 100},
+        [1, 2],
+    ) + b"\nnot json\n\n"
+
+    events, metrics, invalid = parse_records(body, "p1", received_at=now)
+    assert invalid == 4
+    assert [e["event_type"] for e in events] == ["page_view", "click"]
+    assert events[0]["created_at"] == now - timedelta(minutes=30)
+    # Implausible client clocks fall back to the receive time
+    assert events[1]["created_at"] == now
+    assert metrics == [{
+        "project_id": "p1", "metric_name": "lcp", "value": 1234.5, "unit": "ms",
+        "timestamp": "2026-05-01T11:59:00+00:00", "created_at": now - timedelta(minutes=1),
+    }]
+    with pytest.raises(IngestRejected):
+        parse_records(_ndjson(*[{"type": "a"}] * 4), "p1", max_records=3)
+
+
+def test_parse_records_bounds_event_data():
+    nested = {"a": {"b": {"c": {"d": 1}}}}
+    body = _ndjson(
+        {"type": "ok", "data": nested},
+        {"type": "deep", "data": {"x": nested}},
+        {"type": "big", "data": {"blob": "x" * 5000}},
+    ) + b"\n" + b'{"type": "bomb", "data": ' + b"[" * 5000 + b"]" * 5000 + b"}"
+
+    events, _, invalid = parse_records(body, "p1")
+    assert [e["event_type"] for e in events] == ["ok"] and invalid == 3
+
+
+@pytest.mark.usefixtures("plain_update_ops")
+def test_rollup_buckets_cap_distinct_event_types(monkeypatch):
+    import analytics_rollups
+
+    monkeypatch.setattr(analytics_rollups, "MAX_TYPES_PER_BUCKET", 3)
+    at = datetime(2026, 5, 1, 12, 0, tzinfo=timezone.utc)
+    events = [{"project_id": "p1", "event_type": name, "created_at": at} for name in ("b", "c", "d", "a", "e")]
+
+    # The minute bucket already counts "a"; the hour and day buckets are new
+    updates = analytics_rollups.event_rollup_updates(events, {("p1", "minute", at): ["a"]})
+    incs = {u.filter["granularity"]: u.update["$inc"] for u in updates}
+    assert incs["minute"] == {"total": 5, "types.a": 1, "types.b": 1, "types.c": 1, "types.other": 2}
+    assert incs["hour"] == {"total": 5, "types.b": 1, "types.c": 1, "types.d": 1, "types.other": 2}
+
+
+def test_rate_limiter_refuses_an_empty_bucket_until_it_refills(monkeypatch):
+    import analytics_ingest
+
+    clock = [100.0]
+    monkeypatch.setattr(analytics_ingest.time, "monotonic", lambda: clock[0])
+    limiter = IngestRateLimiter(records_per_second=10, burst=20)
+
+    assert limiter.retry_after("p1") is None
+    # One oversized batch is still charged in full and leaves the key in debt
+    limiter.charge("p1", 50)
+    assert limiter.retry_after("p1") == pytest.approx(3.1)
+    assert limiter.retry_after("p2") is None
+    clock[0] += 3.2
+    assert limiter.retry_after("p1") is None
+    assert limiter.stats()["limited"] == 1
+
+
+def test_inject_beacon_targets_entry_point_once():
+    files = [
+        {"path": "src/App.js", "content": "export default function App(){}"},
+        {"path": "src/index.js", "content": "import App from './App';\nrender(App);\n"},
+    ]
+    assert inject_beacon(files, "https://api.example.com/api/analytics/ingest", "wk_first")
+    assert inject_beacon(files, "https://api.example.com/api/analytics/ingest", "wk_second")
+    entry = files[1]["content"]
+    assert entry.startswith("import App from './App';\nrender(App);\n")
+    assert entry.count(BEACON_MARKER) == 1
+    assert '"https://api.example.com/api/analytics/ingest?key=wk_second"' in entry and "sendBeacon" in entry
+    assert files[0]["content"] == "export default function App(){}"
+    assert not inject_beacon([{"path": "src/main.py", "content": ""}], "u", "k")
+
+
+class FakeProjects(FakeCollection):
+    def __init__(self, docs):
+        super().__init__(docs)
+        self.lookups = 0
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        self.lookups += 1
+        return await super().find_one(query, projection, sort)
+
+
+class FakeDB:
+    def __init__(self, projects):
+        self.projects = FakeProjects(projects)
+        self.analytics = FakeCollection()
+        self.metrics = FakeCollection()
+        self.analytics_rollups = FakeCollection()
+        self.analytics_rollup_users = FakeCollection()
+        self.metrics_rollups = FakeCollection()
+
+
+@pytest.mark.usefixtures("plain_update_ops")
+def test_ingest_endpoint_authenticates_by_write_key_and_answers_202(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from server import app
+
+    key = generate_write_key()
+    db = FakeDB([{"project_id": "p1", "analytics_write_key_hash": hash_write_key(key)}])
+    service = AnalyticsService(db)
+    monkeypatch.setattr("server.db", db)
+    monkeypatch.setattr("server.analytics_service", service)
+    monkeypatch.setattr("server.write_key_cache", WriteKeyCache())
+    monkeypatch.setattr("server.ingest_rate_limiter", IngestRateLimiter(records_per_second=0.01, burst=4))
+    client = TestClient(app)
+
+    body = gzip.compress(_ndjson({"type": "page_view", "user_id": "anon-1"}, {"metric": "lcp", "value": 900}, {"oops": 1}))
+    response = client.post(f"/api/analytics/ingest?key={key}", content=body, headers={"Content-Type": "text/plain"})
+    assert response.status_code == 202
+    assert response.json() == {"accepted": 3, "invalid": 0, "dropped": 0}
+    # Persisted after the response (no buffer running here): events, metrics and rollups
+    assert [d["event_type"] for d in db.analytics.docs] == ["page_view", "unknown"]
+    assert [d["metric_name"] for d in db.metrics.docs] == ["lcp"]
+    assert db.analytics_rollups.docs and db.metrics_rollups.docs
+
+    again = client.post("/api/analytics/ingest", content=_ndjson({"type": "click"}), headers={"X-Write-Key": key})
+    assert again.status_code == 202 and db.projects.lookups == 1
+    # Four records used up the key's burst
+    limited = client.post("/api/analytics/ingest", content=_ndjson({"type": "click"}), headers={"X-Write-Key": key})
+    assert limited.status_code == 429 and int(limited.headers["retry-after"]) > 0
+
+    assert client.post("/api/analytics/ingest?key=wk_nope", content=b"{}").status_code == 401
+    assert client.post("/api/analytics/ingest", content=b"{}").status_code == 401
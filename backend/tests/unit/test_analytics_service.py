@@ -0,0 +1,277 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from analytics_service import AnalyticsService
+from conftest import FakeCollection, FakeCursor, matches
+
+pytestmark = pytest.mark.usefixtures("plain_update_ops")
+
+
+def _value(doc, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        return doc.get(expr[1:])
+    if isinstance(expr, dict) and "$dateTrunc" in expr:
+        date = _value(doc, expr["$dateTrunc"]["date"])
+        return date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if isinstance(expr, dict) and "$hour" in expr:
+        return _value(doc, expr["$hour"]).hour
+    return expr
+
+
+class FakeEvents(FakeCollection):
+    """Evaluates the handful of pipeline stages the service uses"""
+
+    def __init__(self, docs):
+        super().__init__(docs)
+        self.pipelines = []
+
+    def aggregate(self, pipeline, allowDiskUse=False):
+        self.pipelines.append(pipeline)
+        docs = self.docs
+        for stage in pipeline:
+            if "$match" in stage:
+                docs = [d for d in docs if matches(d, stage["$match"])]
+            elif "$group" in stage:
+                groups = {}
+                sizes = {}
+                for d in docs:
+                    key = _value(d, stage["$group"]["_id"])
+                    row = groups.setdefault(key, {"_id": key})
+                    sizes[key] = sizes.get(key, 0) + 1
+                    for field, accumulator in stage["$group"].items():
+                        if field == "_id":
+                            continue
+                        (op, expr), = accumulator.items()
+                        value = _value(d, expr)
+                        if op in ("$sum", "$avg"):
+                            row[field] = row.get(field, 0) + value
+                        elif op == "$min":
+                            row[field] = min(row.get(field, value), value)
+                        elif op == "$max":
+                            row[field] = max(row.get(field, value), value)
+                        elif op == "$first":
+                            row.setdefault(field, value)
+                for key, row in groups.items():
+                    for field, accumulator in stage["$group"].items():
+                        if field != "_id" and "$avg" in accumulator:
+                            row[field] /= sizes[key]
+                docs = list(groups.values())
+            elif "$sort" in stage:
+                (key, direction), = stage["$sort"].items()
+                docs = sorted(docs, key=lambda d: d[key], reverse=direction == -1)
+            elif "$count" in stage:
+                docs = [{stage["$count"]: len(docs)}] if docs else []
+        return FakeCursor(docs)
+
+
+class FakeRawEvents(FakeEvents):
+    """Enforces unique _ids; the first insert_many can drop the connection part-way"""
+
+    name = "analytics"
+
+    def __init__(self, docs, fail_after=None):
+        super().__init__(docs)
+        self.fail_after = fail_after
+
+    async def insert_many(self, docs, ordered=True):
+        stored = {d.get("_id") for d in self.docs}
+        errors = []
+        for index, doc in enumerate(docs):
+            if self.fail_after is not None and index == self.fail_after:
+                self.fail_after = None
+                raise AutoReconnect("connection reset")
+            if doc["_id"] in stored:
+                errors.append({"index": index, "code": 11000, "errmsg": "E11000 duplicate key"})
+                continue
+            self.docs.append(dict(doc))
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+
+class FakeDB:
+    def __init__(self, events):
+        self.analytics = FakeEvents(events)
+        self.metrics = FakeEvents([])
+        self.analytics_rollups = FakeEvents([])
+        self.analytics_rollup_users = FakeEvents([])
+        self.metrics_rollups = FakeEvents([])
+
+
+@pytest.mark.asyncio
+async def test_analytics_counts_are_exact_past_ten_thousand_events():
+    start = datetime(2024, 3, 1, tzinfo=timezone.utc)
+    events = [
+        {
+            "project_id": "p1",
+            "event_type": "click" if i % 3 else "page_view",
+            "user_id": f"u{i % 7}" if i % 5 else None,
+            "created_at": start + timedelta(minutes=i),
+        }
+        for i in range(12000)
+    ]
+    events.append({"project_id": "other", "event_type": "click", "created_at": start})
+    db = FakeDB(events)
+
+    result = await AnalyticsService(db).get_project_analytics(
+        "p1", start_date=start, end_date=start + timedelta(days=30), use_rollups=False
+    )
+    stats = result["stats"]
+
+    assert stats["total_events"] == 12000
+    assert stats["event_types"] == {"click": 8000, "page_view": 4000}
+    assert stats["unique_users"] == 7
+    assert list(stats["daily_events"])[:2] == ["2024-03-01", "2024-03-02"]
+    assert sum(stats["daily_events"].values()) == 12000
+    assert sum(stats["peak_hours"]) == 12000 and stats["peak_hours"][0] == 540
+    assert all(p[0]["$match"]["project_id"] == "p1" for p in db.analytics.pipelines)
+
+
+@pytest.mark.asyncio
+async def test_rollups_answer_windows_like_raw_events():
+    from analytics_rollups import cover_window, floor_bucket, ranges_query
+
+    now = datetime.now(timezone.utc)
+    base = floor_bucket(now, "day") - timedelta(days=2)
+    events = [
+        {
+            "project_id": "p1",
+            "event_type": ["click", "page.view", "error"][i % 3],
+            "user_id": f"u{i % 4}",
+            "created_at": base + timedelta(minutes=7 * i),
+        }
+        for i in range(600)
+    ]
+    db = FakeDB(events)
+    service = AnalyticsService(db)
+    await service._write_event_rollups(events)
+
+    start, end = base + timedelta(hours=5, minutes=3), base + timedelta(days=2, hours=4, minutes=30)
+    ranges = cover_window(start, end, now)
+    assert [g for g, _, _ in ranges] == ["minute", "hour", "day", "hour", "minute"]
+
+    from_rollups = (await service.get_project_analytics("p1", start, end))["stats"]
+    raw = (await service.get_project_analytics("p1", start, end - timedelta(microseconds=1), use_rollups=False))["stats"]
+    raw["event_types"] = {k.replace(".", "_"): v for k, v in raw["event_types"].items()}
+    assert from_rollups == raw
+    # Whole hours and days in the middle: far fewer rollup documents read than events counted
+    read = await db.analytics_rollups.find({"project_id": "p1", **ranges_query(ranges)}).to_list()
+    assert from_rollups["total_events"] > 400 and len(read) < 40
+
+
+@pytest.mark.asyncio
+async def test_metric_rollups_report_min_max_avg():
+    db = FakeDB([])
+    service = AnalyticsService(db)
+    for value in (120.0, 80.0, 100.0):
+        assert await service.track_performance_metric("p1", "lcp", value)
+    await service.track_performance_metric("p1", "ttfb", 30.0)
+
+    result = await service.get_performance_metrics("p1", metric_name="lcp", hours=1)
+    lcp = result["metrics"]["lcp"]
+    assert {k: lcp[k] for k in ("min", "max", "count", "unit", "avg")} == {
+        "min": 80.0, "max": 120.0, "count": 3, "unit": "ms", "avg": 100.0
+    }
+    assert lcp["p50"] == pytest.approx(100.0, rel=0.01)
+    assert 80.0 <= lcp["p99"] <= 120.0
+    assert len(db.metrics.docs) == 4
+
+
+@pytest.mark.asyncio
+async def test_buffered_tracking_writes_batches_and_rollups(tmp_path, monkeypatch):
+    monkeypatch.setenv("INGEST_SPILL_PATH", str(tmp_path))
+    db = FakeDB([])
+    service = AnalyticsService(db)
+    service.start()
+    for i in range(30):
+        assert await service.track_event("p1", "click", {}, user_id=f"u{i % 3}")
+    await service.track_performance_metric("p1", "lcp", 90.0)
+    # Nothing written yet: the calls only queued
+    assert db.analytics.docs == []
+
+    await service.stop()
+    stats = service.stats()
+    assert stats["events"]["flushed"] == 30 and stats["metrics"]["flushed"] == 1
+    assert len(db.analytics.docs) == 30
+    # One coalesced upsert per bucket, not three per event
+    assert len(db.analytics_rollups.docs) <= 6
+    day = next(d for d in db.analytics_rollups.docs if d["granularity"] == "day")
+    assert day["total"] == 30 and day["types"] == {"click": 30}
+    assert len(db.analytics_rollup_users.docs) == 3
+
+
+@pytest.mark.asyncio
+async def test_retry_after_partial_insert_counts_every_event_once(tmp_path, monkeypatch):
+    monkeypatch.setenv("INGEST_SPILL_PATH", str(tmp_path))
+    db = FakeDB([])
+    db.analytics = FakeRawEvents([], fail_after=4)
+    service = AnalyticsService(db)
+    now = datetime.now(timezone.utc)
+    events = [
+        {"project_id": "p1", "event_type": "click", "data": {}, "user_id": f"u{i % 2}",
+         "timestamp": now.isoformat(), "created_at": now}
+        for i in range(10)
+    ]
+    assert service.enqueue(events, []) == 0
+
+    # The flusher is not running, so each flush() is one attempt; the first drops mid-batch
+    assert await service.event_buffer.flush() == 0
+    assert len(db.analytics.docs) == 4 and db.analytics_rollups.docs == []
+    assert await service.event_buffer.flush() == 10
+
+    stats = service.stats()["events"]
+    assert stats["rejected"] == 0 and stats["errors"] == 1
+    assert len(db.analytics.docs) == 10
+    day = next(d for d in db.analytics_rollups.docs if d["granularity"] == "day")
+    assert day["total"] == 10
+
+
+@pytest.mark.asyncio
+async def test_metric_percentiles_merge_across_buckets():
+    import random
+
+    from analytics_rollups import metric_rollup_updates
+
+    rng = random.Random(7)
+    now = datetime.now(timezone.utc)
+    metrics = [
+        {
+            "project_id": "p1",
+            "metric_name": "ttfb",
+            "value": rng.lognormvariate(4, 0.8),
+            "created_at": now - timedelta(minutes=rng.randrange(600)),
+        }
+        for _ in range(5000)
+    ]
+    db = FakeDB([])
+    await db.metrics_rollups.bulk_write(metric_rollup_updates(metrics[:2500]))
+    await db.metrics_rollups.bulk_write(metric_rollup_updates(metrics[2500:]))
+    db.metrics.docs = metrics
+    service = AnalyticsService(db)
+
+    sketched = (await service.get_performance_metrics("p1", hours=11))["metrics"]["ttfb"]
+    exact = (await service.get_performance_metrics("p1", hours=11, use_rollups=False))["metrics"]["ttfb"]
+    assert sketched["count"] == exact["count"] == 5000
+    assert exact["min"] == min(m["value"] for m in metrics) and exact["max"] == max(m["value"] for m in metrics)
+    assert exact["avg"] == pytest.approx(sum(m["value"] for m in metrics) / 5000)
+    assert "$group" in db.metrics.pipelines[-1][1]
+    for label in ("p50", "p90", "p99"):
+        assert sketched[label] == pytest.approx(exact[label], rel=0.02)
+    assert "values" not in sketched
+
+
+def test_quantile_sketch_relative_error_and_merge():
+    from quantile_sketch import QuantileSketch
+
+    values = [0.0, -3.5] + [i * 0.37 for i in range(1, 2000)]
+    whole = QuantileSketch.of(values)
+    left, right = QuantileSketch.of(values[:700]), QuantileSketch.of(values[700:])
+    left.merge(right)
+    ordered = sorted(values)
+    for q in (0.0, 0.01, 0.5, 0.9, 0.99, 1.0):
+        expected = ordered[int(q * (len(ordered) - 1))]
+        assert whole.quantile(q) == pytest.approx(expected, rel=0.01, abs=1e-9)
+        assert left.quantile(q) == whole.quantile(q)
+    assert QuantileSketch().quantile(0.5) is None
@@ -0,0 +1,92 @@
+import pytest
+from starlette.requests import Request
+
+import server
+from auth_cache import UserResolutionCache
+
+
+class FakeCollection:
+    def __init__(self, documents, key):
+        self.documents = {doc[key]: doc for doc in documents}
+        self.key = key
+        self.find_one_calls = 0
+
+    async def find_one(self, query, projection=None):
+        self.find_one_calls += 1
+        doc = self.documents.get(query.get(self.key))
+        return dict(doc) if doc else None
+
+    async def update_one(self, *_args, **_kwargs):
+        return None
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.users = FakeCollection([{
+            "user_id": "user_1",
+            "email": "user@example.com",
+            "name": "Test User",
+            "created_at": "2026-01-13T00:00:00+00:00",
+            "team_id": "team_1",
+            "role": "owner",
+            "plan": "free",
+        }], "user_id")
+        self.teams = FakeCollection([{
+            "team_id": "team_1",
+            "name": "Test Team",
+            "owner_id": "user_1",
+            "plan": "free",
+            "created_at": "2026-01-13T00:00:00+00:00",
+        }], "team_id")
+
+
+def make_request(token: str) -> Request:
+    return Request({
+        "type": "http",
+        "headers": [(b"authorization", f"Bearer {token}".encode())],
+    })
+
+
+def test_cache_expires_and_evicts(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("auth_cache.time.monotonic", lambda: clock[0])
+    cache = UserResolutionCache(ttl_seconds=10, max_entries=2)
+
+    cache.set("u1", "tok1", {"user_id": "u1", "team_id": "t1"})
+    assert cache.get("u1", "tok1")["user_id"] == "u1"
+    assert cache.get("u1", "other-token") is None
+
+    clock[0] += 11
+    assert cache.get("u1", "tok1") is None
+
+    cache.set("u1", "a", {"team_id": "t1"})
+    cache.set("u2", "b", {"team_id": "t1"})
+    cache.set("u3", "c", {"team_id": "t2"})
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+    assert cache.invalidate_team("t1") == 1
+    assert cache.invalidate_user("u3") == 1
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_served_from_cache(monkeypatch):
+    fake_db = FakeDatabase()
+    monkeypatch.setattr("server.db", fake_db)
+    monkeypatch.setattr("server.user_cache", UserResolutionCache(ttl_seconds=60))
+    token = server.create_access_token({"user_id": "user_1"})
+
+    first = await server.get_current_user(make_request(token))
+    second = await server.get_current_user(make_request(token))
+
+    assert first == second
+    assert fake_db.users.find_one_calls == 1
+    assert fake_db.teams.find_one_calls == 1
+
+    server.user_cache.invalidate_user("user_1")
+    await server.get_current_user(make_request(token))
+    assert fake_db.users.find_one_calls == 2
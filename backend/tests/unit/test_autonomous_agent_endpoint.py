@@ -2,22 +2,25 @@ import json
 
 import pytest
 
+from conftest import FakeCollection
+from project_file_store import ProjectFileStore
 from server import app, User, get_current_user
 
 
-class FakeProjectsCollection:
+class FakeProjectsCollection(FakeCollection):
     def __init__(self):
-        self.documents = {}
+        super().__init__(key="project_id")
         self.last_inserted = None
 
     async def insert_one(self, document):
         self.last_inserted = document
-        self.documents[document["project_id"]] = document
+        return await super().insert_one(document)
 
 
 class FakeDatabase:
     def __init__(self):
         self.projects = FakeProjectsCollection()
+        self.file_blobs = FakeCollection(key="blob_hash")
 
     async def command(self, *_args, **_kwargs):
         return {"ok": 1}
@@ -44,9 +47,11 @@ class DummyAutonomousAgent:
 
 
 @pytest.mark.asyncio
+@pytest.mark.usefixtures("plain_update_ops")
 async def test_autonomous_agent_stream_success(monkeypatch):
     fake_db = FakeDatabase()
     monkeypatch.setattr("server.db", fake_db, raising=False)
+    monkeypatch.setattr("server.project_store", ProjectFileStore(fake_db), raising=False)
     monkeypatch.setenv("OPENAI_API_KEY", "test-key")
     monkeypatch.setattr("autonomous_agent.AutonomousAgent", DummyAutonomousAgent, raising=False)
 
@@ -86,4 +91,5 @@ async def test_autonomous_agent_stream_success(monkeypatch):
     assert complete_events, "Expected a completion event from autonomous build stream"
     complete_payload = complete_events[0]
     assert complete_payload["project_id"] == fake_db.projects.last_inserted["project_id"]
-    assert fake_db.projects.last_inserted["autonomous_build"] is True
\ No newline at end of file
+    assert fake_db.projects.last_inserted["autonomous_build"] is True
+    assert fake_db.projects.last_inserted["file_manifest"][0]["path"] == "frontend/src/App.jsx"
\ No newline at end of file
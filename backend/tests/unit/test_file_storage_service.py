@@ -0,0 +1,282 @@
+from pathlib import Path
+
+import pytest
+
+from conftest import FakeCollection
+from file_storage_service import FileStorageService
+
+
+class FakeDB:
+    def __init__(self):
+        self.project_files = FakeCollection(key="file_id")
+        self.storage_objects = FakeCollection(key="checksum")
+        self.upload_sessions = FakeCollection(key="upload_id")
+
+
+@pytest.mark.asyncio
+async def test_lookup_uses_index_not_disk(tmp_path, monkeypatch):
+    db = FakeDB()
+    storage = FileStorageService(str(tmp_path), db=db)
+
+    uploaded = await storage.upload_file(b"hello", "notes.txt", "u1", "p1")
+    assert uploaded["success"] and len(uploaded["checksum"]) == 64
+    assert db.project_files.documents[uploaded["file_id"]]["size"] == 5
+
+    monkeypatch.setattr(Path, "glob", lambda *a, **k: pytest.fail("get_file must not scan disk"))
+    info = await storage.get_file(uploaded["file_id"])
+    assert info["path"] == str(tmp_path / "documents" / uploaded["stored_filename"])
+    assert info["checksum"] == uploaded["checksum"]
+
+    assert (await storage.delete_file(uploaded["file_id"]))["success"]
+    assert db.project_files.documents == {}
+    assert await storage.get_file(uploaded["file_id"]) is None
+
+
+@pytest.mark.asyncio
+async def test_reconcile_repairs_drift(tmp_path):
+    db = FakeDB()
+    storage = FileStorageService(str(tmp_path), db=db)
+
+    kept = await storage.upload_file(b"keep", "a.txt", "u1")
+    gone = await storage.upload_file(b"gone", "b.txt", "u1")
+    grown = await storage.upload_file(b"small", "c.png", "u1")
+    (tmp_path / "documents" / gone["stored_filename"]).unlink()
+    (tmp_path / "images" / grown["stored_filename"]).write_bytes(b"much bigger now")
+    (tmp_path / "media" / "stray0000000.mp4").write_bytes(b"stray")
+
+    dry = await storage.reconcile_index(dry_run=True)
+    assert dry == {"missing_on_disk": [gone["file_id"]], "unindexed": ["stray0000000"],
+                   "size_mismatch": [grown["file_id"]], "refs_repaired": [gone["stored_filename"], grown["stored_filename"], "stray0000000.mp4"]}
+    assert gone["file_id"] in db.project_files.documents
+
+    await storage.reconcile_index()
+    docs = db.project_files.documents
+    assert set(docs) == {kept["file_id"], grown["file_id"], "stray0000000"}
+    assert docs[grown["file_id"]]["size"] == len(b"much bigger now")
+    assert docs["stray0000000"]["category"] == "media"
+    assert db.storage_objects.documents[docs["stray0000000"]["checksum"]]["refs"] == 1
+    assert not any(d["stored_filename"] == gone["stored_filename"] for d in db.storage_objects.docs)
+    clean = await storage.reconcile_index(dry_run=True)
+    assert all(ids == [] for ids in clean.values())
+
+
+@pytest.mark.asyncio
+async def test_streamed_multipart_upload_is_hashed_and_size_limited(tmp_path):
+    import hashlib
+
+    from file_storage_service import UploadTooLarge
+    from multipart_stream import disposition_params, iter_parts, parse_boundary
+
+    payload = bytes(range(256)) * 40
+    body = (
+        b"--xyz\r\nContent-Disposition: form-data; name=\"file\"; filename=\"clip.mp4\"\r\n"
+        b"Content-Type: video/mp4\r\n\r\n" + payload + b"\r\n--xyz--\r\n"
+    )
+
+    async def network(size=7):
+        for i in range(0, len(body), size):
+            yield body[i:i + size]
+
+    async def file_part():
+        parts = iter_parts(network(), parse_boundary("multipart/form-data; boundary=xyz"))
+        async for kind, value in parts:
+            if kind == "headers":
+                assert disposition_params(value)["filename"] == "clip.mp4"
+            elif kind == "data":
+                yield value
+
+    db = FakeDB()
+    storage = FileStorageService(str(tmp_path), db=db)
+    result = await storage.upload_stream(file_part(), "clip.mp4", "u1", max_bytes=len(payload))
+    assert result["category"] == "media" and result["size"] == len(payload)
+    assert result["checksum"] == hashlib.sha256(payload).hexdigest()
+    assert (tmp_path / "media" / result["stored_filename"]).read_bytes() == payload
+
+    with pytest.raises(UploadTooLarge):
+        await storage.upload_stream(file_part(), "clip.mp4", "u1", max_bytes=1000)
+    assert list((tmp_path / "temp").iterdir()) == []
+    assert len(db.project_files.documents) == 1
+
+
+@pytest.mark.asyncio
+async def test_resumable_upload_resumes_dedups_and_refcounts(tmp_path):
+    import hashlib
+
+    from file_storage_service import UploadRejected
+
+    async def body(data):
+        yield data
+
+    db = FakeDB()
+    storage = FileStorageService(str(tmp_path), db=db)
+    payload = b"0123456789" * 10
+
+    started = await storage.init_upload("video.mp4", len(payload), "u1", project_id="p1")
+    upload_id = started["upload_id"]
+    await storage.put_chunk(upload_id, "u1", 0, body(payload[:40]))
+
+    # A bad chunk is rolled back and the client is told where to resume
+    with pytest.raises(UploadRejected) as bad:
+        await storage.put_chunk(upload_id, "u1", 40, body(payload[40:70]), chunk_checksum="0" * 64)
+    assert bad.value.status_code == 400
+    with pytest.raises(UploadRejected) as gap:
+        await storage.put_chunk(upload_id, "u1", 70, body(payload[70:]))
+    assert gap.value.status_code == 409 and gap.value.offset == 40
+    assert (await storage.upload_status(upload_id, "u1"))["offset"] == 40
+
+    await storage.put_chunk(upload_id, "u1", 40, body(payload[40:]),
+                            chunk_checksum=hashlib.sha256(payload[40:]).hexdigest())
+    first = await storage.complete_upload(upload_id, "u1")
+    checksum = hashlib.sha256(payload).hexdigest()
+    assert first["checksum"] == checksum and first["category"] == "media"
+
+    # Another user's checksum alone does not claim the content: they must send the bytes
+    probe = await storage.init_upload("copy.mp4", len(payload), "u2", checksum=checksum)
+    assert not probe["complete"]
+    assert await storage.abort_upload(probe["upload_id"], "u2")
+    assert await storage.get_file(first["file_id"], "u2") is None
+    assert (await storage.delete_file(first["file_id"], "u2"))["error"] == "File not found"
+
+    # Same bytes again: the owner's known checksum short-circuits, a plain upload shares the file
+    second = await storage.init_upload("copy.mp4", len(payload), "u1", checksum=checksum)
+    third = await storage.upload_file(payload, "again.mp4", "u3")
+    assert second["complete"] and second["stored_filename"] == first["stored_filename"]
+    assert third["stored_filename"] == first["stored_filename"]
+    assert db.storage_objects.documents[checksum]["refs"] == 3
+    stored = tmp_path / "media" / first["stored_filename"]
+    assert [p.name for p in (tmp_path / "media").iterdir()] == [stored.name]
+
+    for result in (first, second):
+        await storage.delete_file(result["file_id"])
+        assert stored.exists()
+    await storage.delete_file(third["file_id"])
+    assert not stored.exists() and db.storage_objects.docs == []
+    assert list((tmp_path / "temp").iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_image_uploads_advertise_renditions_rendered_once(tmp_path):
+    db = FakeDB()
+    storage = FileStorageService(str(tmp_path), db=db)
+
+    document = await storage.upload_file(b"%PDF", "spec.pdf", "u1")
+    assert "renditions" not in document
+    assert await storage.get_rendition(document["file_id"], "thumb") is None
+
+    pil = pytest.importorskip("PIL.Image")
+    import io
+
+    buffer = io.BytesIO()
+    pil.new("RGBA", (2000, 1000), (255, 0, 0, 128)).save(buffer, "PNG")
+    image = await storage.upload_file(buffer.getvalue(), "hero.png", "u1")
+    assert set(image["renditions"]) == {"thumb", "web", "webp"}
+
+    path, media_type = await storage.get_rendition(image["file_id"], "thumb")
+    assert media_type == "image/jpeg"
+    with pil.open(path) as thumb:
+        assert thumb.size == (320, 160)
+    assert (await storage.get_rendition(image["file_id"], "thumb"))[0] == path
+    assert storage.images.stats()["generated"] == 1 and storage.images.stats()["hits"] == 1
+    assert (tmp_path / "images" / image["stored_filename"]).read_bytes() == buffer.getvalue()
+    storage.images.shutdown()
+
+
+def test_download_supports_range_etag_and_public_url(tmp_path, monkeypatch):
+    import asyncio
+
+    from fastapi.testclient import TestClient
+
+    from server import app
+
+    storage = FileStorageService(str(tmp_path), db=FakeDB())
+    monkeypatch.setattr("server.file_storage", storage)
+    payload = bytes(range(256)) * 8
+    uploaded = asyncio.run(storage.upload_file(payload, "clip.mp4", "u1"))
+    etag = f'"{uploaded["checksum"]}"'
+
+    client = TestClient(app)
+    full = client.get(f"/api/storage/{uploaded['file_id']}/download")
+    assert full.status_code == 200 and full.content == payload
+    assert full.headers["etag"] == etag and full.headers["accept-ranges"] == "bytes"
+    assert "max-age" in full.headers["cache-control"]
+
+    part = client.get(uploaded["url"], headers={"Range": "bytes=100-199"})
+    assert part.status_code == 206 and part.content == payload[100:200]
+    assert part.headers["content-range"] == f"bytes 100-199/{len(payload)}"
+
+    cached = client.get(uploaded["url"], headers={"If-None-Match": f'W/"other", {etag}'})
+    assert cached.status_code == 304 and cached.content == b""
+
+    assert client.get("/storage/images/../../secret").status_code == 404
+    assert client.get("/api/storage/missing/download").status_code == 404
+    assert full.headers["cache-control"].startswith("public")
+
+
+def test_documents_need_a_session_or_presigned_url(tmp_path, monkeypatch):
+    import asyncio
+
+    from fastapi.testclient import TestClient
+
+    from server import app
+
+    storage = FileStorageService(str(tmp_path), db=FakeDB(), signing_key="test-key")
+    monkeypatch.setattr("server.file_storage", storage)
+    uploaded = asyncio.run(storage.upload_file(b"%PDF-1.7 contract", "contract.pdf", "u1"))
+    client = TestClient(app)
+
+    assert client.get(uploaded["url"]).status_code == 401
+    assert client.get(f"/api/storage/{uploaded['file_id']}/download").status_code == 401
+
+    signed = asyncio.run(storage.generate_presigned_url(uploaded["file_id"], 60, "u1"))
+    response = client.get(signed)
+    assert response.status_code == 200 and response.content == b"%PDF-1.7 contract"
+    assert response.headers["cache-control"].startswith("private")
+
+    assert client.get(signed.replace("token=", "token=0")).status_code == 401
+    assert asyncio.run(storage.generate_presigned_url(uploaded["file_id"], 60, "u2")) is None
+    expired = asyncio.run(storage.generate_presigned_url(uploaded["file_id"], -1, "u1"))
+    assert client.get(expired).status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_janitor_sweeps_stale_temp_and_orphans_only(tmp_path, monkeypatch):
+    import os
+
+    import file_storage_service
+    from storage_janitor import StorageJanitor
+
+    monkeypatch.setattr(file_storage_service, "SCAN_BATCH", 2)
+    db = FakeDB()
+    storage = FileStorageService(str(tmp_path), db=db)
+    kept = await storage.upload_file(b"referenced", "kept.txt", "u1")
+    live = await storage.init_upload("big.mp4", 100, "u1")
+
+    old = 1_000_000_000
+    for name, data in [("abandoned.part", b"x" * 10), ("stale.tmp", b"y" * 5)]:
+        (tmp_path / "temp" / name).write_bytes(data)
+        os.utime(tmp_path / "temp" / name, (old, old))
+    os.utime(tmp_path / "temp" / f"{live['upload_id']}.part", (old, old))
+    (tmp_path / "temp" / "fresh.tmp").write_bytes(b"new")
+    (tmp_path / "media" / "orphan.mp4").write_bytes(b"z" * 7)
+    os.utime(tmp_path / "media" / "orphan.mp4", (old, old))
+    os.utime(tmp_path / "documents" / kept["stored_filename"], (old, old))
+    derived = tmp_path / "derived"
+    gone = "f" * 64
+    for checksum in (kept["checksum"], gone):
+        (derived / checksum[:2]).mkdir(exist_ok=True)
+        (derived / checksum[:2] / f"{checksum}-320w-q75.jpg").write_bytes(b"r" * 3)
+        os.utime(derived / checksum[:2] / f"{checksum}-320w-q75.jpg", (old, old))
+
+    janitor = StorageJanitor(storage, interval_seconds=60, temp_max_age_seconds=3600, orphan_min_age_seconds=3600)
+    report = await janitor.run_once()
+
+    assert report["temp"] == {"files": 2, "bytes": 15}
+    assert report["orphans"] == {"files": 2, "bytes": 10}
+    assert sorted(p.name for p in (tmp_path / "temp").iterdir()) == sorted([f"{live['upload_id']}.part", "fresh.tmp"])
+    assert (tmp_path / "documents" / kept["stored_filename"]).exists()
+    assert [p.name for p in derived.rglob("*.jpg")] == [f"{kept['checksum']}-320w-q75.jpg"]
+    assert janitor.stats()["orphan_bytes_reclaimed"] == 10
+
+    # Deleting the last reference to an original takes its renditions with it
+    await storage.delete_file(kept["file_id"])
+    assert list(derived.rglob("*.jpg")) == []
@@ -0,0 +1,45 @@
+import pytest
+
+from conftest import FakeCollection
+from services.generation_cache import GenerationCache, MemoryCacheBackend, MongoCacheBackend
+
+
+def test_key_normalises_prompt_and_stack():
+    key = GenerationCache.make_key("Build a  Calculator app!", {"frontend": "React"}, "v2", "gpt-4o")
+
+    assert key == GenerationCache.make_key("build a calculator app", {"frontend": "react "}, "v2", "gpt-4o")
+    assert key != GenerationCache.make_key("build a calculator app", {"frontend": "React"}, "v1", "gpt-4o")
+    assert key != GenerationCache.make_key("build a todo app", {"frontend": "React"}, "v2", "gpt-4o")
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_evicts_by_size_and_expires():
+    backend = MemoryCacheBackend(max_entries=10, max_bytes=10)
+    await backend.set("a", "xxxxxx", ttl_seconds=60)
+    await backend.set("b", "yyyyyy", ttl_seconds=60)
+
+    assert await backend.get("a") is None
+    assert await backend.get("b") == "yyyyyy"
+    assert backend.stats()["evictions"] == 1
+
+    await backend.set("c", "z", ttl_seconds=-1)
+    assert await backend.get("c") is None
+
+
+@pytest.mark.asyncio
+async def test_mongo_hit_is_promoted_and_returned_as_copy():
+    collection = FakeCollection(key="cache_key")
+    cache = GenerationCache()
+    cache.attach_backend(MongoCacheBackend(collection))
+    await cache.set("k", {"files": [{"path": "App.js", "content": "x"}]})
+
+    cache.backends[0] = MemoryCacheBackend()
+    first = await cache.get("k")
+    first["files"].clear()
+    second = await cache.get("k")
+
+    assert second["files"][0]["path"] == "App.js"
+    assert len(collection.docs) == 1 and collection.docs[0]["expires_at"] > collection.docs[0]["created_at"]
+    assert cache.stats()["hits"] == {"mongodb": 1, "memory": 1}
+    assert await cache.get("missing") is None
+    assert cache.misses == 1
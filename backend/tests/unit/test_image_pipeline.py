@@ -0,0 +1,70 @@
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import image_pipeline
+from image_pipeline import ImagePipeline
+
+SPEC = {"width": 320, "format": "webp", "quality": 80}
+
+
+class FakeExecutor(Executor):
+    """Runs inline; the first `broken` executors created report a dead worker"""
+
+    created = []
+
+    def __init__(self, broken):
+        self.broken = broken
+        self.shut_down = False
+        FakeExecutor.created.append(self)
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        if self.broken:
+            future.set_exception(BrokenProcessPool("worker died"))
+        else:
+            future.set_result(fn(*args, **kwargs))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    FakeExecutor.created = []
+    monkeypatch.setattr(image_pipeline, "_render", lambda *args: {"width": 320, "height": 200})
+    return ImagePipeline(tmp_path / "cache", max_workers=1)
+
+
+@pytest.mark.asyncio
+async def test_broken_pool_is_replaced_and_retried_once(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "_new_executor", lambda: FakeExecutor(broken=len(FakeExecutor.created) == 0))
+
+    dest = await pipeline._run(pipeline.cache_path / "src.png", pipeline.cache_path / "ab" / "out.webp", SPEC)
+
+    assert dest.name == "out.webp"
+    assert len(FakeExecutor.created) == 2 and FakeExecutor.created[0].shut_down
+    assert pipeline.stats()["pool_restarts"] == 1 and pipeline.generated == 1
+
+
+@pytest.mark.asyncio
+async def test_broken_pool_twice_fails_the_render(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline, "_new_executor", lambda: FakeExecutor(broken=True))
+
+    with pytest.raises(BrokenProcessPool):
+        await pipeline._run(pipeline.cache_path / "src.png", pipeline.cache_path / "ab" / "out.webp", SPEC)
+
+    assert len(FakeExecutor.created) == 2 and pipeline._executor is None
+    assert pipeline.failed == 1
+
+
+def test_pool_does_not_fork(tmp_path, monkeypatch):
+    created = {}
+    monkeypatch.setattr(image_pipeline, "ProcessPoolExecutor", lambda **kwargs: created.update(kwargs))
+
+    ImagePipeline(tmp_path, max_workers=3)._new_executor()
+
+    assert created["max_workers"] == 3
+    assert created["mp_context"].get_start_method() in ("forkserver", "spawn")
@@ -0,0 +1,107 @@
+import pytest
+
+from index_bootstrap import IndexBootstrap
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def to_list(self, length=None):
+        return self.documents
+
+
+class FakeCollection:
+    def __init__(self, indexes=None, stats=None):
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+        self.indexes.update(indexes or {})
+        self.stats = stats or []
+        self.created = []
+
+    async def index_information(self):
+        return dict(self.indexes)
+
+    async def create_index(self, keys, **options):
+        self.created.append(options["name"])
+        self.indexes[options["name"]] = {"key": list(keys), **{k: v for k, v in options.items() if k != "name"}}
+        return options["name"]
+
+    def aggregate(self, pipeline):
+        return FakeCursor(self.stats)
+
+
+class FakeDatabase(dict):
+    def __init__(self):
+        super().__init__()
+        self.commands = []
+
+    def __getitem__(self, name):
+        return self.setdefault(name, FakeCollection())
+
+    async def command(self, name, collection, **kwargs):
+        self.commands.append((name, collection, kwargs))
+        index = kwargs["index"]
+        self[collection].indexes[index["name"]]["expireAfterSeconds"] = index["expireAfterSeconds"]
+        return {"ok": 1}
+
+
+SPECS = [
+    ("users", [("email", 1)], {"name": "users_email"}),
+    ("users", [("user_id", 1)], {"name": "users_user_id", "unique": True}),
+]
+
+
+@pytest.mark.asyncio
+async def test_dry_run_reports_without_creating():
+    db = FakeDatabase()
+    db["users"] = FakeCollection(
+        indexes={"legacy_name": {"key": [("name", 1)]}, "email_1": {"key": [("email", 1)]}},
+        stats=[{"name": "legacy_name", "accesses": {"ops": 0}}, {"name": "email_1", "accesses": {"ops": 9}}],
+    )
+    bootstrap = IndexBootstrap(db, specs=SPECS)
+
+    report = await bootstrap.ensure_indexes(dry_run=True)
+
+    assert report["present"] == ["users.users_email"]
+    assert report["missing"] == ["users.users_user_id"]
+    assert report["undeclared"] == ["users.legacy_name"]
+    assert report["unused"] == ["users.legacy_name"]
+    assert db["users"].created == []
+
+
+@pytest.mark.asyncio
+async def test_apply_is_idempotent():
+    db = FakeDatabase()
+    bootstrap = IndexBootstrap(db, specs=SPECS)
+
+    first = await bootstrap.ensure_indexes()
+    second = await bootstrap.ensure_indexes()
+
+    assert first["created"] == ["users.users_email", "users.users_user_id"]
+    assert second["created"] == []
+    assert len(second["present"]) == 2
+    assert bootstrap.summary()["present"] == 2
+
+
+@pytest.mark.asyncio
+async def test_option_changes_are_reported_and_ttl_is_applied():
+    specs = SPECS + [("events", [("created_at", 1)], {"name": "events_ttl", "expireAfterSeconds": 3600})]
+    db = FakeDatabase()
+    db["users"] = FakeCollection(indexes={
+        "email_1": {"key": [("email", 1)]},
+        "user_id_1": {"key": [("user_id", 1)]},
+    })
+    db["events"] = FakeCollection(indexes={"created_at_1": {"key": [("created_at", 1)], "expireAfterSeconds": 86400}})
+    bootstrap = IndexBootstrap(db, specs=specs)
+
+    dry = await bootstrap.ensure_indexes(dry_run=True)
+    assert [m["index"] for m in dry["mismatched"]] == ["users.users_user_id", "events.events_ttl"]
+    assert dry["mismatched"][1]["options"] == {"expireAfterSeconds": {"declared": 3600, "existing": 86400}}
+    assert db.commands == []
+
+    applied = await bootstrap.ensure_indexes()
+    assert applied["modified"] == ["events.events_ttl"]
+    # A uniqueness change needs a rebuild, so it is left to an operator
+    assert [m["index"] for m in applied["mismatched"]] == ["users.users_user_id"]
+    assert db["events"].indexes["created_at_1"]["expireAfterSeconds"] == 3600
+    assert "events.events_ttl" in (await bootstrap.ensure_indexes())["present"]
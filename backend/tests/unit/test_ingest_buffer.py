@@ -0,0 +1,128 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from ingest_buffer import IngestBuffer
+
+
+class FakeSink:
+    def __init__(self):
+        self.batches = []
+        self.failures = 0
+
+    async def __call__(self, docs):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("primary stepped down")
+        self.batches.append(list(docs))
+        return 0
+
+    @property
+    def docs(self):
+        return [d for batch in self.batches for d in batch]
+
+
+@pytest.mark.asyncio
+async def test_flushes_in_batches_on_size_threshold(tmp_path):
+    sink = FakeSink()
+    buffer = IngestBuffer("events", sink, batch_size=10, flush_interval=60, max_queued=1000, spill_path=str(tmp_path))
+    buffer.start()
+    for i in range(25):
+        assert buffer.add({"n": i})
+    await asyncio.sleep(0.05)
+    # Size threshold woke the flusher well before the 60s interval
+    assert [len(b) for b in sink.batches] == [10, 10, 5]
+    await buffer.stop()
+    assert buffer.stats()["flushed"] == 25 and buffer.stats()["pending"] == 0
+    assert all("_id" in d for d in sink.docs)
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_in_order(tmp_path):
+    sink = FakeSink()
+    sink.failures = 1
+    buffer = IngestBuffer("events", sink, batch_size=4, max_queued=100, spill_path=str(tmp_path))
+    for i in range(6):
+        buffer.add({"n": i})
+
+    assert await buffer.flush() == 0
+    assert buffer.stats()["errors"] == 1 and buffer.stats()["pending"] == 6
+    assert await buffer.flush() == 6
+    assert [d["n"] for d in sink.docs] == list(range(6))
+
+
+@pytest.mark.asyncio
+async def test_overflow_drop_policy_counts_drops(tmp_path):
+    buffer = IngestBuffer("events", FakeSink(), batch_size=5, max_queued=3, overflow="drop", spill_path=str(tmp_path))
+    results = [buffer.add({"n": i}) for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert buffer.stats()["queued"] == 3 and buffer.stats()["dropped"] == 2
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.asyncio
+async def test_overflow_spills_to_disk_and_replays(tmp_path):
+    sink = FakeSink()
+    buffer = IngestBuffer("events", sink, batch_size=2, max_queued=2, overflow="spill", spill_path=str(tmp_path))
+    created = datetime(2026, 1, 2, 3, 4, tzinfo=timezone.utc)
+    for i in range(5):
+        assert buffer.add({"n": i, "created_at": created})
+    assert buffer.stats()["spilled"] == 3
+
+    # Replay fails part-way: nothing is lost, the remainder waits on disk
+    calls = 0
+    real_write = sink.__call__
+
+    async def flaky(docs):
+        nonlocal calls
+        calls += 1
+        if calls == 3:
+            raise ConnectionError("timed out")
+        return await real_write(docs)
+
+    buffer.flush_batch = flaky
+    await buffer.flush()
+    assert [d["n"] for d in sink.docs] == [0, 1, 2, 3]
+    assert buffer.spill_file.exists()
+
+    await buffer.flush()
+    assert [d["n"] for d in sink.docs] == [0, 1, 2, 3, 4]
+    assert sink.docs[4]["created_at"] == created
+    assert buffer.stats()["replayed"] == 3
+    assert not buffer.spill_file.exists()
+
+
+@pytest.mark.asyncio
+async def test_stop_spills_what_cannot_be_written(tmp_path):
+    sink = FakeSink()
+    buffer = IngestBuffer("events", sink, batch_size=10, max_queued=100, spill_path=str(tmp_path))
+    buffer.start()
+    for i in range(3):
+        buffer.add({"n": i})
+    sink.failures = 1
+    await buffer.stop()
+    assert sink.docs == [] and buffer.stats()["spilled"] == 3
+
+    # The next process picks the spilled documents up on its first flush
+    restarted = IngestBuffer("events", sink, batch_size=10, max_queued=100, spill_path=str(tmp_path))
+    assert await restarted.flush() == 3
+    assert [d["n"] for d in sink.docs] == [0, 1, 2]
+
+
+@pytest.mark.asyncio
+async def test_replay_claims_only_spill_files_of_exited_workers(tmp_path, monkeypatch):
+    import ingest_buffer
+    from bson import json_util
+
+    monkeypatch.setattr(ingest_buffer, "_process_alive", lambda pid: pid == 222)
+    for pid, kind, n in [(111, "jsonl", 0), (111, "replay", 1), (222, "jsonl", 2)]:
+        (tmp_path / f"events.{pid}.{kind}").write_text(json_util.dumps({"n": n}) + "\n")
+    (tmp_path / "metrics.111.jsonl").write_text(json_util.dumps({"n": 9}) + "\n")
+
+    sink = FakeSink()
+    buffer = IngestBuffer("events", sink, batch_size=10, max_queued=100, spill_path=str(tmp_path))
+    assert await buffer.flush() == 2
+    assert sorted(d["n"] for d in sink.docs) == [0, 1]
+    # A live worker's file and another buffer's file are left alone
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["events.222.jsonl", "metrics.111.jsonl"]
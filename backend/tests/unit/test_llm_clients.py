@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from services.llm_clients import LLMClientRegistry
+
+
+def test_clients_are_shared_per_api_key(monkeypatch):
+    monkeypatch.setenv("LLM_MODEL_CONCURRENCY", "gpt-4o=2,bad-entry")
+    registry = LLMClientRegistry()
+
+    assert registry.get_client("key-a") is registry.get_client("key-a")
+    assert registry.get_client("key-a") is not registry.get_client("key-b")
+    assert registry.gate("gpt-4o").limit == 2
+    assert registry.gate("gpt-4o-mini").limit == registry.default_model_concurrency
+
+
+@pytest.mark.asyncio
+async def test_model_gate_bounds_concurrency(monkeypatch):
+    monkeypatch.setenv("LLM_MODEL_CONCURRENCY", "gpt-4o=2")
+    registry = LLMClientRegistry()
+    gate = registry.gate("gpt-4o")
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with gate.slot():
+            peak = max(peak, gate.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(call() for _ in range(6)))
+
+    assert peak == 2
+    stats = registry.stats()["models"]["gpt-4o"]
+    assert stats["requests"] == 6
+    assert stats["in_flight"] == 0
+    assert stats["waiting"] == 0
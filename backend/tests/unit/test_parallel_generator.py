@@ -0,0 +1,128 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import parallel_generator
+from parallel_generator import ParallelAppGenerator
+
+
+def _response(content, finish_reason="stop"):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)])
+
+
+class FakeLLM:
+    def __init__(self, delays):
+        self.delays = delays
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = {}
+
+    async def chat_completion(self, model, api_key=None, **kwargs):
+        if "response_format" in kwargs:
+            return _response(json.dumps({
+                "app_name": "Demo",
+                "files": [{"path": p, "language": "javascript"} for p in self.delays] + [{"path": "src/a.js"}],
+            }))
+        path = kwargs["messages"][0]["content"].split("contents of `")[1].split("`")[0]
+        self.calls[path] = self.calls.get(path, 0) + 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays[path])
+        finally:
+            self.in_flight -= 1
+        if path == "src/flaky.js":
+            if len(kwargs["messages"]) == 1:
+                return _response("// src/flaky.js\nexport const a = ", finish_reason="length")
+            assert kwargs["messages"][1] == {"role": "assistant", "content": "// src/flaky.js\nexport const a = "}
+            return _response("1;")
+        if path == "src/broken.js":
+            return _response("never ends", finish_reason="length")
+        return _response(f"```js\n// {path}\n```")
+
+
+@pytest.mark.asyncio
+async def test_files_stream_in_completion_order_under_concurrency_limit(monkeypatch):
+    fake = FakeLLM({"src/a.js": 0.03, "src/b.js": 0.01, "src/flaky.js": 0.0, "src/c.js": 0.02})
+    monkeypatch.setattr(parallel_generator, "llm_clients", fake)
+    generator = ParallelAppGenerator(api_key="x", max_concurrency=2)
+
+    events = [event async for event in generator.stream("demo")]
+
+    assert events[0]["type"] == "plan"
+    assert [e["file"]["path"] for e in events[1:]][0] != "src/a.js"
+    assert fake.peak == 2
+    # Truncation is continued from the partial output, not re-asked from scratch
+    assert fake.calls["src/flaky.js"] == 2
+
+    structure = ParallelAppGenerator.assemble(events[0]["plan"], {e["file"]["path"]: e["file"] for e in events[1:]})
+    assert [f["path"] for f in structure["files"]] == ["src/a.js", "src/b.js", "src/flaky.js", "src/c.js"]
+    assert structure["files"][0]["content"] == "// src/a.js"
+    assert structure["files"][2]["content"] == "// src/flaky.js\nexport const a = 1;"
+
+
+@pytest.mark.asyncio
+async def test_file_that_never_completes_degrades_to_placeholder(monkeypatch):
+    fake = FakeLLM({"src/a.js": 0.0, "src/broken.js": 0.0})
+    monkeypatch.setattr(parallel_generator, "llm_clients", fake)
+    monkeypatch.setattr(parallel_generator, "MAX_CONTINUATIONS", 1)
+
+    structure = await ParallelAppGenerator(api_key="x").generate("demo")
+
+    assert fake.calls["src/broken.js"] == 2
+    by_path = {f["path"]: f for f in structure["files"]}
+    assert by_path["src/a.js"]["content"] == "// src/a.js"
+    assert "Generation failed for src/broken.js" in by_path["src/broken.js"]["content"]
+    assert [e["path"] for e in structure["errors"]] == ["src/broken.js"]
+
+
+@pytest.mark.asyncio
+async def test_stream_resets_client_before_fallback_after_partial_failure(monkeypatch):
+    from ai_builder_service_v2 import AIBuilderServiceV2
+
+    class FailingGenerator:
+        async def stream(self, prompt, context=""):
+            yield {"type": "plan", "plan": {"files": [{"path": "src/a.js"}, {"path": "src/b.js"}]}}
+            yield {"type": "file", "file": {"path": "src/a.js", "content": "real", "language": "javascript"}}
+            raise RuntimeError("provider went away")
+
+    builder = AIBuilderServiceV2()
+    builder.parallel = True
+    monkeypatch.setattr(builder, "_parallel_generator", lambda: FailingGenerator())
+
+    events = [e async for e in builder.stream_app_structure("a todo app", {}, use_cache=False)]
+    types = [e["type"] for e in events]
+
+    reset_at = types.index("reset")
+    assert types[:reset_at] == ["plan", "file"]
+    fallback = events[-1]["app_structure"]
+    # Everything after the reset is exactly the fallback app the server saves
+    assert [e["file"] for e in events[reset_at + 1:-1]] == fallback["files"]
+
+
+@pytest.mark.asyncio
+async def test_stream_app_single_call_parses_files_and_adds_post_processed_ones():
+    from parallel_generator import stream_app
+
+    async def model_stream():
+        text = json.dumps({"app_name": "Todo", "files": [{"path": "src/App.js", "content": "app"}]})
+        for i in range(0, len(text), 7):
+            yield text[i:i + 7]
+
+    def finalize(text):
+        structure = json.loads(text)
+        structure["files"].append({"path": ".env.example", "content": "KEY="})
+        return structure
+
+    events = [e async for e in stream_app(
+        "k", False, None, "a todo app", "",
+        model_stream=model_stream,
+        finalize=finalize,
+        post_process=lambda s: s,
+        fallback=lambda: pytest.fail("no fallback expected"),
+    )]
+
+    assert [e["type"] for e in events] == ["file", "file", "structure"]
+    assert [e["file"]["path"] for e in events[:2]] == ["src/App.js", ".env.example"]
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+
+import pytest
+
+from password_hasher import PasswordHasher, PasswordHasherSaturated
+
+
+class BlockingContext:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def hash(self, password):
+        self.release.wait(timeout=5)
+        return f"hashed:{password}"
+
+    def verify(self, plain, hashed):
+        return hashed == f"hashed:{plain}"
+
+
+@pytest.mark.asyncio
+async def test_hasher_rejects_when_saturated():
+    context = BlockingContext()
+    hasher = PasswordHasher(context, max_workers=1, max_queue=1)
+
+    running = asyncio.create_task(hasher.hash("a"))
+    queued = asyncio.create_task(hasher.hash("b"))
+    await asyncio.sleep(0.05)
+
+    assert hasher.stats()["in_flight"] == 2
+    assert hasher.queue_depth == 1
+    with pytest.raises(PasswordHasherSaturated):
+        await hasher.hash("c")
+
+    context.release.set()
+    assert await running == "hashed:a"
+    assert await queued == "hashed:b"
+    assert await hasher.verify("a", "hashed:a") is True
+
+    stats = hasher.stats()
+    assert stats["rejected"] == 1
+    assert stats["in_flight"] == 0
+    hasher.shutdown()
@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import FakeCollection
+from project_file_store import ProjectFileStore, content_hash, manifest_entry, manifest_root_hash
+
+pytestmark = pytest.mark.usefixtures("plain_update_ops")
+
+
+class FakeProjectsCollection(FakeCollection):
+    """Adds the positional manifest rewrite and the counter refresh pipeline"""
+
+    def __init__(self):
+        super().__init__(key="project_id")
+        self.updates = []
+
+    async def update_one(self, query, update, upsert=False):
+        self.updates.append((query, update))
+        project = self._first({"project_id": query["project_id"]})
+        if project is None:
+            return SimpleNamespace(matched_count=0)
+        if "file_manifest.path" in query:
+            for i, entry in enumerate(project["file_manifest"]):
+                if entry["path"] == query["file_manifest.path"]:
+                    project["file_manifest"][i] = update["$set"]["file_manifest.$"]
+                    return SimpleNamespace(matched_count=1)
+            return SimpleNamespace(matched_count=0)
+        if isinstance(update, list):
+            project["file_count"] = len(project["file_manifest"])
+            project["total_size"] = sum(e["size"] for e in project["file_manifest"])
+            project.pop("root_hash", None)
+            return SimpleNamespace(matched_count=1)
+        return await super().update_one(query, update, upsert)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.file_blobs = FakeCollection(key="blob_hash")
+        self.projects = FakeProjectsCollection()
+        self.project_snapshots = FakeCollection()
+
+
+BOILERPLATE = [
+    {"path": "vercel.json", "content": '{"version": 2}', "language": "json"},
+    {"path": ".env.example", "content": "MONGO_URL=mongodb://localhost:27017\n", "language": "env"},
+]
+
+
+@pytest.mark.asyncio
+async def test_identical_files_are_stored_once():
+    db = FakeDatabase()
+    store = ProjectFileStore(db)
+
+    first = await store.store_files(BOILERPLATE + [{"path": "src/App.js", "content": "a"}])
+    second = await store.store_files(BOILERPLATE + [{"path": "src/App.js", "content": "b"}])
+
+    assert len(db.file_blobs.documents) == 4
+    assert first[0]["hash"] == second[0]["hash"] == content_hash('{"version": 2}')
+
+    files = await store.load_files(second)
+    assert files[0] == BOILERPLATE[0]
+    assert files[2] == {"path": "src/App.js", "content": "b"}
+
+
+@pytest.mark.asyncio
+async def test_write_file_rewrites_single_manifest_entry():
+    db = FakeDatabase()
+    store = ProjectFileStore(db)
+    manifest = await store.store_files(BOILERPLATE)
+    db.projects.docs.append({"project_id": "proj_1", "file_manifest": manifest, "root_hash": "stale"})
+    query = {"project_id": "proj_1"}
+
+    await store.write_file(query, "vercel.json", '{"version": 3}', language="json")
+    await store.write_file(query, "src/App.js", "new", language="js")
+
+    project = await store.hydrate(dict(db.projects.documents["proj_1"]))
+    contents = {f["path"]: f["content"] for f in project["files"]}
+    assert contents == {
+        "vercel.json": '{"version": 3}',
+        ".env.example": BOILERPLATE[1]["content"],
+        "src/App.js": "new",
+    }
+    positional = db.projects.updates[0][1]["$set"]
+    assert list(positional) == ["file_manifest.$"]
+    stored = db.projects.documents["proj_1"]
+    assert stored["file_count"] == 3 and "root_hash" not in stored
+    # Positional rewrite (or push) plus one counter refresh per write
+    assert len(db.projects.updates) == 5
+
+
+def test_manifest_size_counts_utf8_bytes():
+    entry = manifest_entry("README.md", "héllo ✓")
+    assert entry["size"] == len("héllo ✓".encode("utf-8")) == 10
+    assert entry["hash"] == content_hash("héllo ✓")
+
+
+def test_root_hash_ignores_manifest_order_and_tracks_content():
+    a = [{"path": "src/App.js", "hash": "h1"}, {"path": "src/lib/api.js", "hash": "h2"}, {"path": "README.md", "hash": "h3"}]
+    shuffled = [a[2], a[0], a[1]]
+    edited = [a[0], {"path": "src/lib/api.js", "hash": "h9"}, a[2]]
+    moved = [a[0], {"path": "src/api.js", "hash": "h2"}, a[2]]
+
+    assert manifest_root_hash(a) == manifest_root_hash(shuffled)
+    assert len({manifest_root_hash(m) for m in (a, edited, moved)}) == 3
+
+
+@pytest.mark.asyncio
+async def test_collect_garbage_sweeps_only_idle_unreferenced_blobs():
+    db = FakeDatabase()
+    store = ProjectFileStore(db)
+    old = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    for name in ("project", "keyframe", "delta", "orphan", "fresh-orphan", "legacy-orphan"):
+        db.file_blobs.docs.append({"blob_hash": name, "content": name, "size": len(name),
+                                   "created_at": old, "referenced_at": old})
+    db.file_blobs.documents["fresh-orphan"]["referenced_at"] = datetime.now(timezone.utc).isoformat()
+    del db.file_blobs.documents["legacy-orphan"]["referenced_at"]
+    db.projects.docs.append({"project_id": "p1", "file_manifest": [{"path": "a", "hash": "project"}]})
+    db.project_snapshots.docs = [
+        {"format": "keyframe", "manifest": [{"path": "a", "hash": "keyframe"}]},
+        {"format": "delta", "changed": [{"path": "a", "hash": "delta"}]},
+        {"format": "full", "files": [{"path": "a", "content": "orphan"}]},
+    ]
+
+    report = await store.collect_garbage(min_age_seconds=3600, batch_size=1)
+
+    assert report == {"blobs": 2, "bytes": len("orphan") + len("legacy-orphan")}
+    assert set(db.file_blobs.documents) == {"project", "keyframe", "delta", "fresh-orphan"}
+
+    # Storing content again renews the grace period of the existing blob
+    await store.put_blobs({"project": "project"})
+    assert db.file_blobs.documents["project"]["referenced_at"] > old
+
+
+@pytest.mark.asyncio
+async def test_put_blobs_recreates_a_blob_swept_since_it_was_last_stored():
+    db = FakeDatabase()
+    store = ProjectFileStore(db)
+
+    assert await store.put_blobs({content_hash("x"): "x", content_hash("y"): "y"}) == 2
+    # The sweep removes "x" just before a manifest references it again
+    await db.file_blobs.delete_many({"blob_hash": content_hash("x")})
+
+    assert await store.put_blobs({content_hash("x"): "x", content_hash("y"): "y"}) == 1
+    assert (await store.load_blobs([content_hash("x")])) == {content_hash("x"): "x"}
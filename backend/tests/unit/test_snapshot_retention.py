@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import FakeCollection, FakeCursor
+from periodic_task import LeaseLost, MongoLease
+from snapshot_retention import RetentionPolicy, SnapshotRetentionEngine
+
+NOW = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def _snap(snapshot_id, age, auto=True):
+    return {"snapshot_id": snapshot_id, "created_at": (NOW - age).isoformat(), "auto_created": auto}
+
+
+def test_policy_keeps_latest_manual_and_one_per_bucket():
+    policy = RetentionPolicy(keep_latest=2, hourly_hours=24, daily_days=7)
+    snapshots = [
+        _snap("latest-1", timedelta(minutes=1)),
+        _snap("latest-2", timedelta(minutes=2)),
+        _snap("hour-a", timedelta(minutes=5)),    # newest of the 11:00 bucket
+        _snap("hour-b", timedelta(minutes=10)),   # same hour, dropped
+        _snap("manual", timedelta(minutes=15), auto=False),
+        _snap("day-a", timedelta(days=2)),
+        _snap("day-b", timedelta(days=2, minutes=30)),
+        _snap("ancient", timedelta(days=40)),
+    ]
+    assert policy.select_deletions(snapshots, NOW) == ["hour-b", "day-b", "ancient"]
+
+
+class FakeSnapshots(FakeCollection):
+    async def distinct(self, key):
+        return sorted({d[key] for d in self.docs})
+
+    def aggregate(self, pipeline):
+        ids = pipeline[0]["$match"]["snapshot_id"]["$in"]
+        return FakeCursor([{"_id": None, "bytes": 100 * len(ids)}])
+
+
+class FakeVersionControl:
+    def __init__(self):
+        self.compacted = []
+
+    async def compact_before_delete(self, project_id, delete_ids):
+        self.compacted.append((project_id, list(delete_ids)))
+        return {"promoted": 1, "folded": 0}
+
+
+@pytest.mark.asyncio
+async def test_engine_compacts_then_deletes_in_batches():
+    now = datetime.now(timezone.utc)
+    docs = [
+        {"project_id": "p1", "snapshot_id": f"s{i}", "auto_created": True,
+         "created_at": (now - timedelta(days=60, minutes=i)).isoformat()}
+        for i in range(5)
+    ]
+    db = SimpleNamespace(project_snapshots=FakeSnapshots(docs))
+    version_control = FakeVersionControl()
+    engine = SnapshotRetentionEngine(
+        db, version_control, policy=RetentionPolicy(keep_latest=2), interval_seconds=60, batch_size=2
+    )
+
+    report = await engine.run_once()
+
+    assert version_control.compacted == [("p1", ["s2", "s3", "s4"])]
+    assert [d["snapshot_id"] for d in db.project_snapshots.docs] == ["s0", "s1"]
+    assert report["deleted"] == 3 and report["snapshot_bytes_deleted"] == 300 and report["promoted"] == 1
+    assert engine.stats()["snapshots_deleted"] == 3 and engine.stats()["runs"] == 1
+
+
+@pytest.mark.asyncio
+async def test_only_the_lease_holder_runs_retention():
+    db = SimpleNamespace(project_snapshots=FakeSnapshots([]), job_leases=FakeCollection(key="_id"))
+    first, second = (
+        SnapshotRetentionEngine(db, FakeVersionControl(), interval_seconds=60, lease=MongoLease(db, "retention", 60))
+        for _ in range(2)
+    )
+
+    assert await first.lease.acquire()
+    await second._run_leased()
+    assert second.runs == 0 and second.stats()["skipped_not_leader"] == 1
+
+    # The holder renews freely; once its lease lapses and another worker takes it, it stops
+    await first.keep_lease()
+    db.job_leases.docs[0]["expires_at"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+    await second._run_leased()
+    assert second.runs == 1
+    db.job_leases.docs[0]["expires_at"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+    assert await second.lease.acquire()
+    with pytest.raises(LeaseLost):
+        await first.keep_lease()
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from services.sse import HEARTBEAT, SSEHub
+
+
+async def _collect(channel, after=0):
+    return [chunk async for chunk in channel.subscribe(after)]
+
+
+@pytest.mark.asyncio
+async def test_queued_events_are_coalesced_and_resumable():
+    hub = SSEHub()
+    release = asyncio.Event()
+
+    async def produce(channel):
+        for i in range(3):
+            await channel.publish({"type": "file", "index": i})
+        await release.wait()
+        await channel.publish({"type": "complete"})
+
+    channel = hub.start(produce, owner="user-1")
+    await asyncio.sleep(0)
+    release.set()
+    chunks = await _collect(channel)
+
+    body = b"".join(chunks)
+    assert body.count(b"data: ") == 4
+    assert len(chunks) < 4
+    assert f"id: {channel.channel_id}:1\n".encode() in body
+
+    resumed, after = hub.find(f"{channel.channel_id}:2", owner="user-1")
+    replay = b"".join(await _collect(resumed, after))
+    assert b'"index": 2' in replay and b'"index": 1' not in replay
+    assert hub.find(f"{channel.channel_id}:2", owner="someone-else") is None
+
+
+@pytest.mark.asyncio
+async def test_idle_stream_sends_heartbeat_comments():
+    hub = SSEHub()
+    hub.heartbeat_seconds = 0.01
+    release = asyncio.Event()
+
+    async def produce(channel):
+        await release.wait()
+
+    channel = hub.start(produce)
+    subscriber = channel.subscribe()
+    assert await subscriber.__anext__() == HEARTBEAT
+    release.set()
+    await subscriber.aclose()
+    await hub.aclose()
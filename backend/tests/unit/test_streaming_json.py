@@ -0,0 +1,22 @@
+from streaming_json import FilesArrayParser
+
+
+def test_files_are_emitted_as_each_object_closes():
+    text = (
+        '```json\n{"app_name": "Demo", "meta": {"files": [{"path": "ignored"}]}, "files": ['
+        '{"path": "src/App.js", "content": "const s = \\"}]{\\"; export default s;", "language": "javascript"},'
+        '{"path": "src/index.css", "content": "body { margin: 0 }"}'
+        '], "description": "x"}\n```'
+    )
+    parser = FilesArrayParser()
+    emitted = []
+    for i in range(0, len(text), 7):
+        emitted.append(parser.feed(text[i:i + 7]))
+
+    files = [f for batch in emitted for f in batch]
+    assert [f["path"] for f in files] == ["src/App.js", "src/index.css"]
+    assert files[0]["content"] == 'const s = "}]{"; export default s;'
+    # The first file is available before the second one has even started streaming
+    first_batch = next(i for i, batch in enumerate(emitted) if batch)
+    assert first_batch * 7 < text.index("src/index.css")
+    assert parser.text == text
@@ -0,0 +1,138 @@
+import pytest
+
+from conftest import FakeCollection
+from project_file_store import manifest_entry
+from version_control_service import VersionControlService
+
+
+class FakeFileStore:
+    def __init__(self):
+        self.blobs = {}
+
+    async def put_blobs(self, blobs):
+        self.blobs.update(blobs)
+        return len(blobs)
+
+    async def load_files(self, manifest):
+        return [{"path": e["path"], "content": self.blobs[e["hash"]]} for e in manifest]
+
+
+class FakeDB:
+    def __init__(self):
+        self.project_snapshots = FakeCollection()
+
+
+def _files(version, count=5):
+    files = [{"path": f"src/f{i}.js", "content": f"// file {i}"} for i in range(count)]
+    files[0]["content"] = f"// edited {version}"
+    return files
+
+
+@pytest.mark.asyncio
+async def test_deltas_store_only_changes_and_rebuild_from_keyframe():
+    db = FakeDB()
+    service = VersionControlService(db, file_store=FakeFileStore(), keyframe_interval=3)
+
+    versions = [_files(v) for v in range(4)]
+    versions[2] = versions[2][:-1]  # one file removed in v2
+    for i, files in enumerate(versions):
+        await service.create_snapshot("p1", "u1", files, message=f"v{i}")
+        db.project_snapshots.docs[-1]["created_at"] = f"2024-01-01T00:00:0{i}"
+
+    docs = db.project_snapshots.docs
+    assert [d["format"] for d in docs] == ["keyframe", "delta", "delta", "keyframe"]
+    assert [e["path"] for e in docs[1]["changed"]] == ["src/f0.js"]
+    assert docs[2]["removed"] == ["src/f4.js"]
+
+    for doc, files in zip(docs, versions):
+        assert await service.materialize(doc) == files
+
+    # A project manifest dedups against the latest snapshot without touching bodies
+    manifest = [manifest_entry(f["path"], f["content"]) for f in versions[3]]
+    result = await service.create_snapshot("p1", "u1", manifest=manifest)
+    assert result["is_new"] is False
+
+    comparison = await service.compare_snapshots(docs[0]["snapshot_id"], docs[2]["snapshot_id"])
+    assert comparison["modified_files"] == ["src/f0.js"]
+    assert comparison["removed_files"] == ["src/f4.js"]
+
+
+@pytest.mark.asyncio
+async def test_deleting_a_parent_promotes_its_child():
+    db = FakeDB()
+    service = VersionControlService(db, file_store=FakeFileStore(), keyframe_interval=10)
+
+    versions = [_files(v) for v in range(3)]
+    for i, files in enumerate(versions):
+        await service.create_snapshot("p1", "u1", files, auto=True)
+        db.project_snapshots.docs[-1]["created_at"] = f"2024-01-01T00:00:0{i}"
+
+    await service.delete_old_snapshots("p1", keep_count=2)
+
+    docs = sorted(db.project_snapshots.docs, key=lambda d: d["created_at"])
+    assert [d["format"] for d in docs] == ["keyframe", "delta"]
+    assert docs[1]["keyframe_id"] == docs[0]["snapshot_id"]
+    assert await service.materialize(docs[1]) == versions[2]
+
+
+@pytest.mark.asyncio
+async def test_diff_streams_only_requested_paths_with_caps():
+    db = FakeDB()
+    store = FakeFileStore()
+    service = VersionControlService(db, file_store=store, keyframe_interval=10)
+
+    before = [{"path": "src/App.js", "content": "a\nb\nc\n"}, {"path": "big.txt", "content": "x" * 50}]
+    after = [{"path": "src/App.js", "content": "a\nB\nc\n"}, {"path": "big.txt", "content": "y" * 50},
+             {"path": "new.js", "content": "n\n"}]
+    first = await service.create_snapshot("p1", "u1", before)
+    second = await service.create_snapshot("p1", "u1", after)
+
+    async def no_blob_reads(hashes):
+        raise AssertionError("summary must not read bodies")
+
+    store.load_blobs = no_blob_reads
+    diff = await service.resolve_diff("p1", first["snapshot_id"], second["snapshot_id"])
+    assert [e["path"] for e in diff["added"]] == ["new.js"]
+    assert sorted(e["path"] for e in diff["modified"]) == ["big.txt", "src/App.js"]
+    assert await service.resolve_diff("other", first["snapshot_id"], second["snapshot_id"]) is None
+
+    async def load_blobs(hashes):
+        return {h: store.blobs[h] for h in hashes}
+
+    store.load_blobs = load_blobs
+    patch = "".join([c async for c in service.iter_unified_diff(diff, max_file_bytes=20)])
+    assert "-b\n+B\n" in patch
+    assert "file too large to diff (50 -> 50 bytes)" in patch
+    assert "--- /dev/null\n+++ b/new.js" in patch
+
+    only_app = "".join([c async for c in service.iter_unified_diff(diff, paths=["src/App.js"])])
+    assert "new.js" not in only_app and "a/src/App.js" in only_app
+
+    truncated = "".join([c async for c in service.iter_unified_diff(diff, max_total_bytes=60)])
+    assert truncated.endswith("request fewer paths\n")
+
+
+@pytest.mark.asyncio
+async def test_deleting_middle_deltas_folds_them_into_the_survivor():
+    db = FakeDB()
+    service = VersionControlService(db, file_store=FakeFileStore(), keyframe_interval=10)
+
+    versions = [_files(v) for v in range(4)]
+    versions[1][1]["content"] = "// touched in v1 only"
+    versions[2] = versions[2][:-1]
+    versions[3] = versions[3][:-1]
+    versions[3][1]["content"] = "// touched in v1 only"
+    for i, files in enumerate(versions):
+        await service.create_snapshot("p1", "u1", files, auto=True)
+        db.project_snapshots.docs[-1]["created_at"] = f"2024-01-01T00:00:0{i}"
+
+    ids = [d["snapshot_id"] for d in db.project_snapshots.docs]
+    report = await service.compact_before_delete("p1", ids[1:3])
+    await db.project_snapshots.delete_many({"snapshot_id": {"$in": ids[1:3]}})
+
+    assert report == {"promoted": 0, "folded": 1}
+    survivor = next(d for d in db.project_snapshots.docs if d["snapshot_id"] == ids[3])
+    assert survivor["format"] == "delta"
+    assert survivor["parent_id"] == ids[0]
+    assert survivor["chain_depth"] == 1
+    assert await service.materialize(survivor) == versions[3]
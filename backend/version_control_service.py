@@ -2,12 +2,16 @@
 Version Control & Snapshot System
 Like Replit's snapshot engine - instant rollback capability
 """
+import asyncio
+import difflib
 import json
 import logging
-from typing import Dict, List, Optional
+import os
+from typing import AsyncIterator, Dict, List, Optional
 from datetime import datetime, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
-import hashlib
+
+from project_file_store import manifest_entry, manifest_root_hash
 
 logger = logging.getLogger(__name__)
 
@@ -15,17 +19,27 @@ logger = logging.getLogger(__name__)
 class VersionControlService:
     """Manage project versions and snapshots"""
     
-    def __init__(self, db):
+    # Snapshot formats: "full" embeds `files` (legacy, or no file store); "keyframe" holds the
+    # complete blob manifest; "delta" holds only entries changed/removed relative to `parent_id`.
+    CHAIN_PROJECTION = {"_id": 0, "files": 0}
+    SUMMARY_PROJECTION = {"_id": 0, "files": 0, "manifest": 0, "changed": 0, "removed": 0}
+
+    def __init__(self, db, file_store=None, keyframe_interval: Optional[int] = None):
         self.db = db
         self.snapshots_collection = db.project_snapshots
+        # Optional ProjectFileStore; projects then hold a blob manifest instead of `files`
+        # and snapshots are stored as keyframes + deltas over the same blobs
+        self.file_store = file_store
+        self.keyframe_interval = max(1, keyframe_interval or int(os.getenv("SNAPSHOT_KEYFRAME_INTERVAL", "20")))
     
     async def create_snapshot(
         self,
         project_id: str,
         user_id: str,
-        files: List[Dict],
+        files: Optional[List[Dict]] = None,
         message: Optional[str] = None,
-        auto: bool = False
+        auto: bool = False,
+        manifest: Optional[List[Dict]] = None
     ) -> Dict:
         """
         Create a snapshot of current project state
@@ -36,19 +50,30 @@ class VersionControlService:
             files: Current project files
             message: Optional snapshot message
             auto: Whether this is an automatic snapshot
+            manifest: The project's blob manifest; used instead of `files` (requires a file store)
+                so the snapshot never reads or re-hashes file bodies
             
         Returns:
             Snapshot information
         """
         try:
-            # Generate snapshot ID from file content hash
-            content_hash = self._generate_content_hash(files)
+            blobs: Dict[str, str] = {}
+            if manifest is None:
+                manifest = []
+                for f in files or []:
+                    content = f.get("content", "") or ""
+                    entry = manifest_entry(f.get("path", ""), content, f.get("language"))
+                    blobs[entry["hash"]] = content
+                    manifest.append(entry)
+
+            # Generate snapshot ID from the Merkle root of per-file hashes
+            content_hash = manifest_root_hash(manifest)
             
             # Check if identical snapshot exists
-            existing = await self.snapshots_collection.find_one({
-                "project_id": project_id,
-                "content_hash": content_hash
-            })
+            existing = await self.snapshots_collection.find_one(
+                {"project_id": project_id, "content_hash": content_hash},
+                {"_id": 0, "snapshot_id": 1}
+            )
             
             if existing:
                 logger.info(f"Identical snapshot already exists: {existing['snapshot_id']}")
@@ -63,29 +88,36 @@ class VersionControlService:
             now = datetime.now(timezone.utc)
             snapshot_id = f"snap_{now.strftime('%Y%m%d_%H%M%S')}_{content_hash[:8]}"
             
+            if self.file_store:
+                await self.file_store.put_blobs(blobs)
+                storage = await self._chain_fields(project_id, snapshot_id, manifest)
+            else:
+                storage = {"format": "full", "files": files or []}
+
             snapshot_doc = {
                 "snapshot_id": snapshot_id,
                 "project_id": project_id,
                 "user_id": user_id,
-                "files": files,
+                **storage,
                 "content_hash": content_hash,
                 "message": message or ("Auto-save" if auto else "Manual snapshot"),
                 "auto_created": auto,
                 "created_at": now.isoformat(),
-                "file_count": len(files),
-                "total_size": sum(len(f.get("content", "")) for f in files)
+                "file_count": len(manifest),
+                "total_size": sum(e.get("size", 0) for e in manifest)
             }
             
             await self.snapshots_collection.insert_one(snapshot_doc)
             
-            logger.info(f"Created snapshot: {snapshot_id} for project {project_id}")
+            logger.info(f"Created {snapshot_doc['format']} snapshot: {snapshot_id} for project {project_id}")
             
             return {
                 "success": True,
                 "snapshot_id": snapshot_id,
                 "message": "Snapshot created successfully",
                 "is_new": True,
-                "created_at": now.isoformat()
+                "created_at": now.isoformat(),
+                "format": snapshot_doc["format"]
             }
             
         except Exception as e:
@@ -95,6 +127,167 @@ class VersionControlService:
                 "error": str(e)
             }
     
+    async def _chain_fields(self, project_id: str, snapshot_id: str, manifest: List[Dict]) -> Dict:
+        """Store a delta against the latest snapshot, or a keyframe every `keyframe_interval` snapshots"""
+        latest = await self.snapshots_collection.find_one(
+            {"project_id": project_id},
+            self.CHAIN_PROJECTION,
+            sort=[("created_at", -1)]
+        )
+        if (
+            latest
+            and latest.get("format") in ("keyframe", "delta")
+            and latest.get("chain_depth", 0) + 1 < self.keyframe_interval
+        ):
+            parent = {e["path"]: e for e in await self.load_manifest(latest)}
+            current = {e["path"] for e in manifest}
+            changed = [e for e in manifest if parent.get(e["path"], {}).get("hash") != e["hash"]]
+            return {
+                "format": "delta",
+                "parent_id": latest["snapshot_id"],
+                "keyframe_id": latest["keyframe_id"],
+                "chain_depth": latest.get("chain_depth", 0) + 1,
+                "changed": changed,
+                "removed": [path for path in parent if path not in current],
+                "stored_size": sum(e.get("size", 0) for e in changed),
+            }
+        return {
+            "format": "keyframe",
+            "parent_id": latest["snapshot_id"] if latest else None,
+            "keyframe_id": snapshot_id,
+            "chain_depth": 0,
+            "manifest": manifest,
+            "stored_size": sum(e.get("size", 0) for e in manifest),
+        }
+
+    async def load_manifest(self, snapshot: Dict) -> List[Dict]:
+        """
+        Materialise a snapshot's manifest ({path, hash, size[, language]} entries)
+
+        Deltas are resolved by walking parent links back to their keyframe; the whole
+        chain is fetched with one query (bodies excluded) and applied oldest-first.
+        """
+        snapshot_format = snapshot.get("format", "full")
+        if snapshot_format == "full":
+            return [
+                manifest_entry(f.get("path", ""), f.get("content", "") or "", f.get("language"))
+                for f in snapshot.get("files", [])
+            ]
+        if snapshot_format == "keyframe":
+            return snapshot.get("manifest", [])
+
+        chain = {
+            doc["snapshot_id"]: doc
+            for doc in await self.snapshots_collection.find(
+                {"project_id": snapshot["project_id"], "keyframe_id": snapshot["keyframe_id"]},
+                self.CHAIN_PROJECTION
+            ).to_list(length=None)
+        }
+        deltas = []
+        node = snapshot
+        while node.get("format") == "delta":
+            deltas.append(node)
+            parent_id = node.get("parent_id")
+            node = chain.get(parent_id) or await self.snapshots_collection.find_one(
+                {"snapshot_id": parent_id}, {"_id": 0}
+            )
+            if node is None:
+                raise ValueError(f"Snapshot chain broken at {parent_id}")
+
+        by_path = {e["path"]: e for e in await self.load_manifest(node)}
+        for delta in reversed(deltas):
+            for path in delta.get("removed", []):
+                by_path.pop(path, None)
+            for entry in delta.get("changed", []):
+                by_path[entry["path"]] = entry
+        return list(by_path.values())
+
+    async def materialize(self, snapshot: Dict) -> List[Dict]:
+        """Full `files` list (path/content/language) for any snapshot format"""
+        if snapshot.get("format", "full") == "full":
+            return snapshot.get("files", [])
+        return await self.file_store.load_files(await self.load_manifest(snapshot))
+
+    async def _promote_to_keyframe(self, snapshot: Dict) -> None:
+        """Rewrite a delta as a keyframe so it no longer depends on its ancestors"""
+        manifest = await self.load_manifest(snapshot)
+        old_keyframe = snapshot["keyframe_id"]
+        depth = snapshot.get("chain_depth", 0)
+        await self.snapshots_collection.update_one(
+            {"snapshot_id": snapshot["snapshot_id"]},
+            {
+                "$set": {
+                    "format": "keyframe",
+                    "keyframe_id": snapshot["snapshot_id"],
+                    "chain_depth": 0,
+                    "manifest": manifest,
+                    "stored_size": sum(e.get("size", 0) for e in manifest),
+                },
+                "$unset": {"changed": "", "removed": ""}
+            }
+        )
+        # Later links of the same chain now hang off the promoted snapshot
+        await self.snapshots_collection.update_many(
+            {"project_id": snapshot["project_id"], "keyframe_id": old_keyframe, "chain_depth": {"$gt": depth}},
+            {"$set": {"keyframe_id": snapshot["snapshot_id"]}, "$inc": {"chain_depth": -depth}}
+        )
+
+    async def compact_before_delete(self, project_id: str, delete_ids: List[str]) -> Dict[str, int]:
+        """
+        Keep delta chains valid before `delete_ids` are removed
+
+        A surviving delta whose parent is a deleted delta absorbs the parent's changes and
+        re-points to the grandparent; one whose parent is a deleted keyframe (or whose chain
+        cannot be folded) is promoted to a keyframe.
+        """
+        doomed = set(delete_ids)
+        dependents = await self.snapshots_collection.find(
+            {
+                "project_id": project_id,
+                "format": "delta",
+                "parent_id": {"$in": delete_ids},
+                "snapshot_id": {"$nin": delete_ids},
+            },
+            self.CHAIN_PROJECTION
+        ).sort("created_at", 1).to_list(length=None)
+
+        folded = promoted = 0
+        for snapshot in dependents:
+            changed = {e["path"]: e for e in snapshot.get("changed", [])}
+            removed = set(snapshot.get("removed", []))
+            parent_id = snapshot["parent_id"]
+            hops = 0
+            while parent_id in doomed:
+                parent = await self.snapshots_collection.find_one({"snapshot_id": parent_id}, self.CHAIN_PROJECTION)
+                if not parent or parent.get("format") != "delta":
+                    break
+                for entry in parent.get("changed", []):
+                    if entry["path"] not in changed and entry["path"] not in removed:
+                        changed[entry["path"]] = entry
+                removed |= {path for path in parent.get("removed", []) if path not in changed}
+                parent_id = parent.get("parent_id")
+                hops += 1
+
+            if parent_id in doomed:
+                # Re-read: an earlier promotion may have moved this snapshot to a new keyframe
+                fresh = await self.snapshots_collection.find_one(
+                    {"snapshot_id": snapshot["snapshot_id"]}, self.CHAIN_PROJECTION
+                )
+                await self._promote_to_keyframe(fresh or snapshot)
+                promoted += 1
+                continue
+            await self.snapshots_collection.update_one(
+                {"snapshot_id": snapshot["snapshot_id"]},
+                {"$set": {
+                    "parent_id": parent_id,
+                    "changed": list(changed.values()),
+                    "removed": sorted(removed),
+                    "stored_size": sum(e.get("size", 0) for e in changed.values()),
+                }, "$inc": {"chain_depth": -hops}}
+            )
+            folded += 1
+        return {"promoted": promoted, "folded": folded}
+
     async def list_snapshots(
         self,
         project_id: str,
@@ -104,7 +297,7 @@ class VersionControlService:
         try:
             snapshots = await self.snapshots_collection.find(
                 {"project_id": project_id},
-                {"files": 0}  # Exclude file content for listing
+                self.SUMMARY_PROJECTION  # Exclude file content and manifests for listing
             ).sort("created_at", -1).limit(limit).to_list(length=limit)
             
             return [
@@ -136,7 +329,8 @@ class VersionControlService:
         try:
             # Get current project state
             current_project = await self.db.projects.find_one(
-                {"project_id": project_id, "user_id": user_id}
+                {"project_id": project_id, "user_id": user_id},
+                {"_id": 0, "file_manifest": 1, "files": 1}
             )
             
             if not current_project:
@@ -145,13 +339,14 @@ class VersionControlService:
                     "error": "Project not found"
                 }
             
-            # Create safety snapshot of current state
+            # Create safety snapshot of current state (from the manifest when there is one)
             await self.create_snapshot(
                 project_id,
                 user_id,
                 current_project.get("files", []),
                 message="Auto-save before restore",
-                auto=True
+                auto=True,
+                manifest=current_project.get("file_manifest") if self.file_store else None
             )
             
             # Get target snapshot
@@ -168,15 +363,31 @@ class VersionControlService:
             
             # Restore files
             now = datetime.now(timezone.utc)
+            if self.file_store:
+                if snapshot.get("format", "full") == "full":
+                    manifest = await self.file_store.store_files(snapshot["files"])
+                else:
+                    # Blobs are already stored; only the manifest moves
+                    manifest = await self.load_manifest(snapshot)
+                file_fields = {"file_manifest": manifest, **self.file_store.manifest_stats(manifest)}
+                file_count = len(manifest)
+                unset = {"files": ""}
+            else:
+                file_fields = {"files": snapshot["files"]}
+                file_count = len(snapshot["files"])
+                unset = {}
+            update = {
+                "$set": {
+                    **file_fields,
+                    "updated_at": now.isoformat(),
+                    "last_restored_from": snapshot_id
+                }
+            }
+            if unset:
+                update["$unset"] = unset
             await self.db.projects.update_one(
                 {"project_id": project_id, "user_id": user_id},
-                {
-                    "$set": {
-                        "files": snapshot["files"],
-                        "updated_at": now.isoformat(),
-                        "last_restored_from": snapshot_id
-                    }
-                }
+                update
             )
             
             logger.info(f"Restored project {project_id} to snapshot {snapshot_id}")
@@ -185,7 +396,7 @@ class VersionControlService:
                 "success": True,
                 "message": "Project restored successfully",
                 "snapshot_id": snapshot_id,
-                "file_count": len(snapshot["files"])
+                "file_count": file_count
             }
             
         except Exception as e:
@@ -202,8 +413,8 @@ class VersionControlService:
     ) -> Dict:
         """Compare two snapshots and return differences"""
         try:
-            snapshot1 = await self.snapshots_collection.find_one({"snapshot_id": snapshot_id_1})
-            snapshot2 = await self.snapshots_collection.find_one({"snapshot_id": snapshot_id_2})
+            snapshot1 = await self.snapshots_collection.find_one({"snapshot_id": snapshot_id_1}, {"_id": 0})
+            snapshot2 = await self.snapshots_collection.find_one({"snapshot_id": snapshot_id_2}, {"_id": 0})
             
             if not snapshot1 or not snapshot2:
                 return {
@@ -211,8 +422,17 @@ class VersionControlService:
                     "error": "One or both snapshots not found"
                 }
             
-            files1 = {f["path"]: f["content"] for f in snapshot1["files"]}
-            files2 = {f["path"]: f["content"] for f in snapshot2["files"]}
+            if snapshot1.get("content_hash") and snapshot1.get("content_hash") == snapshot2.get("content_hash"):
+                return {
+                    "success": True,
+                    "added_files": [],
+                    "removed_files": [],
+                    "modified_files": [],
+                    "total_changes": 0
+                }
+            
+            files1 = {e["path"]: e["hash"] for e in await self.load_manifest(snapshot1)}
+            files2 = {e["path"]: e["hash"] for e in await self.load_manifest(snapshot2)}
             
             # Find changes
             added = [path for path in files2 if path not in files1]
@@ -237,26 +457,140 @@ class VersionControlService:
                 "error": str(e)
             }
     
+    async def resolve_diff(self, project_id: str, snapshot_id_1: str, snapshot_id_2: str) -> Optional[Dict]:
+        """
+        Load both snapshots of a project and classify changed paths by per-file hash
+
+        Returns None when either snapshot is missing; no file bodies are read.
+        """
+        snapshot1 = await self.snapshots_collection.find_one(
+            {"snapshot_id": snapshot_id_1, "project_id": project_id}, {"_id": 0}
+        )
+        snapshot2 = await self.snapshots_collection.find_one(
+            {"snapshot_id": snapshot_id_2, "project_id": project_id}, {"_id": 0}
+        )
+        if not snapshot1 or not snapshot2:
+            return None
+
+        manifest1 = {e["path"]: e for e in await self.load_manifest(snapshot1)}
+        manifest2 = {e["path"]: e for e in await self.load_manifest(snapshot2)}
+        return {
+            "snapshots": (snapshot1, snapshot2),
+            "manifests": (manifest1, manifest2),
+            "added": [
+                {"path": path, "size": e.get("size", 0)}
+                for path, e in manifest2.items() if path not in manifest1
+            ],
+            "removed": [
+                {"path": path, "size": e.get("size", 0)}
+                for path, e in manifest1.items() if path not in manifest2
+            ],
+            "modified": [
+                {"path": path, "old_size": e.get("size", 0), "new_size": manifest2[path].get("size", 0)}
+                for path, e in manifest1.items()
+                if path in manifest2 and e.get("hash") != manifest2[path].get("hash")
+            ],
+        }
+
+    async def _read_paths(self, snapshot: Dict, manifest: Dict[str, Dict], paths: List[str]) -> Dict[str, str]:
+        """Bodies for a few paths of one snapshot"""
+        if snapshot.get("format", "full") == "full":
+            wanted = set(paths)
+            return {f["path"]: f.get("content", "") or "" for f in snapshot.get("files", []) if f.get("path") in wanted}
+        hashes = {path: manifest[path]["hash"] for path in paths if path in manifest}
+        blobs = await self.file_store.load_blobs(hashes.values())
+        return {path: blobs.get(blob_hash, "") for path, blob_hash in hashes.items()}
+
+    async def iter_unified_diff(
+        self,
+        diff: Dict,
+        paths: Optional[List[str]] = None,
+        context: int = 3,
+        max_file_bytes: Optional[int] = None,
+        max_total_bytes: Optional[int] = None,
+        batch_size: int = 16
+    ) -> AsyncIterator[str]:
+        """
+        Stream a unified diff for `paths` (default: every changed path) of a resolved diff
+
+        Bodies are loaded a batch of paths at a time and diffed off the event loop.
+        Files over `max_file_bytes` are summarised; output stops after `max_total_bytes`.
+        """
+        max_file_bytes = max_file_bytes or int(os.getenv("SNAPSHOT_DIFF_MAX_FILE_BYTES", str(256 * 1024)))
+        max_total_bytes = max_total_bytes or int(os.getenv("SNAPSHOT_DIFF_MAX_TOTAL_BYTES", str(2 * 1024 * 1024)))
+        snapshot1, snapshot2 = diff["snapshots"]
+        manifest1, manifest2 = diff["manifests"]
+
+        changed = sorted(
+            [e["path"] for e in diff["added"]]
+            + [e["path"] for e in diff["removed"]]
+            + [e["path"] for e in diff["modified"]]
+        )
+        if paths is not None:
+            wanted = set(paths)
+            changed = [path for path in changed if path in wanted]
+
+        emitted = 0
+        for start in range(0, len(changed), batch_size):
+            batch = changed[start:start + batch_size]
+            small = [
+                path for path in batch
+                if max(manifest1.get(path, {}).get("size", 0), manifest2.get(path, {}).get("size", 0)) <= max_file_bytes
+            ]
+            old = await self._read_paths(snapshot1, manifest1, small)
+            new = await self._read_paths(snapshot2, manifest2, small)
+
+            for path in batch:
+                if path not in small:
+                    chunk = (
+                        f"diff --snapshot a/{path} b/{path}\n"
+                        f"# file too large to diff ({manifest1.get(path, {}).get('size', 0)} -> "
+                        f"{manifest2.get(path, {}).get('size', 0)} bytes)\n"
+                    )
+                else:
+                    chunk = await asyncio.to_thread(
+                        self._unified_diff, path, old.get(path), new.get(path), context
+                    )
+                if emitted + len(chunk) > max_total_bytes:
+                    yield f"# diff truncated after {emitted} bytes; request fewer paths\n"
+                    return
+                emitted += len(chunk)
+                yield chunk
+
+    @staticmethod
+    def _unified_diff(path: str, old: Optional[str], new: Optional[str], context: int) -> str:
+        lines = difflib.unified_diff(
+            (old or "").splitlines(keepends=True),
+            (new or "").splitlines(keepends=True),
+            fromfile=f"a/{path}" if old is not None else "/dev/null",
+            tofile=f"b/{path}" if new is not None else "/dev/null",
+            n=context
+        )
+        body = "".join(line if line.endswith("\n") else line + "\n" for line in lines)
+        return f"diff --snapshot a/{path} b/{path}\n{body}"
+
     async def auto_snapshot_on_change(
         self,
         project_id: str,
         user_id: str,
-        files: List[Dict]
+        files: Optional[List[Dict]] = None,
+        manifest: Optional[List[Dict]] = None
     ):
         """
         Automatically create snapshot on significant changes
-        Called after file edits
+        Called after file edits; pass the project's manifest to skip hashing bodies
         """
         # Only create auto-snapshot if files have changed significantly
         try:
             latest_snapshot = await self.snapshots_collection.find_one(
                 {"project_id": project_id},
+                {"_id": 0, "content_hash": 1},
                 sort=[("created_at", -1)]
             )
             
             if latest_snapshot:
                 # Check if content has changed
-                new_hash = self._generate_content_hash(files)
+                new_hash = manifest_root_hash(manifest) if manifest is not None else self._generate_content_hash(files or [])
                 if new_hash == latest_snapshot.get("content_hash"):
                     # No changes, skip snapshot
                     return
@@ -267,25 +601,18 @@ class VersionControlService:
                 user_id,
                 files,
                 message="Auto-save on edit",
-                auto=True
+                auto=True,
+                manifest=manifest
             )
             
         except Exception as e:
             logger.error(f"Auto-snapshot failed: {e}")
     
     def _generate_content_hash(self, files: List[Dict]) -> str:
-        """Generate hash of file contents for comparison"""
-        # Sort files by path for consistent hashing
-        sorted_files = sorted(files, key=lambda f: f.get("path", ""))
-        
-        # Concatenate all file contents
-        content = "".join(
-            f"{f.get('path', '')}:{f.get('content', '')}"
-            for f in sorted_files
+        """Merkle root of the files, hashing each body separately (no project-wide concatenation)"""
+        return manifest_root_hash(
+            manifest_entry(f.get("path", ""), f.get("content", "") or "") for f in files
         )
-        
-        # Generate SHA256 hash
-        return hashlib.sha256(content.encode()).hexdigest()
     
     async def delete_old_snapshots(
         self,
@@ -297,9 +624,10 @@ class VersionControlService:
         Keep manual snapshots, delete auto-snapshots
         """
         try:
-            # Get all snapshots
+            # Get all snapshots (metadata only)
             all_snapshots = await self.snapshots_collection.find(
-                {"project_id": project_id}
+                {"project_id": project_id},
+                {"_id": 0, "snapshot_id": 1, "auto_created": 1}
             ).sort("created_at", -1).to_list(length=None)
             
             # Keep all manual snapshots + latest auto-snapshots
@@ -310,6 +638,7 @@ class VersionControlService:
             if len(auto) > keep_count:
                 to_delete = auto[keep_count:]
                 delete_ids = [s["snapshot_id"] for s in to_delete]
+                await self.compact_before_delete(project_id, delete_ids)
                 
                 result = await self.snapshots_collection.delete_many({
                     "snapshot_id": {"$in": delete_ids}
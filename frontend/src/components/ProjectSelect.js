@@ -12,8 +12,8 @@ const ProjectSelect = ({ value, onChange, onNewProject }) => {
     let mounted = true;
     const load = async () => {
       try {
-        const res = await api.get('/projects');
-        if (mounted) setProjects(res.data || []);
+        const res = await api.get('/projects/page', { params: { limit: 100 } });
+        if (mounted) setProjects(res.data?.projects || []);
       } catch (e) {
         toast.error('Failed to load projects');
       } finally {
@@ -65,7 +65,7 @@ const SystemStatus = () => {
       .catch(() => setBackendOk(false));
     
     // Projects API
-    api.get('/projects')
+    api.get('/projects/page', { params: { limit: 1 } })
       .then(() => setProjectsOk(true))
       .catch(() => setProjectsOk(false));
     
@@ -137,6 +137,7 @@ const ImprovedBuilder = () => {
 
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
+      let buffer = '';
       let allFiles = [];
       let projectId = null;
 
@@ -144,8 +145,10 @@ const ImprovedBuilder = () => {
         const { done, value } = await reader.read();
         if (done) break;
 
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n');
+        // Events can arrive coalesced or split across reads; keep the trailing partial line
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
 
         for (const line of lines) {
           if (line.startsWith('data: ')) {
@@ -158,6 +161,10 @@ const ImprovedBuilder = () => {
                 const file = data.file;
                 allFiles.push(file);
                 addLog(`✅ Created: ${file.path} (${file.content?.length || 0} chars)`, 'file');
+              } else if (data.type === 'reset') {
+                // The files streamed so far came from a failed attempt; the replacement follows
+                allFiles = [];
+                addLog(`⚠️ ${data.message}`, 'error');
               } else if (data.type === 'complete') {
                 projectId = data.project_id;
                 setGeneratedFiles(data.files);
@@ -15,6 +15,8 @@ const Projects = () => {
   const navigate = useNavigate();
   const [projects, setProjects] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const user = JSON.parse(localStorage.getItem('user') || '{}');
 
   useEffect(() => {
@@ -24,9 +26,10 @@ const Projects = () => {
   const loadProjects = async () => {
     console.log('Loading projects...');
     try {
-      const response = await api.get('/projects');
-      console.log('Projects loaded:', response.data.length);
-      setProjects(response.data);
+      const response = await api.get('/projects/page', { params: { limit: 24 } });
+      console.log('Projects loaded:', response.data.projects.length);
+      setProjects(response.data.projects);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Failed to load projects:', error);
       if (isDevAuthEnabled()) {
@@ -37,10 +40,8 @@ const Projects = () => {
           description: 'Sample project for preview',
           prompt: 'Demo app preview',
           tech_stack: { frontend: 'React', backend: 'FastAPI', database: 'MongoDB' },
-          files: [
-            { path: 'src/App.js', content: 'export default function App(){return <div style={{padding:20}}><h1>Demo App</h1><p>Hello from Digital Ninja.</p></div>}', language: 'js' },
-            { path: 'src/index.css', content: 'body{font-family:sans-serif}', language: 'css' },
-          ],
+          file_count: 2,
+          total_size: 160,
           status: 'active',
           created_at: new Date().toISOString(),
           updated_at: new Date().toISOString(),
@@ -53,6 +54,21 @@ const Projects = () => {
     }
   };
 
+  const loadMoreProjects = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const response = await api.get('/projects/page', { params: { limit: 24, cursor: nextCursor } });
+      setProjects((prev) => [...prev, ...response.data.projects]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Failed to load more projects:', error);
+      toast.error('Failed to load more projects');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   if (loading) {
     return (
       <div className="flex items-center justify-center min-h-screen bg-[#1c1c1e]">
@@ -146,7 +162,7 @@ const Projects = () => {
                         <Calendar className="h-3 w-3" />
                         {new Date(project.created_at).toLocaleDateString()}
                       </span>
-                      <span>{project.files.length} files</span>
+                      <span>{project.file_count} files</span>
                     </div>
                   </div>
                   <div className="flex gap-2 mt-4">
@@ -162,6 +178,20 @@ const Projects = () => {
             ))}
           </div>
         )}
+
+        {nextCursor && (
+          <div className="flex justify-center mt-8">
+            <Button
+              variant="outline"
+              onClick={loadMoreProjects}
+              disabled={loadingMore}
+              className="text-white border-slate-600"
+              data-testid="load-more-projects"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </Button>
+          </div>
+        )}
       </div>
     </div>
   );